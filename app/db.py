@@ -1,15 +1,23 @@
+import json
 import os
+import re
 import sqlite3
-from typing import Optional, Tuple, List, Dict, Any
+from typing import Optional, Tuple, List, Dict, Any, Iterable, Callable, Sequence
 
-_DB_PATH = os.path.join(os.path.dirname(__file__), "books.sqlite3")
+from app import query_log
+from app.id_cache import GLOBAL, IdCache, id_cache, user_keys
+
+_DB_PATH = os.getenv("BOOKS_DB_PATH") or os.path.join(
+    os.path.dirname(__file__), "books.sqlite3"
+)
 _connection: Optional[sqlite3.Connection] = None
 
 
 def get_connection() -> sqlite3.Connection:
     global _connection
     if _connection is None:
-        _connection = sqlite3.connect(_DB_PATH, check_same_thread=False)
+        # Timed and slow-query logged when BOOKS_DB_SLOW_MS is set
+        _connection = query_log.connect(_DB_PATH, check_same_thread=False)
         _connection.row_factory = sqlite3.Row
         # Fast SQLite pragmas
         cur = _connection.cursor()
@@ -51,12 +59,22 @@ def init_db() -> None:
         """
     )
 
-    # Indexes to speed up queries
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_tg_user_id ON users(tg_user_id);")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_books_user_id ON books(user_id);")
+    # Indexes matched to the carousel query shapes: filter by user (and
+    # favourite flag), then walk (created_at DESC, id DESC) without a sort.
+    # users.tg_user_id is already covered by its UNIQUE autoindex.
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_books_created_id ON books(created_at DESC, id DESC);"
+    )
     cur.execute(
-        "CREATE INDEX IF NOT EXISTS idx_books_created_at ON books(created_at DESC);"
+        """
+        CREATE INDEX IF NOT EXISTS idx_books_user_created
+        ON books(user_id, created_at DESC, id DESC);
+        """
     )
+    # Superseded single-column indexes (prefixes of the composite ones)
+    cur.execute("DROP INDEX IF EXISTS idx_users_tg_user_id;")
+    cur.execute("DROP INDEX IF EXISTS idx_books_user_id;")
+    cur.execute("DROP INDEX IF EXISTS idx_books_created_at;")
 
     conn.commit()
 
@@ -72,6 +90,15 @@ def init_db() -> None:
     except Exception:
         pass
 
+    # Needs is_favorite, so only after the migration above
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_books_user_fav_created
+        ON books(user_id, is_favorite, created_at DESC, id DESC);
+        """
+    )
+    conn.commit()
+
     # --- Create m2m table for statuses ---
     cur.execute(
         """
@@ -84,12 +111,15 @@ def init_db() -> None:
         )
         """
     )
+    # (book_id, status) lookups use the UNIQUE autoindex
     cur.execute(
-        "CREATE INDEX IF NOT EXISTS idx_book_statuses_book_id ON book_statuses(book_id);"
-    )
-    cur.execute(
-        "CREATE INDEX IF NOT EXISTS idx_book_statuses_status ON book_statuses(status);"
+        """
+        CREATE INDEX IF NOT EXISTS idx_book_statuses_status_book
+        ON book_statuses(status, book_id);
+        """
     )
+    cur.execute("DROP INDEX IF EXISTS idx_book_statuses_book_id;")
+    cur.execute("DROP INDEX IF EXISTS idx_book_statuses_status;")
     conn.commit()
 
     # --- One-time backfill from legacy books.status ('in','read') ---
@@ -104,20 +134,267 @@ def init_db() -> None:
     except Exception:
         pass
 
+    _init_counters(conn)
+    _init_search(conn)
 
-def ensure_user(tg_user_id: int) -> int:
+    # --- Menu message tracking (persisted by app.menu_store) ---
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_menus (
+            tg_user_id INTEGER PRIMARY KEY,
+            message_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+    # --- FSM states/data (app.fsm_storage); updated_at is unix time for TTL ---
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL
+        )
+        """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states(updated_at);"
+    )
+    conn.commit()
+
+
+# --- Per-scope counters kept exact by triggers ---
+
+# Row user_id = 0 holds the library-wide totals (users.id starts at 1)
+GLOBAL_COUNTERS_ID = 0
+_STATUS_COUNTER_COLUMNS = {"in": "st_in", "read": "st_read"}
+
+_COUNTER_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS trg_books_counters_insert
+AFTER INSERT ON books
+BEGIN
+    INSERT OR IGNORE INTO user_counters (user_id) VALUES (NEW.user_id);
+    UPDATE user_counters
+    SET lib = lib + 1, fav = fav + (NEW.is_favorite = 1)
+    WHERE user_id IN (NEW.user_id, 0);
+END;
+
+-- BEFORE DELETE: the ON DELETE CASCADE on book_statuses runs before AFTER
+-- triggers, and by then the book row (and its owner) is gone
+CREATE TRIGGER IF NOT EXISTS trg_books_counters_delete
+BEFORE DELETE ON books
+BEGIN
+    UPDATE user_counters
+    SET lib = lib - 1,
+        fav = fav - (OLD.is_favorite = 1),
+        st_in = st_in
+            - (SELECT COUNT(*) FROM book_statuses WHERE book_id = OLD.id AND status = 'in'),
+        st_read = st_read
+            - (SELECT COUNT(*) FROM book_statuses WHERE book_id = OLD.id AND status = 'read')
+    WHERE user_id IN (OLD.user_id, 0);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_books_counters_favorite
+AFTER UPDATE OF is_favorite ON books
+WHEN (OLD.is_favorite = 1) != (NEW.is_favorite = 1) AND OLD.user_id = NEW.user_id
+BEGIN
+    UPDATE user_counters
+    SET fav = fav + (NEW.is_favorite = 1) - (OLD.is_favorite = 1)
+    WHERE user_id IN (NEW.user_id, 0);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_books_counters_owner
+AFTER UPDATE OF user_id ON books
+WHEN OLD.user_id != NEW.user_id
+BEGIN
+    INSERT OR IGNORE INTO user_counters (user_id) VALUES (NEW.user_id);
+    UPDATE user_counters
+    SET lib = lib - 1,
+        fav = fav - (OLD.is_favorite = 1),
+        st_in = st_in
+            - (SELECT COUNT(*) FROM book_statuses WHERE book_id = OLD.id AND status = 'in'),
+        st_read = st_read
+            - (SELECT COUNT(*) FROM book_statuses WHERE book_id = OLD.id AND status = 'read')
+    WHERE user_id = OLD.user_id;
+    UPDATE user_counters
+    SET lib = lib + 1,
+        fav = fav + (NEW.is_favorite = 1),
+        st_in = st_in
+            + (SELECT COUNT(*) FROM book_statuses WHERE book_id = NEW.id AND status = 'in'),
+        st_read = st_read
+            + (SELECT COUNT(*) FROM book_statuses WHERE book_id = NEW.id AND status = 'read')
+    WHERE user_id = NEW.user_id;
+    UPDATE user_counters
+    SET fav = fav + (NEW.is_favorite = 1) - (OLD.is_favorite = 1)
+    WHERE user_id = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_book_statuses_counters_insert
+AFTER INSERT ON book_statuses
+BEGIN
+    UPDATE user_counters
+    SET st_in = st_in + (NEW.status = 'in'), st_read = st_read + (NEW.status = 'read')
+    WHERE user_id IN ((SELECT user_id FROM books WHERE id = NEW.book_id), 0)
+      AND EXISTS (SELECT 1 FROM books WHERE id = NEW.book_id);
+END;
+
+-- Cascaded deletes find no book and are already accounted for above
+CREATE TRIGGER IF NOT EXISTS trg_book_statuses_counters_delete
+AFTER DELETE ON book_statuses
+BEGIN
+    UPDATE user_counters
+    SET st_in = st_in - (OLD.status = 'in'), st_read = st_read - (OLD.status = 'read')
+    WHERE user_id IN ((SELECT user_id FROM books WHERE id = OLD.book_id), 0)
+      AND EXISTS (SELECT 1 FROM books WHERE id = OLD.book_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_book_statuses_counters_update
+AFTER UPDATE ON book_statuses
+BEGIN
+    UPDATE user_counters
+    SET st_in = st_in - (OLD.status = 'in'), st_read = st_read - (OLD.status = 'read')
+    WHERE user_id IN ((SELECT user_id FROM books WHERE id = OLD.book_id), 0)
+      AND EXISTS (SELECT 1 FROM books WHERE id = OLD.book_id);
+    UPDATE user_counters
+    SET st_in = st_in + (NEW.status = 'in'), st_read = st_read + (NEW.status = 'read')
+    WHERE user_id IN ((SELECT user_id FROM books WHERE id = NEW.book_id), 0)
+      AND EXISTS (SELECT 1 FROM books WHERE id = NEW.book_id);
+END;
+"""
+
+
+def _init_counters(conn: sqlite3.Connection) -> None:
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_counters'"
+    )
+    exists = cur.fetchone() is not None
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_counters (
+            user_id INTEGER PRIMARY KEY,
+            lib INTEGER NOT NULL DEFAULT 0,
+            fav INTEGER NOT NULL DEFAULT 0,
+            st_in INTEGER NOT NULL DEFAULT 0,
+            st_read INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    cur.executescript(_COUNTER_TRIGGERS)
+    if not exists:
+        # Backfill existing databases; triggers keep the rows exact from here on
+        cur.execute(
+            """
+            INSERT INTO user_counters (user_id, lib, fav, st_in, st_read)
+            SELECT b.user_id,
+                   COUNT(*),
+                   SUM(b.is_favorite = 1),
+                   SUM(EXISTS (SELECT 1 FROM book_statuses s
+                               WHERE s.book_id = b.id AND s.status = 'in')),
+                   SUM(EXISTS (SELECT 1 FROM book_statuses s
+                               WHERE s.book_id = b.id AND s.status = 'read'))
+            FROM books b
+            GROUP BY b.user_id
+            """
+        )
+        cur.execute(
+            """
+            INSERT INTO user_counters (user_id, lib, fav, st_in, st_read)
+            SELECT ?, COALESCE(SUM(lib), 0), COALESCE(SUM(fav), 0),
+                   COALESCE(SUM(st_in), 0), COALESCE(SUM(st_read), 0)
+            FROM user_counters
+            """,
+            (GLOBAL_COUNTERS_ID,),
+        )
+    conn.commit()
+
+
+def _counter(column: str, tg_user_id: Optional[int] = None) -> int:
     conn = get_connection()
     cur = conn.cursor()
+    if tg_user_id is None:
+        cur.execute(
+            f"SELECT {column} FROM user_counters WHERE user_id = ?",
+            (GLOBAL_COUNTERS_ID,),
+        )
+    else:
+        cur.execute(
+            f"""
+            SELECT c.{column}
+            FROM user_counters c
+            JOIN users u ON u.id = c.user_id
+            WHERE u.tg_user_id = ?
+            """,
+            (tg_user_id,),
+        )
+    row = cur.fetchone()
+    return int(row[0]) if row else 0
+
+
+# --- Mutations ---
+# Each _name(cur, ...) does its writes without committing, so the write-behind
+# queue (app.writer) can group many of them into one transaction. The public
+# names without the underscore commit straight away.
+
+
+def _commit(op: Callable[..., Any], *args: Any) -> Any:
+    conn = get_connection()
+    result = op(conn.cursor(), *args)
+    conn.commit()
+    return result
+
+
+def apply_batch(
+    ops: List[Tuple[Callable[..., Any], Tuple[Any, ...]]],
+) -> List[Tuple[bool, Any]]:
+    """Runs (op, args) mutations in one transaction; returns (ok, result or error) per op.
+
+    Every op gets its own savepoint, so a failing op is rolled back alone and
+    the rest of the batch still commits with a single WAL sync.
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    results: List[Tuple[bool, Any]] = []
+    if not conn.in_transaction:
+        # IMMEDIATE: with several worker processes another writer may commit
+        # between our reads and writes, which a deferred transaction can only
+        # report as SQLITE_BUSY; taking the write lock up front waits instead
+        cur.execute("BEGIN IMMEDIATE")
+    try:
+        for op, args in ops:
+            cur.execute("SAVEPOINT op")
+            try:
+                results.append((True, op(cur, *args)))
+            except Exception as e:
+                cur.execute("ROLLBACK TO op")
+                results.append((False, e))
+            cur.execute("RELEASE op")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        # Cache hooks already ran for ops that are now rolled back
+        id_cache.clear()
+        raise
+    return results
+
+
+def _ensure_user(cur: sqlite3.Cursor, tg_user_id: int) -> int:
     cur.execute("SELECT id FROM users WHERE tg_user_id = ?", (tg_user_id,))
     row = cur.fetchone()
     if row:
         return int(row["id"])
     cur.execute("INSERT INTO users (tg_user_id) VALUES (?)", (tg_user_id,))
-    conn.commit()
     return int(cur.lastrowid)
 
 
-def add_book_for_user(
+def ensure_user(tg_user_id: int) -> int:
+    return _commit(_ensure_user, tg_user_id)
+
+
+def _add_book_for_user(
+    cur: sqlite3.Cursor,
     tg_user_id: int,
     name: str,
     author: str,
@@ -125,9 +402,7 @@ def add_book_for_user(
     photo_id: Optional[str] = None,
     status: str = "my",
 ) -> int:
-    user_id = ensure_user(tg_user_id)
-    conn = get_connection()
-    cur = conn.cursor()
+    user_id = _ensure_user(cur, tg_user_id)
     cur.execute(
         """
         INSERT INTO books (user_id, name, author, genre, photo_id, status)
@@ -135,8 +410,104 @@ def add_book_for_user(
         """,
         (user_id, name, author, genre, photo_id, status),
     )
-    conn.commit()
-    return int(cur.lastrowid)
+    book_id = int(cur.lastrowid)
+    # A new book is the newest one: it goes to the front of the library
+    id_cache.prepend((GLOBAL, "lib"), book_id)
+    return book_id
+
+
+def add_book_for_user(
+    tg_user_id: int,
+    name: str,
+    author: str,
+    genre: str,
+    photo_id: Optional[str] = None,
+    status: str = "my",
+) -> int:
+    return _commit(_add_book_for_user, tg_user_id, name, author, genre, photo_id, status)
+
+
+def import_books(
+    tg_user_id: int,
+    rows: List[Tuple[str, str, str, Optional[str], int, Optional[str]]],
+) -> int:
+    """Inserts (name, author, genre, photo_id, is_favorite, status) rows in one transaction.
+
+    status is "in", "read" or None. Meant to be called once per chunk of a
+    bulk import; returns the number of books added.
+    """
+    if not rows:
+        return 0
+    user_id = ensure_user(tg_user_id)
+    conn = get_connection()
+    cur = conn.cursor()
+    if not conn.in_transaction:
+        # IMMEDIATE: the write lock is held from reading sqlite_sequence until
+        # commit, so no other worker process inserts books in between
+        cur.execute("BEGIN IMMEDIATE")
+    with conn:
+        # AUTOINCREMENT and a single writer: the chunk gets consecutive ids
+        # right after the last one recorded in sqlite_sequence
+        cur.execute(
+            "SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'books'), 0)"
+        )
+        first_id = int(cur.fetchone()[0]) + 1
+        cur.executemany(
+            """
+            INSERT INTO books (user_id, name, author, genre, photo_id, is_favorite)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [(user_id, *row[:5]) for row in rows],
+        )
+        cur.executemany(
+            "INSERT OR IGNORE INTO book_statuses (book_id, status) VALUES (?, ?)",
+            [
+                (first_id + i, row[5])
+                for i, row in enumerate(rows)
+                if row[5] in _STATUS_COUNTER_COLUMNS
+            ],
+        )
+    # Many new books at once: cheaper to reload these scopes than to patch them
+    id_cache.invalidate((GLOBAL, "lib"), *user_keys(tg_user_id, "in", "read", "fav"))
+    return len(rows)
+
+
+def get_user_books_after(
+    tg_user_id: int, after: Optional[Tuple[int, int]], limit: int
+) -> List[Dict[str, Any]]:
+    """User's books oldest first, starting after the (created_ts, id) cursor."""
+    seek_sql = "AND (b.created_at, b.id) > (datetime(?, 'unixepoch'), ?)" if after else ""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(
+        f"""
+        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.is_favorite,
+               {_STATUSES_COLUMN},
+               CAST(strftime('%s', b.created_at) AS INTEGER) AS created_ts
+        FROM books b
+        JOIN users u ON u.id = b.user_id
+        WHERE u.tg_user_id = ? {seek_sql}
+        ORDER BY b.created_at ASC, b.id ASC
+        LIMIT ?
+        """,
+        (tg_user_id, *(after or ()), limit),
+    )
+    return [_book_row(row) for row in cur.fetchall()]
+
+
+# --- Book rows ---
+
+# Statuses travel with every book row, so rendering never needs a query per book
+_STATUSES_COLUMN = """(SELECT group_concat(bs.status)
+                FROM book_statuses bs WHERE bs.book_id = b.id) AS statuses"""
+
+
+def _book_row(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+    if row is None:
+        return None
+    book = dict(row)
+    book["statuses"] = sorted(row["statuses"].split(",")) if row["statuses"] else []
+    return book
 
 
 # --- Queries (lists) ---
@@ -146,16 +517,17 @@ def list_all_books(limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
-        """
-        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite, u.tg_user_id
+        f"""
+        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite, u.tg_user_id,
+               {_STATUSES_COLUMN}
         FROM books b
         JOIN users u ON u.id = b.user_id
-        ORDER BY b.created_at DESC
+        ORDER BY b.created_at DESC, b.id DESC
         LIMIT ? OFFSET ?
         """,
         (limit, offset),
     )
-    return [dict(row) for row in cur.fetchall()]
+    return [_book_row(row) for row in cur.fetchall()]
 
 
 def list_user_books(
@@ -164,95 +536,114 @@ def list_user_books(
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
-        """
-        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite, u.tg_user_id
+        f"""
+        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite, u.tg_user_id,
+               {_STATUSES_COLUMN}
         FROM books b
         JOIN users u ON u.id = b.user_id
         WHERE u.tg_user_id = ?
-        ORDER BY b.created_at DESC
+        ORDER BY b.created_at DESC, b.id DESC
         LIMIT ? OFFSET ?
         """,
         (tg_user_id, limit, offset),
     )
-    return [dict(row) for row in cur.fetchall()]
+    return [_book_row(row) for row in cur.fetchall()]
 
 
 def get_book(book_id: int) -> Optional[Dict[str, Any]]:
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
-        """
-        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite, u.tg_user_id
+        f"""
+        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite, u.tg_user_id,
+               {_STATUSES_COLUMN}
         FROM books b
         JOIN users u ON u.id = b.user_id
         WHERE b.id = ?
         """,
         (book_id,),
     )
-    row = cur.fetchone()
-    return dict(row) if row else None
+    return _book_row(cur.fetchone())
 
 
 # --- Carousel helpers ---
 
+# Keyset navigation: "n" seeks to the next (older) book, "p" to the previous one.
+_SEEK_DIRECTIONS = {"n": ("<", "DESC"), "p": (">", "ASC")}
+
+
+def _seek(direction: str) -> Tuple[str, str]:
+    try:
+        return _SEEK_DIRECTIONS[direction]
+    except KeyError:
+        raise ValueError(f"Unknown seek direction: {direction!r}") from None
+
 
 def count_all_books() -> int:
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) AS c FROM books")
-    row = cur.fetchone()
-    return int(row[0]) if row else 0
+    return _counter("lib")
 
 
 def count_user_books(tg_user_id: int) -> int:
+    return _counter("lib", tg_user_id)
+
+
+def get_all_book_by_index(index: int) -> Optional[Dict[str, Any]]:
+    # index is 0-based
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
-        """
-        SELECT COUNT(*) AS c
+        f"""
+        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite,
+               {_STATUSES_COLUMN},
+               CAST(strftime('%s', b.created_at) AS INTEGER) AS created_ts
         FROM books b
-        JOIN users u ON u.id = b.user_id
-        WHERE u.tg_user_id = ?
+        ORDER BY b.created_at DESC, b.id DESC
+        LIMIT 1 OFFSET ?
         """,
-        (tg_user_id,),
+        (index,),
     )
-    row = cur.fetchone()
-    return int(row[0]) if row else 0
+    return _book_row(cur.fetchone())
 
 
-def get_all_book_by_index(index: int) -> Optional[Dict[str, Any]]:
-    # index is 0-based
+def get_all_book_by_cursor(
+    created_ts: int, book_id: int, direction: str
+) -> Optional[Dict[str, Any]]:
+    # Keyset seek from the book at (created_ts, book_id); direction "n" or "p"
+    op, order = _seek(direction)
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
-        """
-        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite
+        f"""
+        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite,
+               {_STATUSES_COLUMN},
+               CAST(strftime('%s', b.created_at) AS INTEGER) AS created_ts
         FROM books b
-        ORDER BY b.created_at DESC
-        LIMIT 1 OFFSET ?
+        WHERE (b.created_at, b.id) {op} (datetime(?, 'unixepoch'), ?)
+        ORDER BY b.created_at {order}, b.id {order}
+        LIMIT 1
         """,
-        (index,),
+        (created_ts, book_id),
     )
-    row = cur.fetchone()
-    return dict(row) if row else None
+    return _book_row(cur.fetchone())
 
 
 def get_user_book_by_index(tg_user_id: int, index: int) -> Optional[Dict[str, Any]]:
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
-        """
-        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite, u.tg_user_id
+        f"""
+        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite, u.tg_user_id,
+               {_STATUSES_COLUMN},
+               CAST(strftime('%s', b.created_at) AS INTEGER) AS created_ts
         FROM books b
         JOIN users u ON u.id = b.user_id
         WHERE u.tg_user_id = ?
-        ORDER BY b.created_at DESC
+        ORDER BY b.created_at DESC, b.id DESC
         LIMIT 1 OFFSET ?
         """,
         (tg_user_id, index),
     )
-    row = cur.fetchone()
-    return dict(row) if row else None
+    return _book_row(cur.fetchone())
 
 
 # --- Status-based helpers ---
@@ -287,116 +678,185 @@ def update_book_status(book_id: int, status: str) -> None:
 
 
 # --- Favorite helpers ---
-def toggle_favorite(book_id: int) -> int:
-    conn = get_connection()
-    cur = conn.cursor()
+def _toggle_favorite(cur: sqlite3.Cursor, book_id: int) -> Optional[Dict[str, Any]]:
+    # One statement flips the flag and returns the updated book view
     cur.execute(
-        "UPDATE books SET is_favorite = CASE is_favorite WHEN 1 THEN 0 ELSE 1 END WHERE id = ?",
+        """
+        UPDATE books
+        SET is_favorite = CASE is_favorite WHEN 1 THEN 0 ELSE 1 END
+        WHERE id = ?
+        RETURNING id, name, author, genre, photo_id, status, is_favorite,
+                  CAST(strftime('%s', created_at) AS INTEGER) AS created_ts,
+                  (SELECT group_concat(bs.status)
+                   FROM book_statuses bs WHERE bs.book_id = books.id) AS statuses,
+                  (SELECT u.tg_user_id FROM users u WHERE u.id = books.user_id) AS tg_user_id
+        """,
         (book_id,),
     )
-    conn.commit()
-    cur.execute("SELECT is_favorite FROM books WHERE id = ?", (book_id,))
-    row = cur.fetchone()
-    return int(row[0]) if row else 0
+    book = _book_row(cur.fetchone())
+    if book is not None:
+        (key,) = user_keys(book["tg_user_id"], "fav")
+        if book["is_favorite"]:
+            id_cache.insert(key, book_id, lambda ids: _carousel_position(cur, ids, book_id))
+        else:
+            id_cache.discard([key], book_id)
+    return book
+
+
+def toggle_favorite(book_id: int) -> Optional[Dict[str, Any]]:
+    return _commit(_toggle_favorite, book_id)
 
 
 def count_user_favorites(tg_user_id: int) -> int:
+    return _counter("fav", tg_user_id)
+
+
+def get_user_favorite_by_index(tg_user_id: int, index: int) -> Optional[Dict[str, Any]]:
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
-        """
-        SELECT COUNT(*) AS c
+        f"""
+        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite, u.tg_user_id,
+               {_STATUSES_COLUMN},
+               CAST(strftime('%s', b.created_at) AS INTEGER) AS created_ts
         FROM books b
         JOIN users u ON u.id = b.user_id
         WHERE u.tg_user_id = ? AND b.is_favorite = 1
+        ORDER BY b.created_at DESC, b.id DESC
+        LIMIT 1 OFFSET ?
         """,
-        (tg_user_id,),
+        (tg_user_id, index),
     )
-    row = cur.fetchone()
-    return int(row[0]) if row else 0
+    return _book_row(cur.fetchone())
 
 
-def get_user_favorite_by_index(tg_user_id: int, index: int) -> Optional[Dict[str, Any]]:
+def get_user_favorite_by_cursor(
+    tg_user_id: int, created_ts: int, book_id: int, direction: str
+) -> Optional[Dict[str, Any]]:
+    op, order = _seek(direction)
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
-        """
-        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite, u.tg_user_id
+        f"""
+        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite, u.tg_user_id,
+               {_STATUSES_COLUMN},
+               CAST(strftime('%s', b.created_at) AS INTEGER) AS created_ts
         FROM books b
         JOIN users u ON u.id = b.user_id
         WHERE u.tg_user_id = ? AND b.is_favorite = 1
-        ORDER BY b.created_at DESC
-        LIMIT 1 OFFSET ?
+          AND (b.created_at, b.id) {op} (datetime(?, 'unixepoch'), ?)
+        ORDER BY b.created_at {order}, b.id {order}
+        LIMIT 1
         """,
-        (tg_user_id, index),
+        (tg_user_id, created_ts, book_id),
     )
-    row = cur.fetchone()
-    return dict(row) if row else None
+    return _book_row(cur.fetchone())
 
 
 # --- M2M status helpers ---
-def toggle_status(book_id: int, status: str) -> int:
-    if status not in {"in", "read"}:
-        return 0
-    conn = get_connection()
-    cur = conn.cursor()
-    # Try delete first; if exists -> remove and return 0 (now none active)
-    cur.execute(
-        "DELETE FROM book_statuses WHERE book_id = ? AND status = ?", (book_id, status)
-    )
-    if cur.rowcount > 0:
-        conn.commit()
-        return 0
-    # Insert the requested status and ensure exclusivity: remove the opposite one
-    opposite = "read" if status == "in" else "in"
-    cur.execute(
-        "INSERT OR IGNORE INTO book_statuses (book_id, status) VALUES (?, ?)",
-        (book_id, status),
-    )
+# Book view for RETURNING on book_statuses; statuses are filled in by the
+# caller, which knows them after a toggle
+_TOGGLED_VIEW = """(SELECT json_object(
+            'id', b.id, 'name', b.name, 'author', b.author, 'genre', b.genre,
+            'photo_id', b.photo_id, 'status', b.status, 'is_favorite', b.is_favorite,
+            'created_ts', CAST(strftime('%s', b.created_at) AS INTEGER),
+            'tg_user_id', u.tg_user_id)
+        FROM books b JOIN users u ON u.id = b.user_id
+        WHERE b.id = book_statuses.book_id) AS book"""
+
+
+def _toggle_status(
+    cur: sqlite3.Cursor, book_id: int, status: str
+) -> Optional[Dict[str, Any]]:
+    if status not in _STATUS_COUNTER_COLUMNS:
+        return None
+    # Statuses are mutually exclusive: clear whatever the book had, learning
+    # what it was and the book view in the same statement. Turning a status
+    # off ends here; otherwise the INSERT returns the view.
     cur.execute(
-        "DELETE FROM book_statuses WHERE book_id = ? AND status = ?",
-        (book_id, opposite),
+        f"DELETE FROM book_statuses WHERE book_id = ? RETURNING status, {_TOGGLED_VIEW}",
+        (book_id,),
     )
-    conn.commit()
-    return 1
+    rows = cur.fetchall()
+    previous = {row[0] for row in rows}
+    if status in previous:
+        statuses: List[str] = []
+    else:
+        try:
+            cur.execute(
+                f"""
+                INSERT INTO book_statuses (book_id, status) VALUES (?, ?)
+                RETURNING status, {_TOGGLED_VIEW}
+                """,
+                (book_id, status),
+            )
+        except sqlite3.IntegrityError:
+            # No such book (foreign key)
+            return None
+        rows, statuses = cur.fetchall(), [status]
+    book = json.loads(rows[0][1])
+    book["statuses"] = statuses
+    # The cached in/read scopes follow the toggle instead of being reloaded
+    owner = book["tg_user_id"]
+    id_cache.discard(user_keys(owner, *previous - set(statuses)), book_id)
+    for key in user_keys(owner, *statuses):
+        id_cache.insert(key, book_id, lambda ids: _carousel_position(cur, ids, book_id))
+    return book
+
+
+def toggle_status(book_id: int, status: str) -> Optional[Dict[str, Any]]:
+    return _commit(_toggle_status, book_id, status)
 
 
 def count_user_books_by_status_m2m(tg_user_id: int, status: str) -> int:
+    column = _STATUS_COUNTER_COLUMNS.get(status)
+    return _counter(column, tg_user_id) if column else 0
+
+
+def get_user_book_by_status_and_index_m2m(
+    tg_user_id: int, status: str, index: int
+) -> Optional[Dict[str, Any]]:
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
-        """
-        SELECT COUNT(*) AS c
+        f"""
+        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite, u.tg_user_id,
+               {_STATUSES_COLUMN},
+               CAST(strftime('%s', b.created_at) AS INTEGER) AS created_ts
         FROM books b
         JOIN users u ON u.id = b.user_id
         JOIN book_statuses s ON s.book_id = b.id AND s.status = ?
         WHERE u.tg_user_id = ?
+        ORDER BY b.created_at DESC, b.id DESC
+        LIMIT 1 OFFSET ?
         """,
-        (status, tg_user_id),
+        (status, tg_user_id, index),
     )
-    row = cur.fetchone()
-    return int(row[0]) if row else 0
+    return _book_row(cur.fetchone())
 
 
-def get_user_book_by_status_and_index_m2m(
-    tg_user_id: int, status: str, index: int
+def get_user_book_by_status_and_cursor_m2m(
+    tg_user_id: int, status: str, created_ts: int, book_id: int, direction: str
 ) -> Optional[Dict[str, Any]]:
+    op, order = _seek(direction)
     conn = get_connection()
     cur = conn.cursor()
     cur.execute(
-        """
-        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite, u.tg_user_id
+        f"""
+        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite, u.tg_user_id,
+               {_STATUSES_COLUMN},
+               CAST(strftime('%s', b.created_at) AS INTEGER) AS created_ts
         FROM books b
         JOIN users u ON u.id = b.user_id
         JOIN book_statuses s ON s.book_id = b.id AND s.status = ?
         WHERE u.tg_user_id = ?
-        ORDER BY b.created_at DESC
-        LIMIT 1 OFFSET ?
+          AND (b.created_at, b.id) {op} (datetime(?, 'unixepoch'), ?)
+        ORDER BY b.created_at {order}, b.id {order}
+        LIMIT 1
         """,
-        (status, tg_user_id, index),
+        (status, tg_user_id, created_ts, book_id),
     )
-    row = cur.fetchone()
-    return dict(row) if row else None
+    return _book_row(cur.fetchone())
 
 
 def list_book_statuses(book_id: int) -> List[str]:
@@ -408,9 +868,566 @@ def list_book_statuses(book_id: int) -> List[str]:
     return [row[0] for row in cur.fetchall()]
 
 
+def _delete_book(cur: sqlite3.Cursor, book_id: int) -> bool:
+    owner = _book_owner(cur, book_id)
+    cur.execute("DELETE FROM books WHERE id = ?", (book_id,))
+    deleted = cur.rowcount > 0
+    if deleted:
+        keys = [(GLOBAL, "lib")]
+        if owner is not None:
+            keys += user_keys(owner, "in", "read", "fav")
+        id_cache.discard(keys, book_id)
+    return deleted
+
+
 def delete_book(book_id: int) -> bool:
+    return _commit(_delete_book, book_id)
+
+
+def _book_owner(cur: sqlite3.Cursor, book_id: int) -> Optional[int]:
+    cur.execute(
+        "SELECT u.tg_user_id FROM books b JOIN users u ON u.id = b.user_id WHERE b.id = ?",
+        (book_id,),
+    )
+    row = cur.fetchone()
+    return int(row[0]) if row else None
+
+
+# --- Carousel pages: book row + scope total + statuses in one statement ---
+
+Cursor = Tuple[int, int, str]  # (created_ts, book_id, direction)
+
+
+def _total_sql(column: str, tg_user_id: Optional[int]) -> Tuple[str, Tuple[Any, ...]]:
+    if tg_user_id is None:
+        return (
+            f"SELECT {column} FROM user_counters WHERE user_id = ?",
+            (GLOBAL_COUNTERS_ID,),
+        )
+    return (
+        f"""SELECT c.{column} FROM user_counters c
+        JOIN users u ON u.id = c.user_id WHERE u.tg_user_id = ?""",
+        (tg_user_id,),
+    )
+
+
+def _fetch_page(
+    from_sql: str,
+    where_sql: str,
+    params: Tuple[Any, ...],
+    index: int,
+    cursor: Optional[Cursor],
+    total: Tuple[str, Tuple[Any, ...]],
+) -> Tuple[Optional[Dict[str, Any]], int]:
+    # The total comes from a one-row counter subquery LEFT JOINed to the page
+    # row, so an empty or exhausted scope still reports its size in the same
+    # round trip.
+    if cursor is None:
+        seek_sql, order, limit_sql = "", "DESC", "LIMIT 1 OFFSET ?"
+        page_params: Tuple[Any, ...] = params + (index,)
+    else:
+        created_ts, book_id, direction = cursor
+        op, order = _seek(direction)
+        seek_sql = f"AND (b.created_at, b.id) {op} (datetime(?, 'unixepoch'), ?)"
+        limit_sql = "LIMIT 1"
+        page_params = params + (created_ts, book_id)
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute("DELETE FROM books WHERE id = ?", (book_id,))
+    cur.execute(
+        f"""
+        SELECT t.total, p.*
+        FROM (SELECT COALESCE(({total[0]}), 0) AS total) t
+        LEFT JOIN (
+            SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite,
+                   CAST(strftime('%s', b.created_at) AS INTEGER) AS created_ts,
+                   {_STATUSES_COLUMN}
+            FROM {from_sql}
+            WHERE {where_sql} {seek_sql}
+            ORDER BY b.created_at {order}, b.id {order}
+            {limit_sql}
+        ) p ON 1
+        """,
+        total[1] + page_params,
+    )
+    row = cur.fetchone()
+    total_count = int(row["total"]) if row else 0
+    if row is None or row["id"] is None:
+        if cursor is not None:
+            # Seek ran off the edge (e.g. the scope shrank): fall back to the index
+            return _fetch_page(from_sql, where_sql, params, index, None, total)
+        return None, total_count
+    book = _book_row(row)
+    del book["total"]
+    return book, total_count
+
+
+def _carousel_position(cur: sqlite3.Cursor, ids: Sequence[int], book_id: int) -> Optional[int]:
+    """Where book_id belongs in ids ordered (created_at DESC, id DESC).
+
+    Binary search with a primary key lookup per probe; None if a probed
+    book is gone, i.e. ids are stale.
+    """
+
+    def before(book: int) -> Optional[bool]:
+        # Compared by SQLite itself, exactly as ORDER BY compares them
+        cur.execute(
+            """
+            SELECT (p.created_at, p.id) > (t.created_at, t.id)
+            FROM books p, books t WHERE p.id = ? AND t.id = ?
+            """,
+            (book, book_id),
+        )
+        row = cur.fetchone()
+        return bool(row[0]) if row is not None else None
+
+    low, high = 0, len(ids)
+    while low < high:
+        middle = (low + high) // 2
+        probe = before(ids[middle])
+        if probe is None:
+            return None
+        if probe:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _book_view(cur: sqlite3.Cursor, book_id: int) -> Optional[Dict[str, Any]]:
+    cur.execute(
+        f"""
+        SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite,
+               CAST(strftime('%s', b.created_at) AS INTEGER) AS created_ts,
+               {_STATUSES_COLUMN},
+               u.tg_user_id
+        FROM books b
+        JOIN users u ON u.id = b.user_id
+        WHERE b.id = ?
+        """,
+        (book_id,),
+    )
+    return _book_row(cur.fetchone())
+
+
+def _page(
+    key: Tuple[int, str],
+    from_sql: str,
+    where_sql: str,
+    params: Tuple[Any, ...],
+    index: int,
+    cursor: Optional[Cursor],
+    total: Tuple[str, Tuple[Any, ...]],
+) -> Tuple[Optional[Dict[str, Any]], int]:
+    # Cached ordered IDs turn index -> book into a primary key lookup; scopes
+    # too large for the cache go through SQL pagination instead.
+    def load_ids(limit: int) -> Iterable[int]:
+        cur = get_connection().cursor()
+        cur.execute(
+            f"""
+            SELECT b.id FROM {from_sql}
+            WHERE {where_sql}
+            ORDER BY b.created_at DESC, b.id DESC
+            LIMIT ?
+            """,
+            params + (limit,),
+        )
+        return (row[0] for row in cur)
+
+    ids = id_cache.get_or_load(key, load_ids)
+    if ids is None:
+        return _fetch_page(from_sql, where_sql, params, index, cursor, total)
+    if not 0 <= index < len(ids):
+        return None, len(ids)
+    book = _book_view(get_connection().cursor(), ids[index])
+    if book is None:
+        # Stale entry (the book vanished behind our back): rebuild next time
+        id_cache.invalidate(key)
+        return _fetch_page(from_sql, where_sql, params, index, cursor, total)
+    return book, len(ids)
+
+
+def get_lib_page(
+    index: int, cursor: Optional[Cursor] = None
+) -> Tuple[Optional[Dict[str, Any]], int]:
+    return _page(
+        (GLOBAL, "lib"), "books b", "1", (), index, cursor, _total_sql("lib", None)
+    )
+
+
+def get_status_page(
+    tg_user_id: int, status: str, index: int, cursor: Optional[Cursor] = None
+) -> Tuple[Optional[Dict[str, Any]], int]:
+    if status not in _STATUS_COUNTER_COLUMNS:
+        return None, 0
+    return _page(
+        (tg_user_id, status),
+        """books b
+        JOIN users u ON u.id = b.user_id
+        JOIN book_statuses s ON s.book_id = b.id AND s.status = ?""",
+        "u.tg_user_id = ?",
+        (status, tg_user_id),
+        index,
+        cursor,
+        _total_sql(_STATUS_COUNTER_COLUMNS[status], tg_user_id),
+    )
+
+
+def get_favorites_page(
+    tg_user_id: int, index: int, cursor: Optional[Cursor] = None
+) -> Tuple[Optional[Dict[str, Any]], int]:
+    return _page(
+        (tg_user_id, "fav"),
+        "books b JOIN users u ON u.id = b.user_id",
+        "u.tg_user_id = ? AND b.is_favorite = 1",
+        (tg_user_id,),
+        index,
+        cursor,
+        _total_sql("fav", tg_user_id),
+    )
+
+
+# --- Full-text search (FTS5, external content over books) ---
+
+# Up to SEARCH_LIMIT matches are all ranked by bm25. Past that only the newest
+# ones are ranked and the carousel shows "SEARCH_LIMIT+": bm25 costs a few
+# microseconds per document, and a very common word matches a large share of a
+# big library (ranking all 230k matches of one took ~0.7 s on a million books)
+SEARCH_LIMIT = 200
+
+_SEARCH_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS trg_books_fts_insert
+AFTER INSERT ON books
+BEGIN
+    INSERT INTO books_fts (rowid, name, author, genre, fts_owner)
+    VALUES (NEW.id, NEW.name, NEW.author, NEW.genre, NEW.fts_owner);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_books_fts_delete
+AFTER DELETE ON books
+BEGIN
+    INSERT INTO books_fts (books_fts, rowid, name, author, genre, fts_owner)
+    VALUES ('delete', OLD.id, OLD.name, OLD.author, OLD.genre, OLD.fts_owner);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_books_fts_update
+AFTER UPDATE OF name, author, genre, user_id ON books
+BEGIN
+    INSERT INTO books_fts (books_fts, rowid, name, author, genre, fts_owner)
+    VALUES ('delete', OLD.id, OLD.name, OLD.author, OLD.genre, OLD.fts_owner);
+    INSERT INTO books_fts (rowid, name, author, genre, fts_owner)
+    VALUES (NEW.id, NEW.name, NEW.author, NEW.genre, NEW.fts_owner);
+END;
+"""
+
+
+def _init_search(conn: sqlite3.Connection) -> None:
+    cur = conn.cursor()
+    # One FTS token per book naming its owner ("u<users.id>"): a user's search
+    # intersects that doclist with the query terms instead of filtering every
+    # match in the library by user_id afterwards
+    cur.execute("PRAGMA table_xinfo(books)")
+    if "fts_owner" not in [row[1] for row in cur.fetchall()]:
+        cur.execute(
+            "ALTER TABLE books ADD COLUMN fts_owner TEXT "
+            "GENERATED ALWAYS AS ('u' || user_id) VIRTUAL"
+        )
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'")
+    exists = cur.fetchone() is not None
+    if exists:
+        cur.execute("PRAGMA table_info(books_fts)")
+        if "fts_owner" not in [row[1] for row in cur.fetchall()]:
+            # Created before the owner column: rebuilt below with it
+            cur.executescript(
+                """
+                DROP TRIGGER IF EXISTS trg_books_fts_insert;
+                DROP TRIGGER IF EXISTS trg_books_fts_delete;
+                DROP TRIGGER IF EXISTS trg_books_fts_update;
+                DROP TABLE books_fts;
+                """
+            )
+            exists = False
+    cur.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+            name, author, genre, fts_owner,
+            content = 'books', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        """
+    )
+    cur.executescript(_SEARCH_TRIGGERS)
+    if not exists:
+        # Title matches outweigh author, author outweighs genre
+        cur.execute(
+            "INSERT INTO books_fts (books_fts, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0, 0.0)')"
+        )
+        # Index books that were added before the search table existed
+        cur.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+    conn.commit()
+
+
+def _match_query(text: str, prefix: bool) -> Optional[str]:
+    # Every word becomes a quoted term, so user input never reaches the FTS5
+    # query syntax: "гаррі пот" -> "гаррі" "пот" (or "гаррі"* "пот"*). The
+    # column filter keeps words like "u12" away from the owner tokens.
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    star = "*" if prefix else ""
+    terms = " ".join(f'"{word}"{star}' for word in words)
+    return f"{{name author genre}} : ({terms})"
+
+
+def search_books_page(query: str, index: int) -> Tuple[Optional[Dict[str, Any]], int]:
+    """Book at position index among the bm25-ranked matches, and their count.
+
+    The count stops at SEARCH_LIMIT + 1, meaning "more than SEARCH_LIMIT";
+    only the first SEARCH_LIMIT positions are served then. Whole words are
+    tried first; prefix terms only when nothing matched, since a prefix query
+    merges the doclists of every word it expands to.
+    """
+    cur = get_connection().cursor()
+    for prefix in (False, True):
+        match = _match_query(query, prefix)
+        if match is None:
+            return None, 0
+        book, total = _search_page(cur, match, index)
+        if total:
+            break
+    return book, total
+
+
+def _search_page(
+    cur: sqlite3.Cursor, match: str, index: int
+) -> Tuple[Optional[Dict[str, Any]], int]:
+    # The newest SEARCH_LIMIT + 1 matches come from walking the doclist in rowid
+    # order (no scoring); only rows at or above the oldest of them are ranked,
+    # which is every match unless there are more than SEARCH_LIMIT.
+    cur.execute(
+        f"""
+        WITH newest AS (
+            SELECT rowid FROM books_fts WHERE books_fts MATCH ?
+            ORDER BY rowid DESC LIMIT ?
+        )
+        SELECT t.total, p.*
+        FROM (SELECT COUNT(*) AS total FROM newest) t
+        LEFT JOIN (
+            SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite,
+                   {_STATUSES_COLUMN}
+            FROM (
+                SELECT rowid FROM books_fts
+                WHERE books_fts MATCH ? AND rowid >= (SELECT MIN(rowid) FROM newest)
+                ORDER BY rank LIMIT 1 OFFSET ?
+            ) f
+            JOIN books b ON b.id = f.rowid
+        ) p ON 1
+        """,
+        (match, SEARCH_LIMIT + 1, match, index),
+    )
+    row = cur.fetchone()
+    total = int(row["total"]) if row else 0
+    if row is None or row["id"] is None or index >= SEARCH_LIMIT:
+        return None, total
+    book = _book_row(row)
+    del book["total"]
+    return book, total
+
+
+def search_user_books(
+    tg_user_id: int, query: str, limit: int, before_id: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """User's books matching query (prefix terms), newest first; all books if empty.
+
+    Used for inline mode, where the last word is usually still being typed.
+    Pages seek past before_id (the last book of the previous page). The query
+    terms are ANDed with the user's owner token inside FTS5, whose doclists
+    are walked newest first until the page is full, so a user with few books
+    does not pay for other users' matches and nothing is ranked.
+    """
+    seek = before_id if before_id is not None else -1
+    match = _match_query(query, prefix=True)
+    cur = get_connection().cursor()
+    if match is None:
+        cur.execute(
+            f"""
+            SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite,
+                   {_STATUSES_COLUMN}
+            FROM books b
+            JOIN users u ON u.id = b.user_id
+            WHERE u.tg_user_id = ?
+              AND (? < 0 OR (b.created_at, b.id) < (
+                  (SELECT created_at FROM books WHERE id = ?), ?))
+            ORDER BY b.created_at DESC, b.id DESC
+            LIMIT ?
+            """,
+            (tg_user_id, seek, seek, seek, limit),
+        )
+    else:
+        cur.execute("SELECT id FROM users WHERE tg_user_id = ?", (tg_user_id,))
+        user = cur.fetchone()
+        if user is None:
+            return []
+        cur.execute(
+            f"""
+            SELECT b.id, b.name, b.author, b.genre, b.photo_id, b.status, b.is_favorite,
+                   {_STATUSES_COLUMN}
+            FROM books_fts f
+            JOIN books b ON b.id = f.rowid
+            WHERE books_fts MATCH ?
+              AND (? < 0 OR f.rowid < ?)
+            ORDER BY f.rowid DESC
+            LIMIT ?
+            """,
+            (f'fts_owner : "u{user["id"]}" AND {match}', seek, seek, limit),
+        )
+    return [_book_row(row) for row in cur.fetchall()]
+
+
+# --- Query plan checks ---
+
+_PLAN_TABLES = {"b", "u", "s", "bs", "books", "users", "book_statuses"}
+
+
+def _plan_problem(detail: str) -> bool:
+    # A full table scan or an explicit sort step means an index is missing
+    if "TEMP B-TREE" in detail:
+        return True
+    words = detail.split()
+    return (
+        len(words) >= 2
+        and words[0] == "SCAN"
+        and words[1] in _PLAN_TABLES
+        and "INDEX" not in detail
+    )
+
+
+def check_query_plans() -> List[Tuple[str, List[str]]]:
+    """Runs EXPLAIN QUERY PLAN for every read query in this module.
+
+    Statements are captured with a trace callback while the read helpers run
+    against the current database, so the check follows the real SQL. Returns
+    (statement, plan) pairs whose plan scans a table or sorts with a temp B-tree.
+    """
+    global id_cache
+    conn = get_connection()
+    statements: List[str] = []
+    probes = [
+        (list_all_books, (1, 0)),
+        (list_user_books, (0, 1, 0)),
+        (get_book, (0,)),
+        (count_all_books, ()),
+        (count_user_books, (0,)),
+        (get_all_book_by_index, (0,)),
+        (get_all_book_by_cursor, (0, 0, "n")),
+        (get_all_book_by_cursor, (0, 0, "p")),
+        (get_user_book_by_index, (0, 0)),
+        (count_user_books_by_status, (0, "in")),
+        (count_user_favorites, (0,)),
+        (get_user_favorite_by_index, (0, 0)),
+        (get_user_favorite_by_cursor, (0, 0, 0, "n")),
+        (count_user_books_by_status_m2m, (0, "in")),
+        (get_user_book_by_status_and_index_m2m, (0, "in", 0)),
+        (get_user_book_by_status_and_cursor_m2m, (0, "in", 0, 0, "n")),
+        (list_book_statuses, (0,)),
+        (get_lib_page, (0,)),
+        (get_lib_page, (0, (0, 0, "n"))),
+        (get_status_page, (0, "in", 0)),
+        (get_favorites_page, (0, 0, (0, 0, "p"))),
+        (search_books_page, ("probe", 0)),
+        (search_user_books, (0, "probe", 1)),
+        (search_user_books, (0, "probe", 1, 1)),
+        (search_user_books, (0, "", 1, 1)),
+        (get_user_books_after, (0, None, 1)),
+        (get_user_books_after, (0, (0, 0), 1)),
+        (lambda: _book_view(conn.cursor(), 0), ()),
+        (lambda: _book_owner(conn.cursor(), 0), ()),
+        (lambda: _carousel_position(conn.cursor(), [0], 0), ()),
+    ]
+    # A cache that refuses every entry makes the page helpers run both the
+    # ID loader and the SQL pagination path.
+    saved_cache, id_cache = id_cache, IdCache(max_entry_ids=-1)
+    conn.set_trace_callback(statements.append)
+    try:
+        for fn, args in probes:
+            fn(*args)
+    finally:
+        conn.set_trace_callback(None)
+        id_cache = saved_cache
+
+    problems: List[Tuple[str, List[str]]] = []
+    cur = conn.cursor()
+    for sql in dict.fromkeys(statements):
+        if not sql.lstrip().upper().startswith("SELECT"):
+            continue
+        cur.execute("EXPLAIN QUERY PLAN " + sql)
+        plan = [row[3] for row in cur.fetchall()]
+        if any(_plan_problem(detail) for detail in plan):
+            problems.append((" ".join(sql.split()), plan))
+    return problems
+
+
+# --- Menu message tracking ---
+
+
+def get_user_menu(tg_user_id: int) -> Optional[int]:
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT message_id FROM user_menus WHERE tg_user_id = ?", (tg_user_id,))
+    row = cur.fetchone()
+    return int(row[0]) if row else None
+
+
+def save_user_menus(items: List[Tuple[int, Optional[int]]]) -> None:
+    # Batched upsert; message_id None removes the entry
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.executemany(
+        """
+        INSERT INTO user_menus (tg_user_id, message_id) VALUES (?, ?)
+        ON CONFLICT(tg_user_id) DO UPDATE
+        SET message_id = excluded.message_id, updated_at = CURRENT_TIMESTAMP
+        """,
+        [(uid, mid) for uid, mid in items if mid is not None],
+    )
+    cur.executemany(
+        "DELETE FROM user_menus WHERE tg_user_id = ?",
+        [(uid,) for uid, mid in items if mid is None],
+    )
+    conn.commit()
+
+
+# --- FSM storage ---
+
+
+def fsm_get(key: str) -> Optional[Tuple[Optional[str], str, float]]:
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (key,))
+    row = cur.fetchone()
+    return (row[0], row[1], float(row[2])) if row else None
+
+
+def fsm_put(key: str, state: Optional[str], data: str, updated_at: float) -> None:
+    # An empty record (no state, no data) is not worth keeping
+    conn = get_connection()
+    cur = conn.cursor()
+    if state is None and data == "{}":
+        cur.execute("DELETE FROM fsm_states WHERE key = ?", (key,))
+    else:
+        cur.execute(
+            """
+            INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE
+            SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+            """,
+            (key, state, data, updated_at),
+        )
+    conn.commit()
+
+
+def fsm_delete_expired(before: float) -> int:
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM fsm_states WHERE updated_at < ?", (before,))
     conn.commit()
-    return cur.rowcount > 0
+    return cur.rowcount
@@ -0,0 +1,122 @@
+"""Асинхронна обгортка над app.db.
+
+Виклики sqlite3 блокують, тому кожен запит іде в окремий однопотоковий
+executor; один потік заодно впорядковує доступ до спільного з'єднання.
+Публічні імена повторюють app.db і повертають awaitable. Мутації проходять
+через груповий коміт (app.writer), який збирає їх у спільні транзакції.
+"""
+
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Awaitable
+
+from app import db, metrics
+from app.writer import GroupCommitWriter
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+
+async def run_in_db(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    loop = asyncio.get_running_loop()
+    # Контекст оновлення (update_id, user_id для логів) — і в потоці БД
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _executor, functools.partial(ctx.run, fn, *args, **kwargs)
+    )
+
+
+def _wrap(fn: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    if metrics.ENABLED:
+        # Час самого запиту в потоці БД, без очікування в черзі executor'а
+        fn = metrics.timed(fn, metrics.db_seconds)
+
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        return await run_in_db(fn, *args, **kwargs)
+
+    return wrapper
+
+
+writer = GroupCommitWriter(db.apply_batch, run_in_db)
+
+
+def _write(
+    op: Callable[..., Any], public: Callable[..., Any]
+) -> Callable[..., Awaitable[Any]]:
+    @functools.wraps(public)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        return await writer.submit(op, *args, **kwargs)
+
+    if metrics.ENABLED:
+        return metrics.timed_async(wrapper, metrics.db_write_seconds, public.__name__)
+    return wrapper
+
+
+def shutdown() -> None:
+    _executor.shutdown(wait=True)
+
+
+init_db = _wrap(db.init_db)
+ensure_user = _write(db._ensure_user, db.ensure_user)
+add_book_for_user = _write(db._add_book_for_user, db.add_book_for_user)
+
+# --- Списки ---
+list_all_books = _wrap(db.list_all_books)
+list_user_books = _wrap(db.list_user_books)
+get_book = _wrap(db.get_book)
+
+# --- Каруселі ---
+count_all_books = _wrap(db.count_all_books)
+count_user_books = _wrap(db.count_user_books)
+get_all_book_by_index = _wrap(db.get_all_book_by_index)
+get_all_book_by_cursor = _wrap(db.get_all_book_by_cursor)
+get_user_book_by_index = _wrap(db.get_user_book_by_index)
+
+# --- Статуси (застарілі) ---
+count_user_books_by_status = _wrap(db.count_user_books_by_status)
+get_user_book_by_status_and_index = _wrap(db.get_user_book_by_status_and_index)
+update_book_status = _wrap(db.update_book_status)
+
+# --- Обране ---
+toggle_favorite = _write(db._toggle_favorite, db.toggle_favorite)
+count_user_favorites = _wrap(db.count_user_favorites)
+get_user_favorite_by_index = _wrap(db.get_user_favorite_by_index)
+get_user_favorite_by_cursor = _wrap(db.get_user_favorite_by_cursor)
+
+# --- Статуси (m2m) ---
+toggle_status = _write(db._toggle_status, db.toggle_status)
+count_user_books_by_status_m2m = _wrap(db.count_user_books_by_status_m2m)
+get_user_book_by_status_and_index_m2m = _wrap(db.get_user_book_by_status_and_index_m2m)
+get_user_book_by_status_and_cursor_m2m = _wrap(
+    db.get_user_book_by_status_and_cursor_m2m
+)
+list_book_statuses = _wrap(db.list_book_statuses)
+delete_book = _write(db._delete_book, db.delete_book)
+
+# --- Сторінки каруселей ---
+get_lib_page = _wrap(db.get_lib_page)
+get_status_page = _wrap(db.get_status_page)
+get_favorites_page = _wrap(db.get_favorites_page)
+
+# --- Повнотекстовий пошук ---
+SEARCH_LIMIT = db.SEARCH_LIMIT
+search_books_page = _wrap(db.search_books_page)
+search_user_books = _wrap(db.search_user_books)
+
+# --- Масовий імпорт / експорт ---
+import_books = _wrap(db.import_books)
+get_user_books_after = _wrap(db.get_user_books_after)
+
+# --- Повідомлення меню ---
+get_user_menu = _wrap(db.get_user_menu)
+save_user_menus = _wrap(db.save_user_menus)
+
+# --- Сховище FSM ---
+fsm_get = _wrap(db.fsm_get)
+fsm_put = _wrap(db.fsm_put)
+fsm_delete_expired = _wrap(db.fsm_delete_expired)
+
+# --- Діагностика ---
+check_query_plans = _wrap(db.check_query_plans)
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Awaitable, Callable, Mapping
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.middleware import FSMContextMiddleware
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage, StateType, StorageKey
+from aiogram.types import TelegramObject, Update
+
+from app import db_async
+from app.logger import logger
+
+
+@dataclass
+class _Record:
+    state: str | None = None
+    data: dict[str, Any] = field(default_factory=dict)
+    updated_at: float = 0.0
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-сховище поверх SQLite бота (таблиця fsm_states).
+
+    Запис — write-through: спочатку БД, потім невеликий LRU-кеш у пам'яті.
+    Стани, які не оновлювались довше ttl секунд (покинуті діалоги додавання
+    книги), вважаються порожніми; фонова задача раз на sweep_interval
+    видаляє їх з БД. Незавершений діалог переживає перезапуск і деплой.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 24 * 3600,
+        cache_size: int = 10_000,
+        sweep_interval: float = 600,
+    ):
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.sweep_interval = sweep_interval
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        self._sweeper: asyncio.Task | None = None
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(
+            str(part) if part is not None else ""
+            for part in (
+                key.bot_id,
+                key.chat_id,
+                key.user_id,
+                key.thread_id,
+                key.business_connection_id,
+                key.destiny,
+            )
+        )
+
+    def _remember(self, key: str, record: _Record) -> None:
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _ensure_sweeper(self) -> None:
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Помилка очищення FSM-станів: {e}")
+
+    async def sweep(self) -> int:
+        """Видаляє прострочені стани з БД і кешу; повертає кількість рядків."""
+        before = time.time() - self.ttl
+        for key in [k for k, r in self._cache.items() if r.updated_at < before]:
+            del self._cache[key]
+        return await db_async.fsm_delete_expired(before)
+
+    async def _load(self, key: str) -> _Record:
+        self._ensure_sweeper()
+        record = self._cache.get(key)
+        if record is None:
+            row = await db_async.fsm_get(key)
+            if row is None:
+                record = _Record()
+            else:
+                state, data, updated_at = row
+                record = _Record(state, json.loads(data), updated_at)
+            self._remember(key, record)
+        else:
+            self._cache.move_to_end(key)
+        if record.updated_at and record.updated_at < time.time() - self.ttl:
+            return _Record()
+        return record
+
+    async def _save(self, key: str, state: str | None, data: dict[str, Any]) -> None:
+        record = _Record(state, data, time.time())
+        await db_async.fsm_put(key, state, json.dumps(data), record.updated_at)
+        self._remember(key, record)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        skey = self._key(key)
+        record = await self._load(skey)
+        state = state.state if isinstance(state, State) else state
+        await self._save(skey, state, record.data)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return (await self._load(self._key(key))).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        skey = self._key(key)
+        record = await self._load(skey)
+        await self._save(skey, record.state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return (await self._load(self._key(key))).data.copy()
+
+    async def close(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        self._cache.clear()
+
+
+class UserEventIsolation(BaseEventIsolation):
+    """
+    Оновлення різних користувачів обробляються одночасно, а одного —
+    по одному: FSM-middleware тримає asyncio.Lock користувача від читання
+    стану до кінця хендлера (toggle_status, delete_book, меню в user_menus).
+
+    Замок живе, лише поки його хтось тримає або чекає: останній, хто
+    відпускає, видаляє запис, тож пам'ять не росте з кількістю користувачів
+    (SimpleEventIsolation з aiogram лишає замок кожного назавжди).
+    """
+
+    def __init__(self) -> None:
+        # user_id -> [замок, скільки оновлень його тримають або чекають]
+        self._locks: dict[int, list] = {}
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        entry = self._locks.get(key.user_id)
+        if entry is None:
+            entry = self._locks[key.user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key.user_id]
+
+    @property
+    def active_users(self) -> int:
+        """Користувачі, чиє оновлення обробляється або чекає на замок."""
+        # Не __len__: порожній екземпляр став би хибним, а Dispatcher бере
+        # `events_isolation or DisabledEventIsolation()`
+        return len(self._locks)
+
+    async def close(self) -> None:
+        self._locks.clear()
+
+
+class InlineUnlockedFSMContextMiddleware(FSMContextMiddleware):
+    """
+    FSMContextMiddleware, що не бере замок користувача для inline-запитів.
+
+    Ключ inline-запиту (chat_id = user_id) збігається з ключем приватного
+    чату, тож відрізнити його можна лише тут, за самим оновленням. Inline-
+    запити приходять на кожне натискання клавіші; застарілий пошук скасовує
+    app.inline, а під замком вони б чекали один на одного.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Update) or event.inline_query is None:
+            return await super().__call__(handler, event, data)
+        bot: Bot = data["bot"]
+        context = self.resolve_event_context(bot, data)
+        data["fsm_storage"] = self.storage
+        if context:
+            data.update({"state": context, "raw_state": await context.get_state()})
+        return await handler(event, data)
+
+
+def create_dispatcher(storage: BaseStorage, **kwargs: Any) -> Dispatcher:
+    """
+    Dispatcher з UserEventIsolation: оновлення одного користувача — по черзі,
+    різних — одночасно; inline-запити — без замка.
+    """
+    dp = Dispatcher(
+        storage=storage, events_isolation=UserEventIsolation(), disable_fsm=True, **kwargs
+    )
+    # Те саме місце в ланцюжку, що й у вбудованого FSM-middleware: одразу
+    # після UserContextMiddleware, від якого він бере контекст події
+    dp.fsm = InlineUnlockedFSMContextMiddleware(
+        storage=dp.fsm.storage,
+        events_isolation=dp.fsm.events_isolation,
+        strategy=dp.fsm.strategy,
+    )
+    dp.update.outer_middleware(dp.fsm)
+    return dp
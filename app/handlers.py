@@ -1,25 +1,25 @@
 import asyncio
 from aiogram import Router, types, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InputMediaPhoto
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 import app.keyboards as kb
 from app.settings import menus, menu_texts, user_menus
-from app.db import (
+from app.render_cache import render_cache
+from app.prefetch import prefetcher
+from app.db_async import (
+    SEARCH_LIMIT,
     add_book_for_user,
     list_all_books,
     get_book,
-    count_all_books,
-    get_all_book_by_index,
-    count_user_books_by_status_m2m,
-    get_user_book_by_status_and_index_m2m,
+    get_lib_page,
+    get_status_page,
+    get_favorites_page,
+    search_books_page,
     toggle_favorite,
-    count_user_favorites,
-    get_user_favorite_by_index,
     toggle_status,
-    list_book_statuses,
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
@@ -35,6 +35,11 @@ class Reg(StatesGroup):
     photo = State()
 
 
+# --- FSM для пошуку: стан очікування запиту; сам запит лежить у data ---
+class Search(StatesGroup):
+    query = State()
+
+
 # --- Helpers ---
 def _map_statuses_ua(statuses: list[str]) -> str:
     """Перекладає технічні статуси в українські підписи для відображення."""
@@ -45,11 +50,14 @@ def _map_statuses_ua(statuses: list[str]) -> str:
 def _build_book_details_text(
     header: str | None,
     page: int | None,
-    total: int | None,
+    total: int | str | None,
     book: dict,
     include_statuses: bool = True,
 ) -> str:
-    """Створює текст з докладними даними про книгу (назва, автор, жанр, id, статус, улюблене)."""
+    """
+    Створює текст з докладними даними про книгу (назва, автор, жанр, id, статус, улюблене).
+    Статуси беруться з book["statuses"], які шар БД повертає разом з рядком книги.
+    """
     parts: list[str] = []
     if header is not None:
         parts.append(header)
@@ -64,12 +72,38 @@ def _build_book_details_text(
     if "is_favorite" in book:
         parts.append(f"⭐ Улюблена: {'Так' if book.get('is_favorite') else 'ні'}")
     if include_statuses:
-        # list_book_statuses повертає список технічних кодів статусів
-        statuses = _map_statuses_ua(list_book_statuses(book["id"]))
-        parts.append(f"📌 Статус: {statuses}")
+        parts.append(f"📌 Статус: {_map_statuses_ua(book.get('statuses') or [])}")
     return "\n".join(parts)
 
 
+# Каруселі, що гортаються лише за індексом (порядок — релевантність, а не дата)
+_OFFSET_SCOPES = {"search"}
+
+
+def _nav_cb(scope: str, index: int, book: dict, direction: str) -> str:
+    """
+    callback для стрілок каруселі: <scope>:<index>:<created_ts>:<book_id>:<n|p>.
+    index — номер сторінки, яку покажемо; (created_ts, book_id) — поточна книга,
+    від якої робимо keyset-перехід замість OFFSET.
+    """
+    target = index + 1 if direction == "n" else index - 1
+    if scope in _OFFSET_SCOPES:
+        return f"{scope}:{target}"
+    return f"{scope}:{target}:{book['created_ts']}:{book['id']}:{direction}"
+
+
+def _parse_nav(data: str) -> tuple[int, tuple[int, int, str] | None] | None:
+    """Розбирає <scope>:<index> або <scope>:<index>:<created_ts>:<book_id>:<n|p>."""
+    parts = data.split(":")
+    try:
+        index = max(int(parts[1]), 0)
+        if len(parts) == 5 and parts[4] in {"n", "p"}:
+            return index, (int(parts[2]), int(parts[3]), parts[4])
+    except (IndexError, ValueError):
+        return None
+    return index, None
+
+
 # --- Показ головного меню ---
 async def show_main_menu(callback: CallbackQuery):
     """Редагує поточне меню в головне меню (текст + клавіатура)."""
@@ -82,11 +116,11 @@ async def show_main_menu(callback: CallbackQuery):
 @router.message(Command("start"))
 async def cmd_start(message: types.Message):
     """Обробляє /start: видаляє старе меню, відправляє нове."""
-    if message.from_user.id in user_menus:
+    old_menu_id = await user_menus.get(message.from_user.id)
+    if old_menu_id:
+        render_cache.forget(message.chat.id, old_menu_id)
         try:
-            await message.bot.delete_message(
-                message.chat.id, user_menus[message.from_user.id]
-            )
+            await message.bot.delete_message(message.chat.id, old_menu_id)
         except TelegramBadRequest:
             pass
     try:
@@ -101,7 +135,7 @@ async def cmd_start(message: types.Message):
         ),
         reply_markup=kb.first_menu,
     )
-    user_menus[message.from_user.id] = msg.message_id
+    user_menus.set(message.from_user.id, msg.message_id)
 
 
 # --- Хендлери для кожного меню ---
@@ -122,6 +156,8 @@ async def library_open(callback: CallbackQuery):
 @router.callback_query(F.data == "add_book")
 async def open_add_book(callback: CallbackQuery, state: FSMContext):
     """Початок FSM додавання книги — просимо назву."""
+    # Пряме редагування повз edit_menu_message — кеш рендеру вже неактуальний
+    render_cache.forget(callback.message.chat.id, callback.message.message_id)
     await callback.message.edit_text(
         menu_texts["add_book"] + "\n\nВведіть назву книги:",
         reply_markup=menus["add_book"],
@@ -154,11 +190,67 @@ async def open_read_books(callback: CallbackQuery):
 @router.callback_query(F.data == "help")
 async def open_help(callback: CallbackQuery):
     """Показує меню допомоги."""
+    render_cache.forget(callback.message.chat.id, callback.message.message_id)
     await callback.message.edit_text(menu_texts["help"], reply_markup=menus["help"])
     await callback.answer()
 
 
+_SEARCH_PROMPT = "🔍 Пошук\n\nВведіть назву, автора або жанр:"
+
+
 # --- Деталі книги ---
+def _book_place(parts: list[str]) -> tuple[str | None, int | None]:
+    """(scope, index) каруселі, з якої відкрили книгу, з хвоста callback.data."""
+    if len(parts) >= 2:
+        try:
+            return parts[-2], int(parts[-1])
+        except ValueError:
+            pass
+    return None, None
+
+
+def _book_details_markup(book_id: int, scope: str | None, index: int | None):
+    # scope/index передаються далі, щоб після дій повернутись у ту ж карусель
+    place = f":{scope}:{index}" if scope is not None and index is not None else ""
+    builder = InlineKeyboardBuilder()
+    # Дії зі статусом (перемикання)
+    builder.button(
+        text="📕 Хочу прочитати ↔", callback_data=f"sttoggle:in:{book_id}{place}"
+    )
+    builder.button(text="❤️ Улюблена ↔", callback_data=f"favtoggle:{book_id}{place}")
+    builder.button(text="✅ Прочитано ↔", callback_data=f"sttoggle:read:{book_id}{place}")
+    builder.button(text="🗑 Видалити", callback_data=f"delete:{book_id}{place}")
+    # Повернення: у бібліотеку чи результати пошуку на ту ж сторінку
+    if scope == "search" and index is not None:
+        back_btn = InlineKeyboardButton(
+            text="🔍 До результатів", callback_data=f"search:{index}"
+        )
+    else:
+        back_btn = InlineKeyboardButton(
+            text="📚 До бібліотеки",
+            callback_data=(
+                f"lib:{index}" if scope == "lib" and index is not None else "book_list"
+            ),
+        )
+    builder.row(
+        back_btn,
+        InlineKeyboardButton(text="🔙 Головне меню", callback_data="back_main"),
+    )
+    return builder.as_markup()
+
+
+async def render_book_details(
+    callback: CallbackQuery, book: dict, scope: str | None, index: int | None
+):
+    """Показує деталі вже завантаженої книги (без запитів до БД)."""
+    await edit_menu_message(
+        callback=callback,
+        text=_build_book_details_text(None, None, None, book, include_statuses=True),
+        reply_markup=_book_details_markup(book["id"], scope, index),
+        photo_id=book.get("photo_id"),
+    )
+
+
 @router.callback_query(F.data.startswith("book:"))
 async def open_book_details(callback: CallbackQuery):
     """
@@ -169,197 +261,158 @@ async def open_book_details(callback: CallbackQuery):
     scope/index використовуються для коректного повернення у карусель.
     """
     parts = callback.data.split(":")
-    book_id = None
-    scope = None
-    index = None
     try:
-        if len(parts) >= 2:
-            book_id = int(parts[1])
-        if len(parts) >= 4:
-            scope = parts[2]
-            index = int(parts[3])
-    except Exception:
-        book_id = None
-    if book_id is None:
+        book_id = int(parts[1])
+    except (IndexError, ValueError):
         await callback.answer()
         return
-    book = get_book(book_id)
+    book = await get_book(book_id)
     if not book:
         await callback.answer("Книгу не знайдено", show_alert=True)
         return
+    await render_book_details(callback, book, *_book_place(parts[2:]))
+    await callback.answer()
 
-    text = _build_book_details_text(None, None, None, book, include_statuses=True)
-    builder = InlineKeyboardBuilder()
-    # Дії зі статусом (перемикання)
-    builder.button(
-        text="📕 Хочу прочитати ↔", callback_data=f"sttoggle:in:{book['id']}"
-    )
-    builder.button(text="❤️ Улюблена ↔", callback_data=f"favtoggle:{book['id']}")
-    builder.button(text="✅ Прочитано ↔", callback_data=f"sttoggle:read:{book['id']}")
-    # Кнопка для видалення книги — додаємо scope/index, якщо є
-    if scope is not None and index is not None:
-        builder.button(
-            text="🗑 Видалити", callback_data=f"delete:{book['id']}:{scope}:{index}"
-        )
+
+# --- Каруселі ---
+# scope -> (заголовок, текст для порожньої каруселі, чи показувати статуси)
+_CAROUSELS = {
+    "lib": (menu_texts["book_list"], "\n\nНічого не знайдено.", True),
+    "in": (menu_texts["in_process"], "\n\nУ вас ще немає книг.", False),
+    "read": (menu_texts["read_books"], "\n\nУ вас ще немає книг.", False),
+    "fav": (menu_texts["favorite_books"], "\n\nУ вас ще немає улюблених книг.", False),
+}
+
+
+async def _fetch_carousel_page(
+    user_id: int, scope: str, index: int, cursor: tuple[int, int, str] | None = None
+) -> tuple[dict | None, int]:
+    """Книга на позиції index та розмір каруселі scope."""
+    if scope == "lib":
+        book, total = await get_lib_page(index, cursor)
+    elif scope == "fav":
+        book, total = await get_favorites_page(user_id, index, cursor)
     else:
-        builder.button(text="🗑 Видалити", callback_data=f"delete:{book['id']}")
-    # Повернення: або в бібліотеку на ту ж сторінку, або в головне меню
-    back_to_library_cb = (
-        f"lib:{index}" if scope == "lib" and isinstance(index, int) else "book_list"
+        book, total = await get_status_page(user_id, scope, index, cursor)
+    if book is None and 0 < total <= index:
+        # Індекс вийшов за межі (наприклад, після видалення) — показуємо останню
+        return await _fetch_carousel_page(user_id, scope, total - 1)
+    return book, total
+
+
+async def _build_carousel_page(user_id: int, scope: str, index: int) -> dict | None:
+    """Сторінка каруселі разом з готовим підписом (для prefetch)."""
+    book, total = await _fetch_carousel_page(user_id, scope, index)
+    if book is None:
+        return None
+    header, _, include_statuses = _CAROUSELS[scope]
+    text = _build_book_details_text(
+        header, index + 1, total, book, include_statuses=include_statuses
     )
-    builder.row(
-        InlineKeyboardButton(text="📚 До бібліотеки", callback_data=back_to_library_cb),
-        InlineKeyboardButton(text="🔙 Головне меню", callback_data="back_main"),
+    return {"book": book, "total": total, "text": text}
+
+
+def _carousel_markup(scope: str, index: int, total: int, book: dict):
+    """Навігація каруселі: вліво, деталі, вправо, назад."""
+    builder = InlineKeyboardBuilder()
+    builder.button(
+        text="⬅️",
+        callback_data=_nav_cb(scope, index, book, "p") if index > 0 else "noop",
     )
-    await edit_menu_message(
-        callback=callback,
-        text=text,
-        reply_markup=builder.as_markup(),
-        photo_id=book.get("photo_id"),
+    builder.button(text="🔎 Деталі", callback_data=f"book:{book['id']}:{scope}:{index}")
+    builder.button(
+        text="➡️",
+        callback_data=_nav_cb(scope, index, book, "n") if index < total - 1 else "noop",
     )
-    await callback.answer()
+    builder.row(InlineKeyboardButton(text="🔙 Головне меню", callback_data="back_main"))
+    return builder.as_markup()
 
 
-# --- Карусель книг ---
-async def render_book_carousel(callback: CallbackQuery, scope: str, index: int):
-    """Рендерить карусель всієї бібліотеки (по індексу)."""
-    if scope == "lib":
-        total = count_all_books()
-        book = get_all_book_by_index(index)
-        header = menu_texts["book_list"]
-        left_cb = f"lib:{index-1}"
-        right_cb = f"lib:{index+1}"
+async def _render_carousel(
+    callback: CallbackQuery,
+    scope: str,
+    index: int,
+    cursor: tuple[int, int, str] | None = None,
+):
+    user_id = callback.from_user.id
+    header, empty_text, include_statuses = _CAROUSELS[scope]
+    text = None
+    # Сусідню сторінку могли вже підтягнути у фоні — тоді без запиту до БД
+    page = prefetcher.get(user_id, scope, index)
+    if page is not None:
+        book, total, text = page["book"], page["total"], page["text"]
     else:
-        # Fallback: показуємо бібліотеку
-        total = count_all_books()
-        book = get_all_book_by_index(index)
-        header = menu_texts["book_list"]
-        left_cb = f"lib:{index-1}"
-        right_cb = f"lib:{index+1}"
-
-    builder = InlineKeyboardBuilder()
+        book, total = await _fetch_carousel_page(user_id, scope, index, cursor)
 
     if total == 0 or not book:
-        text = header + (
-            "\n\nНічого не знайдено." if scope == "lib" else "\n\nУ вас ще немає книг."
+        await edit_menu_message(
+            callback, text=header + empty_text, reply_markup=kb.back_menu()
         )
-        builder.button(text="🔙 Назад у головне меню", callback_data="back_main")
-        builder.adjust(1)
-        await edit_menu_message(callback, text=text, reply_markup=builder.as_markup())
         return
 
-    page = index + 1
-    text = _build_book_details_text(header, page, total, book, include_statuses=True)
-
-    # Навігація: вліво, деталі, вправо, назад
-    builder.button(text="⬅️", callback_data=left_cb if index > 0 else "noop")
-    builder.button(text="🔎 Деталі", callback_data=f"book:{book['id']}:lib:{index}")
-    builder.button(text="➡️", callback_data=right_cb if index < total - 1 else "noop")
-    builder.row(InlineKeyboardButton(text="🔙 Головне меню", callback_data="back_main"))
+    index = min(index, total - 1)
+    if text is None:
+        text = _build_book_details_text(
+            header, index + 1, total, book, include_statuses=include_statuses
+        )
     await edit_menu_message(
         callback=callback,
         text=text,
-        reply_markup=builder.as_markup(),
+        reply_markup=_carousel_markup(scope, index, total, book),
         photo_id=book.get("photo_id"),
     )
+    prefetcher.schedule(
+        user_id,
+        scope,
+        index,
+        total,
+        lambda i: _build_carousel_page(user_id, scope, i),
+    )
+
+
+async def render_book_carousel(
+    callback: CallbackQuery,
+    scope: str,
+    index: int,
+    cursor: tuple[int, int, str] | None = None,
+):
+    """Рендерить карусель всієї бібліотеки (по індексу або keyset-курсору)."""
+    # scope відмінний від "lib" — fallback: показуємо бібліотеку
+    await _render_carousel(callback, "lib", index, cursor)
 
 
 # --- Карусель за статусом користувача ---
-async def render_status_carousel(callback: CallbackQuery, status: str, index: int):
+async def render_status_carousel(
+    callback: CallbackQuery,
+    status: str,
+    index: int,
+    cursor: tuple[int, int, str] | None = None,
+):
     """Рендер каруселі для статусів 'in' та 'read'."""
-    user_id = callback.from_user.id
-    if status == "in":
-        header = menu_texts["in_process"]
-        total = count_user_books_by_status_m2m(user_id, "in")
-        book = get_user_book_by_status_and_index_m2m(user_id, "in", index)
-        left_cb = f"in:{index-1}"
-        right_cb = f"in:{index+1}"
-    elif status == "fav":
-        # За сумісництвом; фактично використовується окрема карусель
-        header = menu_texts["favorite_books"]
-        total = count_user_favorites(user_id)
-        book = get_user_favorite_by_index(user_id, index)
-        left_cb = f"fav:{index-1}"
-        right_cb = f"fav:{index+1}"
-    elif status == "read":
-        header = menu_texts["read_books"]
-        total = count_user_books_by_status_m2m(user_id, "read")
-        book = get_user_book_by_status_and_index_m2m(user_id, "read", index)
-        left_cb = f"read:{index-1}"
-        right_cb = f"read:{index+1}"
+    if status in {"in", "read", "fav"}:
+        # "fav" — за сумісництвом; фактично використовується окрема карусель
+        await _render_carousel(callback, status, index, cursor)
     else:
         # некоректний статус -> показуємо бібліотеку
         await render_book_carousel(callback, scope="lib", index=0)
-        return
-
-    builder = InlineKeyboardBuilder()
-
-    if total == 0 or not book:
-        text = header + "\n\nУ вас ще немає книг."
-        builder.button(text="🔙 Назад у головне меню", callback_data="back_main")
-        builder.adjust(1)
-        await edit_menu_message(callback, text=text, reply_markup=builder.as_markup())
-        return
-
-    page = index + 1
-    text = _build_book_details_text(header, page, total, book, include_statuses=False)
-
-    builder.button(text="⬅️", callback_data=left_cb if index > 0 else "noop")
-    builder.button(text="🔎 Деталі", callback_data=f"book:{book['id']}:in:{index}")
-    builder.button(text="➡️", callback_data=right_cb if index < total - 1 else "noop")
-    builder.row(InlineKeyboardButton(text="🔙 Головне меню", callback_data="back_main"))
-    await edit_menu_message(
-        callback=callback,
-        text=text,
-        reply_markup=builder.as_markup(),
-        photo_id=book.get("photo_id"),
-    )
 
 
 # --- Карусель улюблених ---
-async def render_favorites_carousel(callback: CallbackQuery, index: int):
+async def render_favorites_carousel(
+    callback: CallbackQuery, index: int, cursor: tuple[int, int, str] | None = None
+):
     """Рендерує карусель улюблених книг користувача."""
-    user_id = callback.from_user.id
-    header = menu_texts["favorite_books"]
-    total = count_user_favorites(user_id)
-    book = get_user_favorite_by_index(user_id, index)
-
-    builder = InlineKeyboardBuilder()
-
-    if total == 0 or not book:
-        text = header + "\n\nУ вас ще немає улюблених книг."
-        builder.button(text="🔙 Назад у головне меню", callback_data="back_main")
-        builder.adjust(1)
-        await edit_menu_message(callback, text=text, reply_markup=builder.as_markup())
-        return
-
-    page = index + 1
-    text = _build_book_details_text(header, page, total, book, include_statuses=False)
-
-    builder.button(text="⬅️", callback_data=(f"fav:{index-1}" if index > 0 else "noop"))
-    builder.button(text="🔎 Деталі", callback_data=f"book:{book['id']}:fav:{index}")
-    builder.button(
-        text="➡️", callback_data=(f"fav:{index+1}" if index < total - 1 else "noop")
-    )
-    builder.row(InlineKeyboardButton(text="🔙 Головне меню", callback_data="back_main"))
-    await edit_menu_message(
-        callback=callback,
-        text=text,
-        reply_markup=builder.as_markup(),
-        photo_id=book.get("photo_id"),
-    )
+    await _render_carousel(callback, "fav", index, cursor)
 
 
 @router.callback_query(F.data.startswith("lib:"))
 async def carousel_lib_nav(callback: CallbackQuery):
-    try:
-        index = int(callback.data.split(":", 1)[1])
-    except Exception:
+    nav = _parse_nav(callback.data)
+    if nav is None:
         await callback.answer()
         return
-    if index < 0:
-        index = 0
-    await render_book_carousel(callback, scope="lib", index=index)
+    index, cursor = nav
+    await render_book_carousel(callback, scope="lib", index=index, cursor=cursor)
     await callback.answer()
 
 
@@ -372,40 +425,115 @@ async def carousel_my_nav(callback: CallbackQuery):
 
 @router.callback_query(F.data.startswith("in:"))
 async def carousel_in_nav(callback: CallbackQuery):
-    try:
-        index = int(callback.data.split(":", 1)[1])
-    except Exception:
+    nav = _parse_nav(callback.data)
+    if nav is None:
         await callback.answer()
         return
-    if index < 0:
-        index = 0
-    await render_status_carousel(callback, status="in", index=index)
+    index, cursor = nav
+    await render_status_carousel(callback, status="in", index=index, cursor=cursor)
     await callback.answer()
 
 
 @router.callback_query(F.data.startswith("fav:"))
 async def carousel_fav_nav(callback: CallbackQuery):
-    try:
-        index = int(callback.data.split(":", 1)[1])
-    except Exception:
+    nav = _parse_nav(callback.data)
+    if nav is None:
         await callback.answer()
         return
-    if index < 0:
-        index = 0
-    await render_favorites_carousel(callback, index=index)
+    index, cursor = nav
+    await render_favorites_carousel(callback, index=index, cursor=cursor)
     await callback.answer()
 
 
 @router.callback_query(F.data.startswith("read:"))
 async def carousel_read_nav(callback: CallbackQuery):
-    try:
-        index = int(callback.data.split(":", 1)[1])
-    except Exception:
+    nav = _parse_nav(callback.data)
+    if nav is None:
         await callback.answer()
         return
-    if index < 0:
-        index = 0
-    await render_status_carousel(callback, status="read", index=index)
+    index, cursor = nav
+    await render_status_carousel(callback, status="read", index=index, cursor=cursor)
+    await callback.answer()
+
+
+# --- Пошук ---
+async def _search_view(query: str, index: int) -> tuple[str, object, str | None]:
+    """Текст, клавіатура та фото сторінки результатів пошуку (за релевантністю bm25)."""
+    book, total = await search_books_page(query, index)
+    # Понад SEARCH_LIMIT збігів гортаються лише перші SEARCH_LIMIT
+    pages = min(total, SEARCH_LIMIT)
+    if book is None and 0 < pages <= index:
+        index = pages - 1
+        book, total = await search_books_page(query, index)
+    header = f"🔍 Пошук: {query}"
+    if book is None:
+        return header + "\n\nНічого не знайдено.", kb.back_menu(), None
+    shown_total = f"{SEARCH_LIMIT}+" if total > SEARCH_LIMIT else total
+    text = _build_book_details_text(header, index + 1, shown_total, book, include_statuses=True)
+    return text, _carousel_markup("search", index, pages, book), book.get("photo_id")
+
+
+async def _replace_menu(
+    message: types.Message, text: str, reply_markup, photo_id: str | None = None
+):
+    """Прибирає повідомлення користувача і старе меню, надсилає нове."""
+    try:
+        await message.delete()
+    except TelegramBadRequest:
+        pass
+    old_menu_id = await user_menus.get(message.from_user.id)
+    if old_menu_id:
+        render_cache.forget(message.chat.id, old_menu_id)
+        try:
+            await message.bot.delete_message(message.chat.id, old_menu_id)
+        except TelegramBadRequest:
+            pass
+    await _send_menu(
+        message.bot, message.chat.id, message.from_user.id, text, reply_markup, photo_id
+    )
+
+
+async def _show_search_results(message: types.Message, state: FSMContext, query: str):
+    # Запит зберігаємо у FSM data — за ним гортається карусель результатів
+    await state.set_state(None)
+    await state.update_data(search_query=query)
+    text, markup, photo_id = await _search_view(query, 0)
+    await _replace_menu(message, text, markup, photo_id)
+
+
+@router.message(Command("search"))
+async def cmd_search(message: types.Message, command: CommandObject, state: FSMContext):
+    """/search <запит> — одразу результати; /search без запиту — питаємо запит."""
+    query = (command.args or "").strip()
+    if query:
+        await _show_search_results(message, state, query)
+        return
+    await state.set_state(Search.query)
+    await _replace_menu(message, _SEARCH_PROMPT, kb.back_menu())
+
+
+@router.callback_query(F.data == "search")
+async def open_search(callback: CallbackQuery, state: FSMContext):
+    """Кнопка пошуку в головному меню — просимо запит."""
+    await edit_menu_message(callback, text=_SEARCH_PROMPT, reply_markup=kb.back_menu())
+    await state.set_state(Search.query)
+    await callback.answer()
+
+
+@router.message(Search.query, F.text)
+async def search_query_entered(message: types.Message, state: FSMContext):
+    await _show_search_results(message, state, message.text.strip())
+
+
+@router.callback_query(F.data.startswith("search:"))
+async def carousel_search_nav(callback: CallbackQuery, state: FSMContext):
+    nav = _parse_nav(callback.data)
+    query = (await state.get_data()).get("search_query")
+    if nav is None or not query:
+        await callback.answer("Пошук застарів, надішліть /search ще раз", show_alert=True)
+        return
+    text, markup, photo_id = await _search_view(query, nav[0])
+    await edit_menu_message(callback, text=text, reply_markup=markup, photo_id=photo_id)
     await callback.answer()
 
 
@@ -416,110 +544,173 @@ async def noop_btn(callback: CallbackQuery):
 
 @router.callback_query(F.data.startswith("sttoggle:"))
 async def toggle_status_handler(callback: CallbackQuery):
+    """sttoggle:<in|read>:<book_id>[:<scope>:<index>]"""
+    parts = callback.data.split(":")
     try:
-        _, status, book_id_str = callback.data.split(":", 2)
-        book_id = int(book_id_str)
-        if status not in {"in", "read"}:
-            await callback.answer()
-            return
-    except Exception:
+        status, book_id = parts[1], int(parts[2])
+    except (IndexError, ValueError):
+        await callback.answer()
+        return
+    if status not in {"in", "read"}:
         await callback.answer()
         return
 
     try:
-        new_val = toggle_status(book_id, status)
-        # взаємовиключність забезпечена у БД: якщо вмикаємо один — вимикається інший
-        ua = "Хочу прочитати" if status == "in" else "Прочитана"
-        await callback.answer(
-            ("Додано статус " + ua) if new_val else ("Знято статус " + ua)
-        )
+        # Взаємовиключність забезпечена у БД; повертається вже оновлена книга
+        book = await toggle_status(book_id, status)
     except Exception:
         await callback.answer("Помилка оновлення статусу", show_alert=True)
         return
-
-    try:
-        await open_book_details(callback)
-    except Exception:
-        await callback.answer()
+    if book is None:
+        await callback.answer("Книгу не знайдено", show_alert=True)
+        return
+    # Підписи в бібліотеці показують статуси, тож скидаємо і "lib" для всіх
+    prefetcher.invalidate(callback.from_user.id, scope="lib")
+    ua = "Хочу прочитати" if status == "in" else "Прочитана"
+    await render_book_details(callback, book, *_book_place(parts[3:]))
+    await callback.answer(
+        ("Додано статус " + ua) if status in book["statuses"] else ("Знято статус " + ua)
+    )
 
 
 @router.callback_query(F.data.startswith("favtoggle:"))
 async def toggle_fav(callback: CallbackQuery):
+    """favtoggle:<book_id>[:<scope>:<index>]"""
+    parts = callback.data.split(":")
     try:
-        book_id = int(callback.data.split(":", 1)[1])
-    except Exception:
+        book_id = int(parts[1])
+    except (IndexError, ValueError):
         await callback.answer()
         return
     try:
-        new_val = toggle_favorite(book_id)
-        await callback.answer(
-            "Додано до улюблених" if new_val else "Прибрано з улюблених"
-        )
+        book = await toggle_favorite(book_id)
     except Exception:
         await callback.answer("Помилка оновлення улюбленого", show_alert=True)
         return
-    try:
-        await open_book_details(callback)
-    except Exception:
-        await callback.answer()
+    if book is None:
+        await callback.answer("Книгу не знайдено", show_alert=True)
+        return
+    prefetcher.invalidate(callback.from_user.id, scope="lib")
+    await render_book_details(callback, book, *_book_place(parts[2:]))
+    await callback.answer(
+        "Додано до улюблених" if book["is_favorite"] else "Прибрано з улюблених"
+    )
 
 
 # --- Допоміжне: показ у одному повідомленні (фото+підпис або текст) ---
+_BAD_PHOTO_ERRORS = (
+    "wrong file identifier",
+    "wrong remote file",
+    "file_id",
+    "failed to get http url content",
+    "wrong type of the web page content",
+    "image_process_failed",
+    "photo_invalid_dimensions",
+)
+
+
+def _is_not_modified(error: TelegramBadRequest) -> bool:
+    return "message is not modified" in str(error)
+
+
+def _is_bad_photo(error: TelegramBadRequest) -> bool:
+    message = str(error).lower()
+    return any(marker in message for marker in _BAD_PHOTO_ERRORS)
+
+
+async def _send_menu(
+    bot,
+    chat_id: int,
+    user_id: int,
+    text: str,
+    reply_markup,
+    photo_id: str | None,
+):
+    """Надсилає нове меню-повідомлення та запам'ятовує його."""
+    sent = None
+    if photo_id:
+        try:
+            sent = await bot.send_photo(
+                chat_id=chat_id, photo=photo_id, caption=text, reply_markup=reply_markup
+            )
+        except TelegramBadRequest as e:
+            if not _is_bad_photo(e):
+                raise
+            # Фото недоступне — більше його не пробуємо, показуємо текст
+            render_cache.mark_photo_failed(photo_id)
+            photo_id = None
+    if sent is None:
+        sent = await bot.send_message(
+            chat_id=chat_id, text=text, reply_markup=reply_markup
+        )
+    user_menus.set(user_id, sent.message_id)
+    render_cache.remember(
+        chat_id,
+        sent.message_id,
+        render_cache.fingerprint(text, reply_markup, photo_id),
+        "photo" if photo_id else "text",
+    )
+
+
 async def edit_menu_message(
     callback: CallbackQuery, text: str, reply_markup, photo_id: str | None = None
 ):
     msg = callback.message
     chat_id = msg.chat.id
-    user_id = callback.from_user.id
+    if photo_id and render_cache.photo_failed(photo_id):
+        photo_id = None
+    fingerprint = render_cache.fingerprint(text, reply_markup, photo_id)
+    # Той самий рендер уже на екрані — жодного запиту до API
+    if render_cache.unchanged(chat_id, msg.message_id, fingerprint):
+        return
+    kind = render_cache.kind(chat_id, msg.message_id)
+    is_photo = kind == "photo" if kind else bool(getattr(msg, "photo", None))
     # Ефективна стратегія: якщо є photo_id — віддаємо перевагу фото
     # 1) якщо повідомлення вже фото — редагуємо медіа
-    # 2) якщо повідомлення текст — замінюємо на фото
+    # 2) якщо тип повідомлення не збігається — замінюємо повідомлення
     # 3) якщо фото немає — редагуємо текст
-    if photo_id and msg.photo:
+    if photo_id and is_photo:
         try:
             await msg.edit_media(
                 media=InputMediaPhoto(media=photo_id, caption=text),
                 reply_markup=reply_markup,
             )
+            render_cache.remember(chat_id, msg.message_id, fingerprint, "photo")
             return
+        except TelegramBadRequest as e:
+            if _is_not_modified(e):
+                render_cache.remember(chat_id, msg.message_id, fingerprint, "photo")
+                return
+            if _is_bad_photo(e):
+                render_cache.mark_photo_failed(photo_id)
+                await edit_menu_message(callback, text, reply_markup)
+                return
         except Exception:
             pass
-    if photo_id and not msg.photo:
+    if bool(photo_id) != is_photo:
         try:
             await msg.delete()
         except Exception:
             pass
-        sent = await callback.bot.send_photo(
-            chat_id=chat_id, photo=photo_id, caption=text, reply_markup=reply_markup
+        render_cache.forget(chat_id, msg.message_id)
+        await _send_menu(
+            callback.bot, chat_id, callback.from_user.id, text, reply_markup, photo_id
         )
-        user_menus[user_id] = sent.message_id
-        return
-    # Якщо потрібно показати текст, а поточне повідомлення з фото — замінюємо коректно
-    if not photo_id and msg.photo:
-        try:
-            await msg.delete()
-        except Exception:
-            pass
-        sent = await callback.bot.send_message(
-            chat_id=chat_id, text=text, reply_markup=reply_markup
-        )
-        user_menus[user_id] = sent.message_id
         return
     try:
         await msg.edit_text(text=text, reply_markup=reply_markup)
+        render_cache.remember(chat_id, msg.message_id, fingerprint, "text")
         return
+    except TelegramBadRequest as e:
+        if _is_not_modified(e):
+            render_cache.remember(chat_id, msg.message_id, fingerprint, "text")
+            return
     except Exception:
         pass
     # Fallback: відправляємо нове повідомлення того ж типу, без зайвих delete
-    if photo_id:
-        sent = await callback.bot.send_photo(
-            chat_id=chat_id, photo=photo_id, caption=text, reply_markup=reply_markup
-        )
-    else:
-        sent = await callback.bot.send_message(
-            chat_id=chat_id, text=text, reply_markup=reply_markup
-        )
-    user_menus[user_id] = sent.message_id
+    await _send_menu(
+        callback.bot, chat_id, callback.from_user.id, text, reply_markup, photo_id
+    )
 
 
 # --- Повернення у головне меню ---
@@ -538,8 +729,9 @@ async def add_book_name(message: types.Message, state: FSMContext):
     except TelegramBadRequest:
         pass
 
-    menu_id = user_menus.get(message.from_user.id)
+    menu_id = await user_menus.get(message.from_user.id)
     if menu_id:
+        render_cache.forget(message.chat.id, menu_id)
         try:
             await message.bot.edit_message_text(
                 chat_id=message.chat.id,
@@ -563,8 +755,9 @@ async def add_book_author(message: types.Message, state: FSMContext):
     except TelegramBadRequest:
         pass
 
-    menu_id = user_menus.get(message.from_user.id)
+    menu_id = await user_menus.get(message.from_user.id)
     if menu_id:
+        render_cache.forget(message.chat.id, menu_id)
         try:
             await message.bot.edit_message_text(
                 chat_id=message.chat.id,
@@ -588,8 +781,9 @@ async def add_book_genre(message: types.Message, state: FSMContext):
     except TelegramBadRequest:
         pass
 
-    menu_id = user_menus.get(message.from_user.id)
+    menu_id = await user_menus.get(message.from_user.id)
     if menu_id:
+        render_cache.forget(message.chat.id, menu_id)
         try:
             await message.bot.edit_message_text(
                 chat_id=message.chat.id,
@@ -624,7 +818,7 @@ async def add_book_photo(message: types.Message, state: FSMContext):
 
     # Зберігаємо книгу в базу
     try:
-        book_id = add_book_for_user(
+        book_id = await add_book_for_user(
             tg_user_id=message.from_user.id,
             name=data["name"],
             author=data["author"],
@@ -632,6 +826,7 @@ async def add_book_photo(message: types.Message, state: FSMContext):
             photo_id=data.get("photo"),
             status="my",
         )
+        prefetcher.invalidate(message.from_user.id, scope="lib")
     except Exception:
         book_id = None
 
@@ -644,8 +839,9 @@ async def add_book_photo(message: types.Message, state: FSMContext):
     )
 
     # Повертаємо користувача в головне меню
-    menu_id = user_menus.get(message.from_user.id)
+    menu_id = await user_menus.get(message.from_user.id)
     if menu_id:
+        render_cache.forget(message.chat.id, menu_id)
         try:
             await message.bot.edit_message_text(
                 chat_id=message.chat.id,
@@ -679,7 +875,7 @@ async def asgore(message: types.Message):
 
 
 @router.callback_query(F.data.startswith("delete:"))
-async def delete_book_handler(callback: CallbackQuery):
+async def delete_book_handler(callback: CallbackQuery, state: FSMContext):
     try:
         parts = callback.data.split(":")
         book_id = int(parts[1])
@@ -689,41 +885,25 @@ async def delete_book_handler(callback: CallbackQuery):
         await callback.answer("Невірні дані", show_alert=True)
         return
 
-    from app.db import (
-        delete_book,
-        count_all_books,
-        count_user_books_by_status_m2m,
-        count_user_favorites,
-    )
+    from app.db_async import delete_book
 
     # Спроба видалити книгу
-    if delete_book(book_id):
+    if await delete_book(book_id):
+        prefetcher.invalidate(callback.from_user.id, scope="lib")
         await callback.answer("Книгу видалено")
     else:
         await callback.answer("Не вдалося видалити книгу", show_alert=True)
         return
 
-    # Оновлюємо перегляд залежно від scope
-    user_id = callback.from_user.id
+    # Оновлюємо перегляд залежно від scope; рендер сам підтягне індекс у межі
     if scope == "lib":
-        total = count_all_books()
-        new_index = index if index < total else max(total - 1, 0)
-        await render_book_carousel(callback, scope="lib", index=new_index)
-    elif scope == "in":
-        from app.db import get_user_book_by_status_and_index_m2m
-
-        total = count_user_books_by_status_m2m(user_id, "in")
-        new_index = index if index < total else max(total - 1, 0)
-        await render_status_carousel(callback, status="in", index=new_index)
-    elif scope == "read":
-        from app.db import get_user_book_by_status_and_index_m2m
-
-        total = count_user_books_by_status_m2m(user_id, "read")
-        new_index = index if index < total else max(total - 1, 0)
-        await render_status_carousel(callback, status="read", index=new_index)
+        await render_book_carousel(callback, scope="lib", index=index)
+    elif scope in {"in", "read"}:
+        await render_status_carousel(callback, status=scope, index=index)
     elif scope == "fav":
-        total = count_user_favorites(user_id)
-        new_index = index if index < total else max(total - 1, 0)
-        await render_favorites_carousel(callback, index=new_index)
+        await render_favorites_carousel(callback, index=index)
+    elif scope == "search" and (query := (await state.get_data()).get("search_query")):
+        text, markup, photo_id = await _search_view(query, index)
+        await edit_menu_message(callback, text=text, reply_markup=markup, photo_id=photo_id)
     else:
         await show_main_menu(callback)
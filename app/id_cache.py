@@ -0,0 +1,155 @@
+"""In-process cache of ordered book IDs per carousel scope.
+
+Each entry maps (owner, scope) to an array('q') of book IDs in carousel order
+(created_at DESC, id DESC), so index -> book_id and the scope total are O(1).
+owner is the Telegram user ID for "in"/"read"/"fav" and GLOBAL for the
+library, which lists every book. Memory is capped by the total number of
+cached IDs; least recently used entries are evicted first.
+
+Worker processes (app.workers) turn the cache off: other workers change the
+same scopes, and their hooks only reach their own cache.
+"""
+
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional, Tuple
+
+GLOBAL = 0
+
+Key = Tuple[int, str]
+
+
+class IdCache:
+    def __init__(
+        self,
+        max_ids: int = 2_000_000,
+        max_entry_ids: int = 200_000,
+        max_oversized: int = 10_000,
+    ):
+        # 8 bytes per ID: the default cap keeps the cache around 16MB
+        self.max_ids = max_ids
+        self.max_entry_ids = max_entry_ids
+        self.max_oversized = max_oversized
+        self._entries: "OrderedDict[Key, array]" = OrderedDict()
+        # Scopes known to exceed max_entry_ids, least recently seen first; a
+        # forgotten one only costs another capped load
+        self._oversized: "OrderedDict[Key, None]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        # False: every lookup misses and callers use SQL pagination
+        self.enabled = True
+
+    def get_or_load(
+        self, key: Key, loader: Callable[[int], Iterable[int]]
+    ) -> Optional[array]:
+        """Returns cached IDs, loading them on a miss.
+
+        loader(limit) must yield at most limit IDs in carousel order. Scopes
+        larger than max_entry_ids are not cached and yield None, so callers
+        fall back to SQL pagination.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            ids = self._entries.get(key)
+            if ids is not None:
+                self._entries.move_to_end(key)
+                return ids
+            if key in self._oversized:
+                self._oversized.move_to_end(key)
+                return None
+        ids = array("q", loader(self.max_entry_ids + 1))
+        with self._lock:
+            if len(ids) > self.max_entry_ids:
+                self._mark_oversized(key)
+                return None
+            self._store(key, ids)
+        return ids
+
+    def _store(self, key: Key, ids: array) -> None:
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = ids
+        self._size += len(ids)
+        while self._size > self.max_ids and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _mark_oversized(self, key: Key) -> None:
+        self._oversized[key] = None
+        self._oversized.move_to_end(key)
+        while len(self._oversized) > self.max_oversized:
+            self._oversized.popitem(last=False)
+
+    def invalidate(self, *keys: Key) -> None:
+        with self._lock:
+            for key in keys:
+                self._oversized.pop(key, None)
+                ids = self._entries.pop(key, None)
+                if ids is not None:
+                    self._size -= len(ids)
+
+    def prepend(self, key: Key, book_id: int) -> None:
+        """Adds a newly created (hence newest) book to the front of a scope."""
+        with self._lock:
+            ids = self._entries.get(key)
+            if ids is None:
+                return
+            if len(ids) >= self.max_entry_ids:
+                self._size -= len(self._entries.pop(key))
+                self._mark_oversized(key)
+                return
+            ids.insert(0, book_id)
+            self._size += 1
+
+    def insert(
+        self, key: Key, book_id: int, position: Callable[[array], Optional[int]]
+    ) -> None:
+        """Adds a book that joined a scope at position(ids) in carousel order.
+
+        position returns None when it cannot place the book (the cached IDs
+        look stale); the scope is then dropped and reloaded on next use.
+        """
+        with self._lock:
+            ids = self._entries.get(key)
+            if ids is None or book_id in ids:
+                return
+            index = position(ids)
+            if index is None or len(ids) >= self.max_entry_ids:
+                self._size -= len(self._entries.pop(key))
+                if index is not None:
+                    self._mark_oversized(key)
+                return
+            ids.insert(index, book_id)
+            self._size += 1
+
+    def discard(self, keys: Iterable[Key], book_id: int) -> None:
+        with self._lock:
+            for key in keys:
+                ids = self._entries.get(key)
+                if ids is None:
+                    continue
+                try:
+                    ids.remove(book_id)
+                except ValueError:
+                    continue
+                self._size -= 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._oversized.clear()
+            self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+
+id_cache = IdCache()
+
+
+def user_keys(tg_user_id: int, *scopes: str) -> list[Key]:
+    return [(tg_user_id, scope) for scope in scopes]
+
@@ -0,0 +1,141 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from aiogram import Router
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import (
+    InlineQuery,
+    InlineQueryResultArticle,
+    InlineQueryResultCachedPhoto,
+    InputTextMessageContent,
+)
+
+from app.db_async import search_user_books
+from app.logger import logger
+
+router = Router()
+
+# Telegram показує до 50 результатів за раз; решта — через next_offset
+PAGE_SIZE = 20
+# Скільки Telegram кешує відповідь на своєму боці. Результати персональні
+# (is_personal), тож короткий час: нова книга з'являється в пошуку майже одразу
+CACHE_TIME = 10
+
+
+class InlineResultsCache:
+    """
+    Короткоживучий кеш сторінок inline-пошуку: (user_id, запит, offset) ->
+    (результати, next_offset). Inline-запити приходять на кожне натискання
+    клавіші, тож стирання і повторний набір того самого префікса не йдуть у БД.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_entries: int = 10_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._items: "OrderedDict[tuple[int, str, str], tuple[float, list, str]]" = (
+            OrderedDict()
+        )
+
+    def get(self, key: tuple[int, str, str]) -> tuple[list, str] | None:
+        entry = self._items.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        self._items.move_to_end(key)
+        return entry[1], entry[2]
+
+    def put(self, key: tuple[int, str, str], results: list, next_offset: str) -> None:
+        self._items[key] = (time.monotonic() + self.ttl, results, next_offset)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+
+inline_cache = InlineResultsCache()
+# Останній незавершений пошук кожного користувача
+_inflight: dict[int, asyncio.Task] = {}
+
+
+def _book_caption(book: dict) -> str:
+    return f"📖 {book['name']}\n👤 {book['author']}\n🎭 {book['genre']}"
+
+
+def _book_result(book: dict):
+    caption = _book_caption(book)
+    if book.get("photo_id"):
+        return InlineQueryResultCachedPhoto(
+            id=str(book["id"]),
+            photo_file_id=book["photo_id"],
+            title=book["name"],
+            description=f"{book['author']} · {book['genre']}",
+            caption=caption,
+        )
+    return InlineQueryResultArticle(
+        id=str(book["id"]),
+        title=book["name"],
+        description=f"{book['author']} · {book['genre']}",
+        input_message_content=InputTextMessageContent(message_text=caption),
+    )
+
+
+def _parse_offset(offset: str) -> int | None:
+    """offset — id останньої книги попередньої сторінки (порожній для першої)."""
+    try:
+        return int(offset) if offset else None
+    except ValueError:
+        return None
+
+
+async def _lookup(user_id: int, query: str, offset: str) -> tuple[list, str] | None:
+    """Сторінка результатів або None, якщо новіший запит користувача її витіснив."""
+    key = (user_id, query, offset)
+    cached = inline_cache.get(key)
+    if cached is not None:
+        return cached
+
+    # Попередній пошук цього користувача вже нікому не потрібен: Telegram чекає
+    # відповідь лише на останній запит. Скасований пошук, що ще стоїть у черзі
+    # потоку БД, туди так і не потрапить.
+    previous = _inflight.get(user_id)
+    if previous is not None:
+        previous.cancel()
+    task = asyncio.ensure_future(
+        search_user_books(user_id, query, PAGE_SIZE + 1, _parse_offset(offset))
+    )
+    _inflight[user_id] = task
+    try:
+        books = await task
+    except asyncio.CancelledError:
+        if task.cancelled():
+            return None
+        raise
+    finally:
+        if _inflight.get(user_id) is task:
+            del _inflight[user_id]
+
+    page = books[:PAGE_SIZE]
+    next_offset = str(page[-1]["id"]) if len(books) > PAGE_SIZE else ""
+    results = [_book_result(book) for book in page]
+    inline_cache.put(key, results, next_offset)
+    return results, next_offset
+
+
+@router.inline_query()
+async def inline_books(inline_query: InlineQuery):
+    """@bot <запит> — книги користувача для вставки в будь-який чат."""
+    page = await _lookup(
+        inline_query.from_user.id, inline_query.query.strip(), inline_query.offset
+    )
+    if page is None:
+        return
+    results, next_offset = page
+    try:
+        await inline_query.answer(
+            results,
+            cache_time=CACHE_TIME,
+            is_personal=True,
+            next_offset=next_offset,
+        )
+    except TelegramBadRequest as e:
+        # Запит застарів, поки шукали (користувач уже набрав далі)
+        logger.debug(f"Inline-відповідь не прийнято: {e}")
@@ -10,7 +10,10 @@ back_main_btn = InlineKeyboardButton(
 first_menu = InlineKeyboardMarkup(
     inline_keyboard=[
         [InlineKeyboardButton(text="📚 Бібліотека", callback_data="book_list")],
-        [InlineKeyboardButton(text="➕ Додати книгу", callback_data="add_book")],
+        [
+            InlineKeyboardButton(text="➕ Додати книгу", callback_data="add_book"),
+            InlineKeyboardButton(text="🔍 Пошук", callback_data="search"),
+        ],
         [
             InlineKeyboardButton(text="📕 Хочу прочитати", callback_data="in_process"),
             InlineKeyboardButton(
@@ -1,25 +1,193 @@
-import os
+import atexit
+import contextvars
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import os
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Awaitable, Callable, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject
+
+# --- Налаштування (.env) ---
+# LOG_FORMAT=json — по JSON-об'єкту на рядок з update_id, user_id і хендлером
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Частка DEBUG-записів, що потрапляють у лог (0.01 — кожен сотий)
+LOG_DEBUG_SAMPLE = float(os.getenv("LOG_DEBUG_SAMPLE", "1"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Воркери (BOT_WORKERS > 1) пишуть кожен у свій файл: ротацію одного файлу
+# кілька процесів не поділять
+_WORKER_INDEX = os.getenv("BOT_WORKER_INDEX")
+LOG_FILE = os.getenv("LOG_FILE") or (
+    f"logs/bot-worker{_WORKER_INDEX}.log" if _WORKER_INDEX is not None else "logs/bot.log"
+)
+
+# --- Контекст оновлення, що обробляється (заповнюють middleware нижче) ---
+update_id_var: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar(
+    "log_update_id", default=None
+)
+user_id_var: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar(
+    "log_user_id", default=None
+)
+handler_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "log_handler", default=None
+)
+
+
+class JsonFormatter(logging.Formatter):
+    """Один JSON-об'єкт на запис; поля контексту — лише ті, що відомі."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in ("update_id", "user_id", "handler", "sample_rate"):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Працює в потоці, що викликає logger.*: переносить контекст оновлення в
+    запис (у потоці QueueListener contextvars уже недоступні) і проріджує DEBUG.
+    """
+
+    def __init__(self, debug_sample: float = 1.0):
+        super().__init__()
+        self.debug_sample = debug_sample
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG and self.debug_sample < 1:
+            if random.random() >= self.debug_sample:
+                return False
+            record.sample_rate = self.debug_sample
+        record.update_id = update_id_var.get()
+        record.user_id = user_id_var.get()
+        record.handler = handler_var.get()
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler з обмеженою чергою: коли QueueListener не встигає, запис
+    відкидається (і рахується в dropped), а не блокує event loop.
+    """
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Як у QueueHandler, але форматування — у потоці QueueListener:
+        # тут лише фіксуємо текст повідомлення і traceback
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
 
 # --- Створюємо папку для логів, якщо її немає ---
-os.makedirs("logs", exist_ok=True)
+os.makedirs(os.path.dirname(LOG_FILE) or ".", exist_ok=True)
 
 # --- Формат логів ---
-formatter = logging.Formatter("%(asctime)s - [%(levelname)s] - %(name)s - %(message)s")
+formatter: logging.Formatter = logging.Formatter(
+    "%(asctime)s - [%(levelname)s] - %(name)s - %(message)s"
+)
+output_formatter = JsonFormatter() if LOG_FORMAT == "json" else formatter
 
 # --- Хендлер для файлу з ротацією (5 файлів по 10MB) ---
 file_handler = RotatingFileHandler(
-    "logs/bot.log", maxBytes=10_000_000, backupCount=5, encoding="utf-8"
+    LOG_FILE, maxBytes=10_000_000, backupCount=5, encoding="utf-8"
 )
-file_handler.setFormatter(formatter)
+file_handler.setFormatter(output_formatter)
 
 # --- Хендлер для консолі ---
 console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
+console_handler.setFormatter(output_formatter)
+
+# --- Запис у файл і консоль — в окремому потоці: виклик logger.* лише кладе
+# запис у чергу ---
+queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+queue_handler.addFilter(ContextFilter(LOG_DEBUG_SAMPLE))
+listener = QueueListener(
+    queue_handler.queue, file_handler, console_handler, respect_handler_level=True
+)
+listener.start()
+# Дописуємо залишок черги при завершенні процесу
+atexit.register(listener.stop)
 
 # --- Головний логер ---
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(queue_handler)
+
+
+class UpdateLogContextMiddleware(BaseMiddleware):
+    """Outer-middleware на update: update_id і user_id для логів його обробки."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        update_token = update_id_var.set(getattr(event, "update_id", None))
+        user_token = user_id_var.set(user.id if user is not None else None)
+        try:
+            return await handler(event, data)
+        finally:
+            user_id_var.reset(user_token)
+            update_id_var.reset(update_token)
+
+
+class HandlerLogContextMiddleware(BaseMiddleware):
+    """Inner-middleware на подіях: ім'я хендлера, що обробляє подію."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        callback = getattr(data.get("handler"), "callback", None)
+        token = handler_var.set(getattr(callback, "__name__", None))
+        try:
+            return await handler(event, data)
+        finally:
+            handler_var.reset(token)
+
+
+def setup(dp: Dispatcher) -> None:
+    """Підключає контекст оновлень до логів (лише для LOG_FORMAT=json)."""
+    if LOG_FORMAT != "json":
+        return
+    dp.update.outer_middleware(UpdateLogContextMiddleware())
+    # Inner-middleware роутера діють і на вкладені роутери
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(HandlerLogContextMiddleware())
@@ -0,0 +1,125 @@
+import asyncio
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from app import db_async
+from app.logger import logger
+
+_MISSING = object()
+
+
+class BaseMenuStore(ABC):
+    """Де живе id меню-повідомлення кожного користувача."""
+
+    @abstractmethod
+    async def get(self, user_id: int) -> int | None: ...
+
+    @abstractmethod
+    def set(self, user_id: int, message_id: int | None) -> None: ...
+
+    async def close(self) -> None:
+        return None
+
+
+class MemoryMenuStore(BaseMenuStore):
+    """Простий LRU у пам'яті процесу, без збереження між перезапусками."""
+
+    def __init__(self, max_size: int = 50_000):
+        self.max_size = max_size
+        self._items: "OrderedDict[int, int | None]" = OrderedDict()
+
+    def _lookup(self, user_id: int):
+        value = self._items.get(user_id, _MISSING)
+        if value is not _MISSING:
+            self._items.move_to_end(user_id)
+        return value
+
+    def _put(self, user_id: int, message_id: int | None) -> None:
+        self._items[user_id] = message_id
+        self._items.move_to_end(user_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    async def get(self, user_id: int) -> int | None:
+        value = self._lookup(user_id)
+        return None if value is _MISSING else value
+
+    def set(self, user_id: int, message_id: int | None) -> None:
+        self._put(user_id, message_id)
+
+
+class SQLiteMenuStore(MemoryMenuStore):
+    """
+    LRU-шар у пам'яті + write-behind у таблицю user_menus.
+    Записи накопичуються і скидаються одним executemany раз на flush_interval
+    секунд (або одразу, коли їх набралося batch_size). Промах у пам'яті читає
+    SQLite, тож меню переживають перезапуск, а пам'ять не росте з кількістю
+    користувачів.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 50_000,
+        flush_interval: float = 1.0,
+        batch_size: int = 500,
+    ):
+        super().__init__(max_size)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # Ще не збережені зміни; не витісняються LRU до flush
+        self._pending: dict[int, int | None] = {}
+        self._wakeup: asyncio.Event | None = None
+        self._flusher: asyncio.Task | None = None
+
+    async def get(self, user_id: int) -> int | None:
+        if user_id in self._pending:
+            return self._pending[user_id]
+        value = self._lookup(user_id)
+        if value is _MISSING:
+            value = await db_async.get_user_menu(user_id)
+            # Кешуємо і відсутність запису, щоб не ходити в БД щоразу
+            self._put(user_id, value)
+        return value
+
+    def set(self, user_id: int, message_id: int | None) -> None:
+        self._put(user_id, message_id)
+        self._pending[user_id] = message_id
+        self._ensure_flusher()
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def _ensure_flusher(self) -> None:
+        if self._flusher is None or self._flusher.done():
+            self._wakeup = asyncio.Event()
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await db_async.save_user_menus(list(batch.items()))
+        except Exception as e:
+            logger.error(f"Не вдалося зберегти меню користувачів: {e}")
+            # Повертаємо незбережене, не затираючи новіші значення
+            for user_id, message_id in batch.items():
+                self._pending.setdefault(user_id, message_id)
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
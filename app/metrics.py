@@ -0,0 +1,323 @@
+"""
+Метрики у форматі Prometheus: затримки хендлерів, викликів app.db та Bot API.
+
+Вмикаються змінною METRICS_PORT (тоді ж піднімається HTTP-ендпоінт /metrics).
+Без неї нічого не обгортається й не реєструється: обробка оновлень, запити до
+БД та Bot API йдуть тим самим шляхом, що й без цього модуля.
+"""
+
+import functools
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Iterable
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import TelegramObject, Update
+from aiohttp import web
+
+from app import query_log
+from app.logger import logger
+
+METRICS_PORT = int(os.getenv("METRICS_PORT") or 0)
+if METRICS_PORT and os.getenv("BOT_WORKER_INDEX"):
+    # Воркер N багатопроцесного режиму слухає METRICS_PORT + N
+    METRICS_PORT += int(os.environ["BOT_WORKER_INDEX"])
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+ENABLED = METRICS_PORT > 0
+
+# Секунди: від запиту до індексу SQLite до повільного Bot API
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """
+    Гістограма з мітками. observe() — бінарний пошук кошика і інкремент під
+    локом (спостереження приходять і з потоку БД, і з event loop); кумулятивні
+    суми рахуються лише під час scrape.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...],
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # мітки -> [лічильники по кошиках (останній — +Inf), сума]
+        self._series: dict[tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        slot = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][slot] += 1
+            series[1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            snapshot = [(labels, list(s[0]), s[1]) for labels, s in self._series.items()]
+        for labels, counts, total in sorted(snapshot):
+            pairs = [f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, labels)]
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = ",".join([*pairs, f'le="{bound}"'])
+                yield f"{self.name}_bucket{{{le}}} {cumulative}"
+            joined = "{" + ",".join(pairs) + "}" if pairs else ""
+            yield f"{self.name}_sum{joined} {total}"
+            yield f"{self.name}_count{joined} {cumulative}"
+
+
+handler_seconds = Histogram(
+    "bot_handler_seconds",
+    "Update handling time by event, route (callback prefix, command or FSM state) and status",
+    ("event", "route", "status"),
+)
+db_seconds = Histogram(
+    "bot_db_seconds",
+    "Time of app.db read calls inside the database thread",
+    ("function",),
+)
+db_write_seconds = Histogram(
+    "bot_db_write_seconds",
+    "Time from submitting an app.db mutation to its group commit",
+    ("function",),
+)
+api_seconds = Histogram(
+    "bot_api_request_seconds",
+    "Outbound Bot API requests by method and outcome (ok or exception class)",
+    ("method", "outcome"),
+)
+_HISTOGRAMS = (handler_seconds, db_seconds, db_write_seconds, api_seconds)
+# (назва, тип, опис, функція без аргументів) — читаються лише під час scrape
+_SAMPLED: list[tuple[str, str, str, Callable[[], float]]] = []
+
+
+def sample(name: str, kind: str, documentation: str, read: Callable[[], float]) -> None:
+    """Реєструє counter/gauge, значення якого береться з read() під час scrape."""
+    _SAMPLED.append((name, kind, documentation, read))
+
+
+def render() -> str:
+    lines: list[str] = []
+    for histogram in _HISTOGRAMS:
+        lines.extend(histogram.render())
+    for name, kind, documentation, read in _SAMPLED:
+        try:
+            value = read()
+        except Exception as e:
+            logger.warning(f"Метрика {name} недоступна: {e}")
+            continue
+        lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+# --- Інструментування ---
+
+
+def timed(fn: Callable[..., Any], histogram: Histogram) -> Callable[..., Any]:
+    """Синхронна fn, що записує свій час у histogram з міткою fn.__name__."""
+    label = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started, label)
+
+    return wrapper
+
+
+def timed_async(
+    fn: Callable[..., Awaitable[Any]], histogram: Histogram, label: str
+) -> Callable[..., Awaitable[Any]]:
+    @functools.wraps(fn)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started, label)
+
+    return wrapper
+
+
+# Мітки маршруту приходять від клієнта (callback_data, текст команди), тож
+# обмежуємо і їх вигляд, і кількість різних значень
+_ROUTE_RE = re.compile(r"[A-Za-z0-9_:]{1,48}")
+MAX_ROUTES = 200
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Outer-middleware на update: час обробки за маршрутом і результатом."""
+
+    def __init__(self, max_routes: int = MAX_ROUTES):
+        self.max_routes = max_routes
+        self._routes: set[str] = set()
+
+    def _route(self, update: Update, data: dict[str, Any]) -> tuple[str, str]:
+        if update.callback_query is not None:
+            route = (update.callback_query.data or "").split(":", 1)[0]
+        elif update.message is not None:
+            text = update.message.text or ""
+            if text.startswith("/"):
+                route = (text[1:].split(maxsplit=1) or [""])[0].split("@", 1)[0]
+            else:
+                # Кроки діалогів (Reg:name, ...) розрізняються станом FSM
+                route = data.get("raw_state") or update.message.content_type
+        else:
+            route = ""
+        if route not in self._routes:
+            if not _ROUTE_RE.fullmatch(route) or len(self._routes) >= self.max_routes:
+                route = "other"
+            else:
+                self._routes.add(route)
+        return update.event_type, route
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = await handler(event, data)
+            status = "unhandled" if result is UNHANDLED else "ok"
+            return result
+        finally:
+            if isinstance(event, Update):
+                handler_seconds.observe(
+                    time.perf_counter() - started, *self._route(event, data), status
+                )
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """
+    Session-middleware: кількість і час запитів до Bot API за методом.
+    Реєструється після RateLimitMiddleware, тож міряє сам запит (кожну
+    спробу окремо), без очікування в лімітері.
+    """
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            api_seconds.observe(
+                time.perf_counter() - started, type(method).__name__, outcome
+            )
+
+
+def setup(dp: Dispatcher, bot: Bot) -> None:
+    """Підключає middleware та лічильники кешів і черги записів."""
+    from app.db_async import writer
+    from app.fsm_storage import UserEventIsolation
+    from app.id_cache import id_cache
+    from app.logger import queue_handler
+    from app.prefetch import prefetcher
+
+    dp.update.outer_middleware(HandlerMetricsMiddleware())
+    bot.session.middleware(ApiMetricsMiddleware())
+    sample(
+        "bot_writer_batches_total", "counter", "Group-commit transactions",
+        lambda: writer.batches,
+    )
+    sample(
+        "bot_writer_ops_total", "counter", "Mutations applied by the group-commit writer",
+        lambda: writer.ops,
+    )
+    sample(
+        "bot_prefetch_hits_total", "counter", "Carousel pages served from prefetch",
+        lambda: prefetcher.hits,
+    )
+    sample(
+        "bot_prefetch_misses_total", "counter", "Carousel pages not in prefetch",
+        lambda: prefetcher.misses,
+    )
+    sample(
+        "bot_prefetch_loaded_total", "counter", "Carousel pages loaded in the background",
+        lambda: prefetcher.prefetched,
+    )
+    sample("bot_id_cache_ids", "gauge", "Book IDs held by the carousel ID cache", lambda: len(id_cache))
+    isolation = dp.fsm.events_isolation
+    if isinstance(isolation, UserEventIsolation):
+        sample(
+            "bot_user_locks", "gauge", "Users with an update being handled or waiting",
+            lambda: isolation.active_users,
+        )
+    sample(
+        "bot_log_dropped_total", "counter", "Log records dropped on a full logging queue",
+        lambda: queue_handler.dropped,
+    )
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(
+        body=render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def _handle_sql_report(request: web.Request) -> web.Response:
+    try:
+        limit = int(request.query.get("limit", "20"))
+    except ValueError:
+        raise web.HTTPBadRequest(text="limit must be an integer")
+    key = request.query.get("key", "total")
+    if key not in {"total", "max", "mean", "calls"}:
+        raise web.HTTPBadRequest(text="key must be total, max, mean or calls")
+    return web.Response(text=query_log.report(limit, key))
+
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner:
+    """
+    HTTP-сервер з GET /metrics (і /debug/sql — топ SQL-запитів, якщо увімкнено
+    BOOKS_DB_SLOW_MS); зупиняється через runner.cleanup().
+    """
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    if query_log.SLOW_THRESHOLD is not None:
+        app.router.add_get("/debug/sql", _handle_sql_report)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logger.info(f"Метрики: http://{host}:{port}/metrics")
+    return runner
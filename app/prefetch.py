@@ -0,0 +1,118 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from app.logger import logger
+
+Page = dict[str, Any]
+PageLoader = Callable[[int], Awaitable[Page | None]]
+
+
+class NeighbourPrefetcher:
+    """
+    Короткоживучий кеш сусідніх сторінок каруселі.
+
+    Після показу сторінки i у фоні підтягуються i-1 та i+1 (книга, total,
+    готовий підпис), тож наступне натискання ⬅️/➡️ не ходить у БД.
+    Записи живуть ttl секунд; кількість користувачів у кеші обмежена (LRU).
+    hits/misses/prefetched показують, чи окуповується prefetch.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_users: int = 10_000):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._users: "OrderedDict[int, dict[tuple[str, int], tuple[float, Page]]]" = (
+            OrderedDict()
+        )
+        self._inflight: dict[tuple[int, str, int], asyncio.Task] = {}
+        # Сильні посилання на фонові задачі, поки вони не завершаться
+        self._tasks: set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        # Scope-и, які не кешуються: напр. "lib" у воркерах, де бібліотеку
+        # змінюють інші процеси, а їхні invalidate() сюди не доходять
+        self.skip_scopes: set[str] = set()
+
+    def get(self, user_id: int, scope: str, index: int) -> Page | None:
+        if scope in self.skip_scopes:
+            return None
+        pages = self._users.get(user_id)
+        entry = pages.get((scope, index)) if pages else None
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._users.move_to_end(user_id)
+        return entry[1]
+
+    def put(self, user_id: int, scope: str, index: int, page: Page) -> None:
+        pages = self._users.setdefault(user_id, {})
+        self._users.move_to_end(user_id)
+        now = time.monotonic()
+        # Прострочене прибираємо тут же, щоб словник користувача не ріс
+        for key in [k for k, (expires, _) in pages.items() if expires < now]:
+            del pages[key]
+        pages[(scope, index)] = (now + self.ttl, page)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    def schedule(
+        self, user_id: int, scope: str, index: int, total: int, load: PageLoader
+    ) -> None:
+        """Запускає фонове завантаження сусідів сторінки index."""
+        if scope in self.skip_scopes:
+            return
+        pages = self._users.get(user_id, {})
+        now = time.monotonic()
+        for neighbour in (index - 1, index + 1):
+            if not 0 <= neighbour < total:
+                continue
+            entry = pages.get((scope, neighbour))
+            key = (user_id, scope, neighbour)
+            if (entry and entry[0] >= now) or key in self._inflight:
+                continue
+            task = asyncio.create_task(self._prefetch(key, load))
+            self._inflight[key] = task
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _prefetch(self, key: tuple[int, str, int], load: PageLoader) -> None:
+        user_id, scope, index = key
+        try:
+            page = await load(index)
+            # Поки вантажили, дані могли змінитись — тоді результат уже неактуальний
+            if page is not None and self._inflight.get(key) is asyncio.current_task():
+                self.put(user_id, scope, index, page)
+                self.prefetched += 1
+        except Exception as e:
+            logger.warning(f"Prefetch {scope}:{index} для {user_id} не вдався: {e}")
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
+
+    def invalidate(self, user_id: int | None = None, scope: str | None = None) -> None:
+        """Скидає сторінки користувача (user_id) та/або певного scope у всіх."""
+        if user_id is not None:
+            self._users.pop(user_id, None)
+            for key in [k for k in self._inflight if k[0] == user_id]:
+                del self._inflight[key]
+        if scope is not None:
+            for pages in self._users.values():
+                for key in [k for k in pages if k[0] == scope]:
+                    del pages[key]
+            for key in [k for k in self._inflight if k[1] == scope]:
+                del self._inflight[key]
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "prefetched": self.prefetched,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+prefetcher = NeighbourPrefetcher()
@@ -0,0 +1,262 @@
+"""Opt-in slow-query log and per-statement timing for the SQLite connection.
+
+app.db opens its connection with TracedConnection when BOOKS_DB_SLOW_MS is
+set. Every statement is then timed on the wall clock: execute() (prepare and
+the first step, which is where OFFSET skips, sorts and aggregates happen) plus
+any fetch or iteration over its rows. Statements at or over the threshold are
+logged with the SQL as SQLite ran it (the trace callback's expanded SQL, bound
+parameters inlined) and their EXPLAIN QUERY PLAN. All statements are
+aggregated by SQL text for a top-N report. Without the variable the plain
+sqlite3 connection is used and none of this runs.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from app.logger import logger
+
+_SLOW_MS = os.getenv("BOOKS_DB_SLOW_MS")
+# None: diagnostics off
+SLOW_THRESHOLD: Optional[float] = float(_SLOW_MS) / 1000 if _SLOW_MS else None
+
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+def _normalize(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+class QueryStats:
+    """Calls, total/max time, slow executions and last plan per SQL text."""
+
+    def __init__(self) -> None:
+        # sql -> [calls, total seconds, max seconds, slow calls, plan]
+        self._entries: Dict[str, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, sql: str) -> List[Any]:
+        entry = self._entries.get(sql)
+        if entry is None:
+            entry = self._entries[sql] = [0, 0.0, 0.0, 0, None]
+        return entry
+
+    def record(self, sql: str, elapsed: float) -> None:
+        with self._lock:
+            entry = self._entry(sql)
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+
+    def add_fetch(self, sql: str, elapsed: float, total: float) -> None:
+        """Adds fetch time to the execution that started at record()."""
+        with self._lock:
+            entry = self._entry(sql)
+            entry[1] += elapsed
+            entry[2] = max(entry[2], total)
+
+    def mark_slow(self, sql: str, plan: Optional[List[str]]) -> None:
+        with self._lock:
+            entry = self._entry(sql)
+            entry[3] += 1
+            if plan is not None:
+                entry[4] = plan
+
+    def plan(self, sql: str) -> Optional[List[str]]:
+        with self._lock:
+            entry = self._entries.get(sql)
+            return entry[4] if entry else None
+
+    def top(self, limit: int = 20, key: str = "total") -> List[Dict[str, Any]]:
+        """The most expensive statements by "total", "max", "mean" or "calls"."""
+        with self._lock:
+            rows = [
+                {
+                    "sql": sql,
+                    "calls": calls,
+                    "total_ms": total * 1000,
+                    "mean_ms": total / calls * 1000 if calls else 0.0,
+                    "max_ms": peak * 1000,
+                    "slow": slow,
+                    "plan": plan,
+                }
+                for sql, (calls, total, peak, slow, plan) in self._entries.items()
+            ]
+        field = {"total": "total_ms", "max": "max_ms", "mean": "mean_ms"}.get(key, key)
+        rows.sort(key=lambda row: row[field], reverse=True)
+        return rows[:limit]
+
+    def report(self, limit: int = 20, key: str = "total") -> str:
+        lines = [f"Top {limit} SQL statements by {key} time:"]
+        for i, row in enumerate(self.top(limit, key), 1):
+            lines.append(
+                f"{i:>3}. total {row['total_ms']:.1f} ms, {row['calls']} calls, "
+                f"mean {row['mean_ms']:.2f} ms, max {row['max_ms']:.2f} ms, "
+                f"slow {row['slow']}: {row['sql'][:300]}"
+            )
+            if row["plan"]:
+                lines.append("       plan: " + " | ".join(row["plan"]))
+        return "\n".join(lines)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+stats = QueryStats()
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that times its statements and the fetching of their rows."""
+
+    def __init__(self, connection: "TracedConnection"):
+        super().__init__(connection)
+        self._sql: Optional[str] = None
+        self._params: Any = ()
+        self._expanded: Optional[str] = None
+        self._elapsed = 0.0
+        self._logged = False
+
+    def execute(self, sql: str, parameters: Any = (), /) -> "TimedCursor":
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any, /) -> "TimedCursor":
+        return self._timed(super().executemany, sql, seq_of_parameters, many=True)
+
+    def _timed(
+        self, run: Callable[..., Any], sql: str, parameters: Any, many: bool = False
+    ) -> "TimedCursor":
+        connection: TracedConnection = self.connection  # type: ignore[assignment]
+        connection.expanded = None
+        started = time.perf_counter()
+        try:
+            run(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            self._sql = _normalize(sql)
+            self._params = None if many else parameters
+            self._expanded = connection.expanded
+            self._elapsed = elapsed
+            self._logged = False
+            stats.record(self._sql, elapsed)
+            self._check()
+        return self
+
+    def _fetched(self, started: float, done: bool) -> None:
+        if self._sql is None:
+            return
+        elapsed = time.perf_counter() - started
+        self._elapsed += elapsed
+        stats.add_fetch(self._sql, elapsed, self._elapsed)
+        if done:
+            self._check()
+
+    def _check(self) -> None:
+        if self._logged or SLOW_THRESHOLD is None or self._elapsed < SLOW_THRESHOLD:
+            return
+        self._logged = True
+        connection: TracedConnection = self.connection  # type: ignore[assignment]
+        plan = stats.plan(self._sql)
+        if plan is None and self._params is not None:
+            plan = connection.explain(self._sql, self._params)
+        stats.mark_slow(self._sql, plan)
+        logger.warning(
+            f"Повільний SQL {self._elapsed * 1000:.1f} мс: {self._expanded or self._sql}"
+            + (f"\nпараметри: {self._params!r}" if self._params else "")
+            + (f"\nплан: {' | '.join(plan)}" if plan else "")
+        )
+
+    def fetchone(self) -> Any:
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is None)
+        return row
+
+    def fetchmany(self, size: int = 1) -> List[Any]:
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(started, not rows)
+        return rows
+
+    def fetchall(self) -> List[Any]:
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, True)
+        return rows
+
+    def __next__(self) -> Any:
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(started, True)
+            raise
+        self._fetched(started, False)
+        return row
+
+    def __iter__(self) -> "TimedCursor":
+        return self
+
+
+class TracedConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors time their statements (see module doc)."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        # Expanded SQL of the statement being timed, from the trace callback
+        self.expanded: Optional[str] = None
+        self._user_trace: Optional[Callable[[str], Any]] = None
+        super().set_trace_callback(self._trace)
+
+    def _trace(self, sql: str) -> None:
+        # Keep the statement we ran: not the implicit BEGIN the sqlite3 module
+        # issues before it, nor the statements of triggers it fires
+        if self.expanded is None and not sql.startswith("BEGIN"):
+            self.expanded = sql
+        if self._user_trace is not None:
+            self._user_trace(sql)
+
+    def set_trace_callback(self, callback: Optional[Callable[[str], Any]]) -> None:
+        # Callers (check_query_plans) get their callback without losing ours
+        self._user_trace = callback
+
+    def cursor(self, factory: Any = TimedCursor) -> sqlite3.Cursor:
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters: Any = (), /) -> sqlite3.Cursor:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any, /) -> sqlite3.Cursor:
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def explain(self, sql: str, parameters: Any) -> Optional[List[str]]:
+        if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+            return None
+        cur = sqlite3.Cursor(self)
+        try:
+            cur.execute("EXPLAIN QUERY PLAN " + sql, parameters)
+            return [row[3] for row in cur.fetchall()]
+        except sqlite3.Error as e:
+            return [f"EXPLAIN failed: {e}"]
+        finally:
+            cur.close()
+
+
+def connect(path: str, **kwargs: Any) -> sqlite3.Connection:
+    """sqlite3.connect, traced when BOOKS_DB_SLOW_MS is set."""
+    if SLOW_THRESHOLD is None:
+        return sqlite3.connect(path, **kwargs)
+    logger.info(f"Журнал повільних SQL: поріг {SLOW_THRESHOLD * 1000:g} мс")
+    return sqlite3.connect(path, factory=TracedConnection, **kwargs)
+
+
+def report(limit: int = 20, key: str = "total") -> Optional[str]:
+    """Top-N report, or None when diagnostics are off."""
+    return stats.report(limit, key) if SLOW_THRESHOLD is not None else None
+
+
+def top(limit: int = 20, key: str = "total") -> List[Dict[str, Any]]:
+    return stats.top(limit, key)
+
@@ -0,0 +1,60 @@
+import hashlib
+from collections import OrderedDict
+from typing import Any
+
+
+class RenderCache:
+    """
+    Пам'ятає, що саме зараз показує кожне меню-повідомлення:
+    (chat_id, message_id) -> (відбиток тексту/клавіатури/фото, тип повідомлення).
+    Однаковий повторний рендер не викликає Telegram API взагалі.
+    Також тримає photo file_id, які Telegram відхилив, щоб не пробувати їх знову.
+    Обидві структури обмежені за розміром (LRU).
+    """
+
+    def __init__(self, max_messages: int = 50_000, max_failed_photos: int = 10_000):
+        self.max_messages = max_messages
+        self.max_failed_photos = max_failed_photos
+        self._messages: "OrderedDict[tuple[int, int], tuple[str, str]]" = OrderedDict()
+        self._failed_photos: "OrderedDict[str, None]" = OrderedDict()
+
+    @staticmethod
+    def fingerprint(text: str, reply_markup: Any, photo_id: str | None) -> str:
+        markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup else ""
+        digest = hashlib.blake2b(digest_size=16)
+        for part in (text, markup, photo_id or ""):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def unchanged(self, chat_id: int, message_id: int, fingerprint: str) -> bool:
+        entry = self._messages.get((chat_id, message_id))
+        if entry is None:
+            return False
+        self._messages.move_to_end((chat_id, message_id))
+        return entry[0] == fingerprint
+
+    def kind(self, chat_id: int, message_id: int) -> str | None:
+        """'photo' або 'text', якщо повідомлення рендерили ми."""
+        entry = self._messages.get((chat_id, message_id))
+        return entry[1] if entry else None
+
+    def remember(self, chat_id: int, message_id: int, fingerprint: str, kind: str) -> None:
+        self._messages[(chat_id, message_id)] = (fingerprint, kind)
+        self._messages.move_to_end((chat_id, message_id))
+        while len(self._messages) > self.max_messages:
+            self._messages.popitem(last=False)
+
+    def forget(self, chat_id: int, message_id: int) -> None:
+        self._messages.pop((chat_id, message_id), None)
+
+    def photo_failed(self, photo_id: str) -> bool:
+        return photo_id in self._failed_photos
+
+    def mark_photo_failed(self, photo_id: str) -> None:
+        self._failed_photos[photo_id] = None
+        while len(self._failed_photos) > self.max_failed_photos:
+            self._failed_photos.popitem(last=False)
+
+
+render_cache = RenderCache()
@@ -1,6 +1,8 @@
 import app.keyboards as kb
+from app.menu_store import SQLiteMenuStore
 
-user_menus = {}
+# id меню-повідомлення кожного користувача: LRU у пам'яті + write-behind у SQLite
+user_menus = SQLiteMenuStore()
 
 # --- Словник меню ---
 menus = {
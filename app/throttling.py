@@ -0,0 +1,134 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from app.logger import logger
+
+
+class TokenBucket:
+    """Token bucket з чергою: очікувачі обслуговуються у порядку надходження."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._blocked_until - now
+                if wait <= 0 and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep(max(wait, (1 - self._tokens) / self.rate))
+
+    def block(self, seconds: float) -> None:
+        """Пауза після flood control від Telegram (retry_after)."""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    def is_idle(self, now: float) -> bool:
+        return (
+            not self._lock.locked()
+            and now >= self._blocked_until
+            and now - self._updated >= self.capacity / self.rate
+        )
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """
+    Session-middleware, що тримає вихідні запити в межах лімітів Telegram
+    ще до відправки: глобальний bucket (~30 повідомлень/с) і bucket на кожен
+    чат (~1 повідомлення або редагування/с). TelegramRetryAfter обробляється
+    на місці: чекаємо retry_after і повторюємо саме цей запит.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        max_retries: int = 3,
+        max_idle_buckets: int = 10_000,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_idle_buckets = max_idle_buckets
+        # Від давно використаних до нещодавніх: простоюючі — на початку
+        self._chats: "OrderedDict[Any, TokenBucket]" = OrderedDict()
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is not None:
+            self._chats.move_to_end(chat_id)
+            return bucket
+        if len(self._chats) >= self.max_idle_buckets:
+            self._sweep()
+        bucket = TokenBucket(self.chat_rate, self.chat_burst)
+        self._chats[chat_id] = bucket
+        return bucket
+
+    def _sweep(self) -> None:
+        """Видаляє простоюючі bucket-и з початку; зайнятий — переносить у кінець."""
+        now = time.monotonic()
+        while self._chats:
+            chat_id, bucket = next(iter(self._chats.items()))
+            if not bucket.is_idle(now):
+                # Напр. чат на паузі після retry_after: наступного разу — інший
+                self._chats.move_to_end(chat_id)
+                return
+            del self._chats[chat_id]
+
+    @staticmethod
+    def _is_chat_message(method: TelegramMethod[Any]) -> bool:
+        # sendMessage, sendPhoto, editMessageText, editMessageMedia, copyMessage...
+        name = method.__api_method__
+        return name.startswith(("send", "edit", "copy", "forward"))
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not self._is_chat_message(method):
+            return await make_request(bot, method)
+
+        chat_bucket = self._chat_bucket(chat_id)
+        attempt = 0
+        while True:
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                logger.warning(
+                    f"Flood control для чату {chat_id}: чекаємо {e.retry_after} с "
+                    f"({method.__api_method__}, спроба {attempt})"
+                )
+                chat_bucket.block(e.retry_after)
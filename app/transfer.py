@@ -0,0 +1,267 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+from itertools import islice
+from typing import Any, Iterator, TextIO
+
+from aiogram import Bot, F, Router, types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import FSInputFile
+
+from app.db_async import get_user_books_after, import_books
+from app.logger import logger
+from app.prefetch import prefetcher
+
+router = Router()
+
+# Рядків на одну транзакцію executemany
+IMPORT_CHUNK_SIZE = 2_000
+# Не частіше ніж раз на стільки секунд оновлюємо повідомлення з прогресом
+PROGRESS_INTERVAL = 15.0
+# Ліміт Bot API на завантаження файлів ботом
+MAX_IMPORT_SIZE = 20 * 1024 * 1024
+MAX_FIELD_LENGTH = 512
+EXPORT_CHUNK_SIZE = 1_000
+EXPORT_FIELDS = ("name", "author", "genre", "photo_id", "is_favorite", "statuses")
+
+_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "json"}
+_TRUE_VALUES = {"1", "true", "yes", "так", "+"}
+
+
+class ImportFormatError(ValueError):
+    """Файл імпорту не вдається розібрати як CSV/JSON."""
+
+
+class Import(StatesGroup):
+    file = State()
+
+
+def detect_format(filename: str | None) -> str | None:
+    _, ext = os.path.splitext((filename or "").lower())
+    return _FORMATS.get(ext)
+
+
+def _iter_json_array(fp: TextIO, buffer_size: int = 64 * 1024) -> Iterator[Any]:
+    """Елементи JSON-масиву по одному, без читання всього файлу в пам'ять."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if started and buffer.startswith(","):
+            buffer = buffer[1:].lstrip()
+        if buffer:
+            if not started:
+                if not buffer.startswith("["):
+                    raise ImportFormatError("очікувався JSON-масив")
+                started, buffer = True, buffer[1:]
+                continue
+            if buffer.startswith("]"):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                # Елемент обрізаний межею буфера — дочитуємо
+                if eof:
+                    raise ImportFormatError("некоректний JSON")
+            else:
+                yield item
+                buffer = buffer[end:]
+                continue
+        elif eof:
+            raise ImportFormatError("JSON-масив не закрито")
+        chunk = fp.read(buffer_size)
+        eof = not chunk
+        buffer += chunk
+
+
+def _iter_jsonl(fp: TextIO) -> Iterator[Any]:
+    for line_no, line in enumerate(fp, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            raise ImportFormatError(f"некоректний JSON у рядку {line_no}")
+
+
+def _iter_csv(fp: TextIO) -> Iterator[dict]:
+    reader = csv.DictReader(fp)
+    if not reader.fieldnames:
+        return
+    reader.fieldnames = [(name or "").strip().lower() for name in reader.fieldnames]
+    yield from reader
+
+
+def _text(value: Any) -> str:
+    return str(value).strip()[:MAX_FIELD_LENGTH] if value is not None else ""
+
+
+def _status(value: Any) -> str | None:
+    """Перший відомий статус з "read,in" або ["in"]; "read" важливіший за "in"."""
+    if isinstance(value, str):
+        value = value.replace(";", ",").split(",")
+    statuses = {_text(s).lower() for s in value or ()}
+    for status in ("read", "in"):
+        if status in statuses:
+            return status
+    return None
+
+
+class BookReader:
+    """
+    Потоково читає книги з CSV, JSON Lines або JSON-масиву.
+    Ітерує кортежі (name, author, genre, photo_id, is_favorite, status);
+    записи без назви, автора чи жанру пропускаються і рахуються в skipped.
+    """
+
+    def __init__(self, fp: TextIO, fmt: str):
+        self.fp = fp
+        self.fmt = fmt
+        self.skipped = 0
+
+    def _records(self) -> Iterator[Any]:
+        if self.fmt == "csv":
+            return _iter_csv(self.fp)
+        if self.fmt == "jsonl":
+            return _iter_jsonl(self.fp)
+        return _iter_json_array(self.fp)
+
+    def __iter__(self) -> Iterator[tuple]:
+        for record in self._records():
+            if not isinstance(record, dict):
+                self.skipped += 1
+                continue
+            name, author, genre = (
+                _text(record.get(key)) for key in ("name", "author", "genre")
+            )
+            if not (name and author and genre):
+                self.skipped += 1
+                continue
+            favorite = _text(record.get("is_favorite")).lower() in _TRUE_VALUES
+            yield (
+                name,
+                author,
+                genre,
+                _text(record.get("photo_id")) or None,
+                int(favorite),
+                _status(record.get("statuses")),
+            )
+
+
+def _take(rows: Iterator[Any], count: int) -> list:
+    return list(islice(rows, count))
+
+
+def _export_row(book: dict) -> list:
+    return [
+        book["name"],
+        book["author"],
+        book["genre"],
+        book["photo_id"] or "",
+        book["is_favorite"],
+        ",".join(book["statuses"]),
+    ]
+
+
+async def _edit_status(status: types.Message, text: str) -> None:
+    try:
+        await status.edit_text(text)
+    except TelegramBadRequest:
+        pass
+
+
+# --- Імпорт ---
+@router.message(Command("import"))
+async def cmd_import(message: types.Message, state: FSMContext):
+    await state.set_state(Import.file)
+    await message.answer(
+        "📥 Надішліть файл .csv, .jsonl або .json (масив об'єктів).\n"
+        "Колонки: name, author, genre; опційно photo_id, is_favorite, statuses."
+    )
+
+
+@router.message(Import.file, F.document)
+async def import_document(message: types.Message, state: FSMContext, bot: Bot):
+    document = message.document
+    fmt = detect_format(document.file_name)
+    if fmt is None:
+        await message.answer("Підтримуються лише файли .csv, .jsonl та .json")
+        return
+    if document.file_size and document.file_size > MAX_IMPORT_SIZE:
+        await message.answer("Файл завеликий: Telegram дозволяє ботам до 20 МБ")
+        return
+    await state.set_state(None)
+
+    user_id = message.from_user.id
+    status = await message.answer("⏳ Імпорт розпочато…")
+    imported = 0
+    error = None
+    try:
+        with tempfile.TemporaryFile() as tmp:
+            await bot.download(document, destination=tmp)
+            tmp.seek(0)
+            reader = BookReader(io.TextIOWrapper(tmp, encoding="utf-8-sig", newline=""), fmt)
+            rows = iter(reader)
+            last_progress = time.monotonic()
+            try:
+                # Розбір файлу — у потоці, щоб великий файл не блокував event loop
+                while chunk := await asyncio.to_thread(_take, rows, IMPORT_CHUNK_SIZE):
+                    imported += await import_books(user_id, chunk)
+                    if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                        last_progress = time.monotonic()
+                        await _edit_status(status, f"⏳ Імпортовано {imported} книг…")
+            except (ImportFormatError, UnicodeDecodeError, csv.Error) as e:
+                error = e
+    except Exception:
+        logger.exception(f"Імпорт для {user_id} не вдався")
+        prefetcher.invalidate(user_id, scope="lib")
+        await _edit_status(
+            status, f"❌ Імпорт не вдався, спробуйте ще раз.\nДодано книг до збою: {imported}"
+        )
+        return
+    prefetcher.invalidate(user_id, scope="lib")
+
+    text = f"✅ Імпортовано книг: {imported}"
+    if reader.skipped:
+        text += f"\nПропущено записів без назви, автора чи жанру: {reader.skipped}"
+    if error is not None:
+        logger.warning(f"Імпорт для {user_id} зупинено: {error}")
+        text += f"\n⚠️ Файл прочитано не до кінця: {error}"
+    await _edit_status(status, text)
+
+
+# --- Експорт ---
+@router.message(Command("export"))
+async def cmd_export(message: types.Message):
+    """Вивантажує книги користувача у CSV частинами, не тримаючи їх у пам'яті."""
+    user_id = message.from_user.id
+    with tempfile.NamedTemporaryFile(
+        "w", suffix=".csv", encoding="utf-8", newline="", delete=False
+    ) as fp:
+        path = fp.name
+        writer = csv.writer(fp)
+        writer.writerow(EXPORT_FIELDS)
+        exported = 0
+        after = None
+        while books := await get_user_books_after(user_id, after, EXPORT_CHUNK_SIZE):
+            await asyncio.to_thread(writer.writerows, [_export_row(book) for book in books])
+            exported += len(books)
+            after = (books[-1]["created_ts"], books[-1]["id"])
+    try:
+        if not exported:
+            await message.answer("У вашій бібліотеці ще немає книг")
+            return
+        await message.answer_document(
+            FSInputFile(path, filename="books.csv"),
+            caption=f"📤 Книг: {exported}",
+        )
+    finally:
+        os.remove(path)
@@ -0,0 +1,100 @@
+import asyncio
+import hmac
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from app.logger import logger
+from app.workers import WorkerPool
+
+
+def build_webhook_app(
+    dp: Dispatcher, bot: Bot, path: str, secret_token: str | None = None
+) -> web.Application:
+    """aiohttp-застосунок, що приймає Update JSON на path.
+
+    Якщо задано secret_token, запити без правильного заголовка
+    X-Telegram-Bot-Api-Secret-Token відхиляються з 401.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, secret_token=secret_token
+    ).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+def build_pool_webhook_app(
+    pool: WorkerPool, path: str, secret_token: str | None = None
+) -> web.Application:
+    """Те саме для багатопроцесного режиму: Update JSON іде у воркер пулу."""
+
+    async def handle(request: web.Request) -> web.Response:
+        if secret_token and not hmac.compare_digest(
+            request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), secret_token
+        ):
+            return web.Response(status=401, text="Unauthorized")
+        await pool.dispatch(await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    return app
+
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    *,
+    host: str,
+    port: int,
+    path: str,
+    secret_token: str | None = None,
+    base_url: str | None = None,
+    pool: WorkerPool | None = None,
+) -> None:
+    """Піднімає webhook-сервер і чекає SIGINT/SIGTERM для коректної зупинки.
+
+    base_url — публічна адреса для set_webhook; без неї сервер лише слухає
+    (зручно для локальних тестів синтетичними POST-запитами). З pool
+    оновлення обробляють процеси-воркери, а не dp цього процесу.
+    """
+    if base_url:
+        await bot.set_webhook(
+            url=base_url.rstrip("/") + path,
+            secret_token=secret_token,
+            drop_pending_updates=True,
+        )
+
+    if pool is not None:
+        app = build_pool_webhook_app(pool, path, secret_token)
+    else:
+        app = build_webhook_app(dp, bot, path, secret_token)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port)
+    await site.start()
+    logger.info(f"Webhook слухає http://{host}:{port}{path}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: лишається KeyboardInterrupt
+            pass
+
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Webhook зупиняється...")
+        if base_url:
+            try:
+                await bot.delete_webhook()
+            except Exception as e:
+                logger.warning(f"Не вдалося зняти webhook: {e}")
+        # Дочікуємось обробників у польоті та закриваємо сесію бота
+        await runner.cleanup()
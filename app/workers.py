@@ -0,0 +1,382 @@
+"""
+Багатопроцесний режим: фронт-процес приймає оновлення (polling або webhook) і
+роздає їх BOT_WORKERS процесам-воркерам, кожен з яких крутить звичайний роутер.
+
+Оновлення розподіляються за хешем from_user.id, тож усі оновлення одного
+користувача потрапляють в один воркер і обробляються там по черзі, а різні
+користувачі — паралельно, на різних ядрах. Фронт передає воркеру оновлення
+JSON-рядками через stdin; воркер у відповідь пише у свій stdout службові
+рядки: "ready" після старту і "stats {...}" перед виходом.
+
+Зупинка: фронт закриває stdin воркера, той дообробляє отримане й виходить.
+Воркер, що впав, запускається знову (з паузою, якщо падає раз за разом);
+restart() по черзі перезапускає всі воркери без втрати оновлень.
+"""
+
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Optional, TextIO
+
+from aiogram import Bot, Dispatcher
+
+from app.logger import logger
+
+WORKERS = max(int(os.getenv("BOT_WORKERS") or 1), 1)
+# Номер цього процесу в пулі; None — не воркер
+_INDEX = os.getenv("BOT_WORKER_INDEX")
+WORKER_INDEX: Optional[int] = int(_INDEX) if _INDEX is not None else None
+
+# Оновлень, що одночасно обробляються одним воркером
+WORKER_CONCURRENCY = 100
+# Прочитаних із stdin, але ще не оброблених оновлень; далі воркер не читає
+WORKER_BACKLOG = 1000
+# Оновлень у черзі фронту до кожного воркера; далі dispatch() чекає
+QUEUE_SIZE = 1000
+READY_TIMEOUT = 60.0
+SHUTDOWN_TIMEOUT = 30.0
+MAX_RESTART_DELAY = 30.0
+
+_STOP = "stop"
+_RESTART = "restart"
+
+
+def partition_key(update: dict[str, Any]) -> int:
+    """from_user.id оновлення; без користувача — id чату, інакше update_id."""
+    for name, event in update.items():
+        if name == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return update.get("update_id", 0)
+
+
+def partition(key: int, count: int) -> int:
+    # Фібоначчієве хешування: сусідні id розходяться по різних воркерах
+    return ((key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) * count >> 64
+
+
+# --- Фронт ---
+
+
+@dataclass
+class _Worker:
+    index: int
+    queue: "asyncio.Queue[Any]"
+    ready: asyncio.Event = field(default_factory=asyncio.Event)
+    process: Optional[asyncio.subprocess.Process] = None
+    # process.wait() і читання службових рядків поточного процесу
+    exited: Optional[asyncio.Future] = None
+    control: Optional[asyncio.Task] = None
+    stats: dict[str, Any] = field(default_factory=dict)
+
+
+class WorkerPool:
+    """
+    Процеси-воркери, запущені командою command. Кожному — своя черга й
+    задача-супервізор, що передає оновлення в його stdin і перезапускає
+    процес, якщо той завершився.
+    """
+
+    def __init__(
+        self,
+        command: list[str],
+        count: int = WORKERS,
+        env: Optional[dict[str, str]] = None,
+        queue_size: int = QUEUE_SIZE,
+        shutdown_timeout: float = SHUTDOWN_TIMEOUT,
+    ):
+        self.command = command
+        self.count = count
+        self.env = env or {}
+        self.queue_size = queue_size
+        self.shutdown_timeout = shutdown_timeout
+        self.restarts = 0
+        self._workers: list[_Worker] = []
+        self._supervisors: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        """Запускає воркери і чекає, доки кожен буде готовий приймати оновлення."""
+        self._workers = [_Worker(i, asyncio.Queue(self.queue_size)) for i in range(self.count)]
+        self._supervisors = [
+            asyncio.create_task(self._supervise(worker)) for worker in self._workers
+        ]
+        await asyncio.wait_for(
+            asyncio.gather(*(worker.ready.wait() for worker in self._workers)),
+            READY_TIMEOUT,
+        )
+        logger.info(f"Запущено воркерів: {self.count}")
+
+    async def dispatch(self, update: dict[str, Any]) -> None:
+        """Ставить оновлення в чергу його воркера (чекає, якщо черга повна)."""
+        worker = self._workers[partition(partition_key(update), self.count)]
+        line = json.dumps(update, ensure_ascii=False, separators=(",", ":"))
+        await worker.queue.put(line.encode() + b"\n")
+
+    async def restart(self) -> None:
+        """По черзі перезапускає воркери; оновлення чекають у черзі фронту."""
+        for worker in self._workers:
+            done = asyncio.get_running_loop().create_future()
+            await worker.queue.put((_RESTART, done))
+            await done
+        logger.info("Воркери перезапущено")
+
+    async def close(self) -> None:
+        """Передає воркерам решту черги, закриває їх stdin і чекає виходу."""
+        for worker in self._workers:
+            await worker.queue.put((_STOP, asyncio.get_running_loop().create_future()))
+        await asyncio.gather(*self._supervisors, return_exceptions=True)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "restarts": self.restarts,
+            "workers": [worker.stats for worker in self._workers],
+        }
+
+    async def _spawn(self, worker: _Worker) -> asyncio.subprocess.Process:
+        env = {
+            **os.environ,
+            **self.env,
+            "BOT_WORKERS": str(self.count),
+            "BOT_WORKER_INDEX": str(worker.index),
+        }
+        process = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env=env,
+            # Ctrl+C у терміналі зупиняє фронт, а воркери — через закритий stdin
+            start_new_session=True,
+        )
+        try:
+            while True:
+                line = await asyncio.wait_for(process.stdout.readline(), READY_TIMEOUT)
+                if line == b"ready\n":
+                    break
+                if not line:
+                    raise RuntimeError(f"код виходу {await process.wait()}")
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+            raise
+        worker.exited = asyncio.ensure_future(process.wait())
+        worker.control = asyncio.create_task(self._read_control(worker, process))
+        return process
+
+    async def _read_control(self, worker: _Worker, process: asyncio.subprocess.Process) -> None:
+        while line := await process.stdout.readline():
+            kind, _, payload = line.decode().partition(" ")
+            if kind == "stats":
+                # Сумарно за всі запуски процесу цього воркера
+                for name, value in json.loads(payload).items():
+                    worker.stats[name] = worker.stats.get(name, 0) + value
+
+    async def _stop(self, worker: _Worker, process: asyncio.subprocess.Process) -> None:
+        process.stdin.close()
+        try:
+            await asyncio.wait_for(process.wait(), self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Воркер {worker.index} не завершився вчасно, зупиняємо примусово")
+            process.kill()
+            await process.wait()
+        # Дочитуємо "stats" перед виходом
+        if worker.control is not None:
+            await worker.control
+
+    async def _supervise(self, worker: _Worker) -> None:
+        pending: Any = None
+        failures = 0
+        while True:
+            if worker.process is None:
+                try:
+                    worker.process = await self._spawn(worker)
+                except Exception as e:
+                    failures += 1
+                    delay = min(2.0 ** failures, MAX_RESTART_DELAY)
+                    logger.error(
+                        f"Воркер {worker.index} не запустився ({e}); повтор за {delay:.0f} с"
+                    )
+                    await asyncio.sleep(delay)
+                    continue
+                worker.ready.set()
+                started = time.monotonic()
+            process, exited = worker.process, worker.exited
+
+            if pending is None:
+                getter = asyncio.ensure_future(worker.queue.get())
+                await asyncio.wait({getter, exited}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    pending = getter.result()
+                else:
+                    getter.cancel()
+            if isinstance(pending, bytes) and not exited.done():
+                try:
+                    process.stdin.write(pending)
+                    await process.stdin.drain()
+                    pending = None
+                    continue
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+            elif isinstance(pending, tuple):
+                kind, done = pending
+                pending = None
+                await self._stop(worker, process)
+                worker.process = None
+                done.set_result(None)
+                if kind == _STOP:
+                    return
+                continue
+
+            # Процес завершився сам: запускаємо знову, оновлення в pending не губиться
+            code = await process.wait()
+            worker.process = None
+            self.restarts += 1
+            failures = failures + 1 if time.monotonic() - started < MAX_RESTART_DELAY else 1
+            delay = 0.0 if failures == 1 else min(2.0 ** (failures - 1), MAX_RESTART_DELAY)
+            logger.error(
+                f"Воркер {worker.index} завершився з кодом {code}; перезапуск за {delay:.0f} с"
+            )
+            await asyncio.sleep(delay)
+
+
+async def run_polling(
+    pool: WorkerPool, bot: Bot, allowed_updates: list[str], timeout: int = 30
+) -> None:
+    """Long polling у фронті до SIGINT/SIGTERM: кожне оновлення — у чергу його воркера."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    poller = asyncio.create_task(_poll(pool, bot, allowed_updates, timeout))
+    stopped = asyncio.create_task(stop.wait())
+    try:
+        await asyncio.wait({poller, stopped}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stopped.cancel()
+        if not poller.done():
+            poller.cancel()
+            await asyncio.gather(poller, return_exceptions=True)
+    if not poller.cancelled():
+        poller.result()
+
+
+async def _poll(pool: WorkerPool, bot: Bot, allowed_updates: list[str], timeout: int) -> None:
+    await bot.delete_webhook(drop_pending_updates=True)
+    offset: Optional[int] = None
+    failures = 0
+    while True:
+        try:
+            updates = await bot.get_updates(
+                offset=offset,
+                timeout=timeout,
+                allowed_updates=allowed_updates,
+                request_timeout=timeout + 30,
+            )
+        except Exception as e:
+            failures += 1
+            delay = min(float(failures), MAX_RESTART_DELAY)
+            logger.error(
+                f"Не вдалося отримати оновлення ({type(e).__name__}: {e}); "
+                f"повтор за {delay:.0f} с"
+            )
+            await asyncio.sleep(delay)
+            continue
+        failures = 0
+        for update in updates:
+            await pool.dispatch(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+            offset = update.update_id + 1
+
+
+# --- Воркер ---
+
+
+def _control_channel() -> TextIO:
+    """
+    Справжній stdout для службових рядків фронту; sys.stdout і fd 1
+    переспрямовуються в stderr, щоб випадковий print не зламав протокол.
+    """
+    control = os.fdopen(os.dup(1), "w", buffering=1, encoding="utf-8")
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    return control
+
+
+async def serve(
+    dp: Dispatcher,
+    bot: Bot,
+    concurrency: int = WORKER_CONCURRENCY,
+    backlog_size: int = WORKER_BACKLOG,
+    **kwargs: Any,
+) -> dict[str, Any]:
+    """
+    Цикл воркера: оновлення з stdin у dp.feed_raw_update до EOF. Оновлення
+    одного користувача (крім inline-запитів) обробляються в порядку
+    надходження, різних — одночасно (не більше concurrency); прочитаних і не
+    оброблених — не більше backlog_size. Повертає лічильники оновлень.
+    """
+    loop = asyncio.get_running_loop()
+    control = _control_channel()
+    reader = asyncio.StreamReader(limit=16 * 1024 * 1024)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    try:
+        # SIGTERM — як закритий stdin: дообробити отримане і вийти
+        loop.add_signal_handler(signal.SIGTERM, reader.feed_eof)
+    except (NotImplementedError, RuntimeError):
+        pass
+
+    # Слот займає лише оновлення, що вже обробляється: ті, що чекають на
+    # попереднє оновлення свого користувача, не блокують інших
+    slots = asyncio.Semaphore(concurrency)
+    backlog = asyncio.Semaphore(max(backlog_size, concurrency))
+    # Остання задача кожного користувача: наступна чекає на неї
+    tails: dict[int, asyncio.Task] = {}
+    running: set[asyncio.Task] = set()
+    stats = {"handled": 0, "failed": 0}
+
+    async def handle(key: int, update: dict[str, Any], previous: Optional[asyncio.Task]) -> None:
+        try:
+            if previous is not None:
+                await asyncio.wait({previous})
+            async with slots:
+                await dp.feed_raw_update(bot, update, **kwargs)
+            stats["handled"] += 1
+        except Exception as e:
+            stats["failed"] += 1
+            # Traceback винятків хендлерів уже залогував aiogram
+            logger.error(
+                f"Оновлення {update.get('update_id')} не оброблено: {type(e).__name__}: {e}"
+            )
+        finally:
+            backlog.release()
+            if tails.get(key) is asyncio.current_task():
+                del tails[key]
+
+    control.write("ready\n")
+    while line := await reader.readline():
+        update = json.loads(line)
+        key = partition_key(update)
+        await backlog.acquire()
+        if "inline_query" in update:
+            # Inline-запити не чекають інших оновлень користувача: застарілий
+            # пошук скасовує app.inline
+            task = asyncio.create_task(handle(key, update, None))
+        else:
+            task = asyncio.create_task(handle(key, update, tails.get(key)))
+            tails[key] = task
+        running.add(task)
+        task.add_done_callback(running.discard)
+    if running:
+        await asyncio.wait(running)
+    control.write(f"stats {json.dumps(stats)}\n")
+    return stats
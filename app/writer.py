@@ -0,0 +1,112 @@
+import asyncio
+import functools
+from typing import Any, Awaitable, Callable
+
+from app.logger import logger
+
+Op = Callable[..., Any]
+BatchRunner = Callable[[list[tuple[Op, tuple]]], list[tuple[bool, Any]]]
+
+# Маркер у черзі: дописати накопичене і завершити роботу
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """
+    Єдиний «письменник» у БД з груповим комітом.
+
+    Мутації (додавання, видалення, перемикачі) стають у чергу; фонова задача
+    забирає все, що накопичилось, чекає ще до max_delay секунд (або до
+    max_batch операцій) і застосовує пакет однією транзакцією — один WAL-sync
+    на пакет замість одного на кожне натискання кнопки. Кожен виклик submit
+    отримує свій результат або свою помилку.
+
+    Read-your-writes: submit завершується лише після коміту, а читання йдуть
+    через той самий потік і з'єднання, тож наступний запит користувача вже
+    бачить його зміну.
+    """
+
+    def __init__(
+        self,
+        apply_batch: BatchRunner,
+        run: Callable[..., Awaitable[Any]],
+        max_batch: int = 64,
+        max_delay: float = 0.005,
+    ):
+        self._apply_batch = apply_batch
+        self._run = run
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self.batches = 0
+        self.ops = 0
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._work())
+        return self._queue
+
+    async def submit(self, op: Op, *args: Any, **kwargs: Any) -> Any:
+        """Ставить op(cursor, *args) у чергу і повертає його результат після коміту."""
+        if kwargs:
+            op = functools.partial(op, **kwargs)
+        future = asyncio.get_running_loop().create_future()
+        self._ensure_worker().put_nowait((op, args, future))
+        return await future
+
+    async def _collect(self) -> list:
+        queue = self._queue
+        batch = [await queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch and batch[-1] is not _STOP:
+            if not queue.empty():
+                batch.append(queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _work(self) -> None:
+        while True:
+            batch = await self._collect()
+            stopping = batch[-1] is _STOP
+            if stopping:
+                batch.pop()
+            if batch:
+                await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: list) -> None:
+        try:
+            results = await self._run(
+                self._apply_batch, [(op, args) for op, args, _ in batch]
+            )
+        except Exception as e:
+            logger.error(f"Пакет із {len(batch)} змін не записано: {e}")
+            results = [(False, e)] * len(batch)
+        self.batches += 1
+        self.ops += len(batch)
+        for (_, _, future), (ok, value) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    async def close(self) -> None:
+        """Дописує все, що вже в черзі, і зупиняє фонову задачу."""
+        if self._worker is None or self._worker.done():
+            return
+        self._queue.put_nowait(_STOP)
+        await self._worker
+        self._worker = None
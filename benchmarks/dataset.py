@@ -0,0 +1,137 @@
+"""Reproducible synthetic book databases for the benchmarks.
+
+The same DatasetSpec always produces the same rows: users own a Zipf-like
+share of the library (a few heavy readers, a long tail of small shelves),
+titles draw words from a Zipf-like vocabulary, and favourite, "in" and "read"
+flags follow fixed ratios. The spec is stored in the database itself, so a
+generated file is reused only by runs that asked for the same data.
+"""
+
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+from dataclasses import asdict, dataclass
+from types import ModuleType
+
+# Books are spread over this many seconds before START_TS, oldest first
+START_TS = 1_700_000_000
+SPAN_SECONDS = 3 * 365 * 24 * 3600
+FIRST_TG_USER_ID = 100_000_000
+BATCH = 50_000
+
+
+@dataclass(frozen=True)
+class DatasetSpec:
+    books: int
+    users: int = 100_000
+    seed: int = 1
+    favorite_ratio: float = 0.12
+    read_ratio: float = 0.30
+    in_ratio: float = 0.15
+    photo_ratio: float = 0.6
+    # Exponent of the books-per-user distribution (0 = uniform)
+    user_skew: float = 0.8
+
+
+def vocabulary(size: int, rng: random.Random) -> list[str]:
+    letters = "абвгдеєжзиіїйклмнопрстуфхцчшщьюя"
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(4, 9))))
+    return sorted(words)
+
+
+def open_dataset(path: str, spec: DatasetSpec) -> ModuleType:
+    """Returns app.db bound to the database at path, generating it if missing.
+
+    Must run before anything imports app.db: the module reads BOOKS_DB_PATH
+    once, at import time.
+    """
+    if "app.db" in sys.modules:
+        raise RuntimeError("app.db is already imported; call open_dataset() first")
+    os.environ["BOOKS_DB_PATH"] = path
+    from app import db
+
+    db.init_db()
+    conn = db.get_connection()
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS benchmark_meta (key TEXT PRIMARY KEY, value TEXT)"
+    )
+    row = conn.execute("SELECT value FROM benchmark_meta WHERE key = 'spec'").fetchone()
+    if row is None:
+        if conn.execute("SELECT 1 FROM books LIMIT 1").fetchone():
+            raise SystemExit(f"{path} has books but no benchmark spec; use a new --db path")
+        print(f"Generating {spec.books} books for {spec.users} users in {path}...")
+        populate(conn, spec)
+    elif json.loads(row[0]) != asdict(spec):
+        raise SystemExit(
+            f"{path} was generated for {row[0]}; use another --db path for this spec"
+        )
+    return db
+
+
+def populate(conn: sqlite3.Connection, spec: DatasetSpec) -> None:
+    rng = random.Random(spec.seed)
+    vocab = vocabulary(20_000, rng)
+    # Zipf-like: the n-th word is n times rarer than the first
+    word_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocab))))
+    genres = vocab[:50]
+    user_ids = list(range(1, spec.users + 1))
+    user_weights = list(
+        itertools.accumulate(1 / (rank + 1) ** spec.user_skew for rank in range(spec.users))
+    )
+    conn.executemany(
+        "INSERT INTO users (id, tg_user_id) VALUES (?, ?)",
+        ((uid, FIRST_TG_USER_ID + uid) for uid in user_ids),
+    )
+    conn.commit()
+
+    step = SPAN_SECONDS / max(spec.books, 1)
+    started = time.perf_counter()
+    for offset in range(0, spec.books, BATCH):
+        books, statuses = [], []
+        for book_id in range(offset + 1, min(offset + BATCH, spec.books) + 1):
+            title = " ".join(rng.choices(vocab, cum_weights=word_weights, k=rng.randint(1, 4)))
+            photo_id = f"AgACAgIAAx{book_id:012x}" if rng.random() < spec.photo_ratio else None
+            books.append(
+                (
+                    book_id,
+                    rng.choices(user_ids, cum_weights=user_weights)[0],
+                    title,
+                    " ".join(rng.choices(vocab, k=2)),
+                    rng.choice(genres),
+                    photo_id,
+                    int(rng.random() < spec.favorite_ratio),
+                    START_TS - SPAN_SECONDS + int((book_id - 1) * step),
+                )
+            )
+            roll = rng.random()
+            if roll < spec.read_ratio:
+                statuses.append((book_id, "read"))
+            elif roll < spec.read_ratio + spec.in_ratio:
+                statuses.append((book_id, "in"))
+        conn.executemany(
+            """
+            INSERT INTO books (id, user_id, name, author, genre, photo_id, is_favorite, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, datetime(?, 'unixepoch'))
+            """,
+            books,
+        )
+        conn.executemany(
+            "INSERT INTO book_statuses (book_id, status) VALUES (?, ?)", statuses
+        )
+        conn.commit()
+        print(f"  {offset + len(books):>9} books ({time.perf_counter() - started:.0f} s)")
+
+    conn.execute("INSERT INTO books_fts (books_fts) VALUES ('optimize')")
+    conn.execute(
+        "INSERT INTO benchmark_meta (key, value) VALUES ('spec', ?)",
+        (json.dumps(asdict(spec)),),
+    )
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
@@ -0,0 +1,405 @@
+"""Latency benchmark for every public function in app.db.
+
+Usage:
+    python -m benchmarks.db_bench run --books 1000000 --out after.json
+    python -m benchmarks.db_bench compare before.json after.json
+
+"run" times each function on a reproducible synthetic database (see
+benchmarks.dataset) at shallow and deep carousel positions and writes
+p50/p95/p99 latency and queries per second as JSON. Functions are called
+directly, without the app.db_async thread hop, so the numbers are the cost of
+the SQL and the Python around it. Mutations undo themselves between timed
+calls, so a database can be reused across runs and branches.
+
+"compare" lines two result files up and exits with status 1 when a case got
+slower than --threshold (relative, on --metric) and --min-delta-ms (absolute),
+so it can gate a deploy.
+"""
+
+import argparse
+import inspect
+import itertools
+import json
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable
+
+from benchmarks.dataset import DatasetSpec, open_dataset
+
+# Not timed: connection/schema setup, the batch primitive behind the write
+# wrappers, a diagnostic and a no-op kept for compatibility
+SKIPPED = {
+    "get_connection",
+    "init_db",
+    "apply_batch",
+    "check_query_plans",
+    "update_book_status",
+}
+
+
+@dataclass
+class Case:
+    """One timed call shape; run(prepared) is timed, setup and teardown are not."""
+
+    name: str
+    run: Callable[[Any], Any]
+    setup: Callable[[], Any] = field(default=lambda: None)
+    teardown: Callable[[Any, Any], None] = field(default=lambda prepared, result: None)
+
+
+def _percentile(sorted_values: list[float], pct: float) -> float:
+    # Nearest-rank percentile
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def _sample(case: Case, calls: int) -> list[float]:
+    timings = []
+    for _ in range(calls):
+        prepared = case.setup()
+        started = time.perf_counter()
+        result = case.run(prepared)
+        timings.append(time.perf_counter() - started)
+        case.teardown(prepared, result)
+    return timings
+
+
+def summarize(timings: list[float]) -> dict[str, float]:
+    timings = sorted(timings)
+    return {
+        "n": len(timings),
+        "p50_ms": _percentile(timings, 50) * 1000,
+        "p95_ms": _percentile(timings, 95) * 1000,
+        "p99_ms": _percentile(timings, 99) * 1000,
+        "max_ms": timings[-1] * 1000,
+        "qps": len(timings) / sum(timings),
+    }
+
+
+def measure(
+    cases: list[Case], repeat: int, warmup: int, rounds: int, budget: float
+) -> dict[str, list[float]]:
+    """Times every case in interleaved rounds.
+
+    Machine noise (CPU frequency, a neighbour on a shared host, a WAL
+    checkpoint) then lands on all cases alike instead of skewing whichever case
+    happened to run at the time. A case stops early once it has used its
+    budget of seconds (deep OFFSETs on a big library).
+    """
+    timings: dict[str, list[float]] = {case.name: [] for case in cases}
+    spent = dict.fromkeys(timings, 0.0)
+    for case in cases:
+        _sample(case, warmup)
+    per_round = -(-repeat // rounds)
+    for _ in range(rounds):
+        for case in cases:
+            if spent[case.name] > budget and len(timings[case.name]) >= 5:
+                continue
+            sample = _sample(case, per_round)
+            timings[case.name] += sample
+            spent[case.name] += sum(sample)
+    return timings
+
+
+def _scope_sizes(conn: sqlite3.Connection) -> dict[str, Any]:
+    """The heaviest user (deep scopes) and a median one with books."""
+    rows = conn.execute(
+        """
+        SELECT u.tg_user_id, c.lib, c.fav, c.st_in, c.st_read
+        FROM user_counters c JOIN users u ON u.id = c.user_id
+        WHERE c.user_id != 0 AND c.lib > 0
+        ORDER BY c.lib DESC, c.user_id
+        """
+    ).fetchall()
+    if not rows:
+        raise SystemExit("The benchmark database has no books")
+    return {"heavy": tuple(rows[0]), "typical": tuple(rows[len(rows) // 2])}
+
+
+def build_cases(db, seed: int) -> list[Case]:
+    conn = db.get_connection()
+    sizes = _scope_sizes(conn)
+    heavy, lib, fav, _, read = sizes["heavy"]
+    typical = sizes["typical"][0]
+    total = db.count_all_books()
+    rng = random.Random(seed)
+    max_id = conn.execute("SELECT MAX(id) FROM books").fetchone()[0]
+    sample = [
+        conn.execute("SELECT id FROM books WHERE id >= ? LIMIT 1", (i,)).fetchone()[0]
+        for i in rng.choices(range(1, max_id + 1), k=256)
+    ]
+    book_ids = itertools.cycle(sample).__next__
+
+    def cursor_at(book: dict | None, direction: str) -> tuple[int, int, str]:
+        return (book["created_ts"], book["id"], direction) if book else (0, 0, direction)
+
+    lib_deep = db.get_all_book_by_index(total - 1)
+    fav_deep = db.get_user_favorite_by_index(heavy, max(fav - 1, 0))
+    read_deep = db.get_user_book_by_status_and_index_m2m(heavy, "read", max(read - 1, 0))
+    words = [
+        row[0]
+        for row in conn.execute(
+            "SELECT term FROM books_fts_vocab WHERE col = 'name' ORDER BY doc DESC, term"
+        )
+    ]
+    common, rare = words[0], words[-1]
+    oldest_own = db.get_user_books_after(heavy, None, 1)
+    # Export cursor with at most one chunk left after it
+    tail = db.get_user_book_by_index(heavy, min(999, lib - 1))
+    tail_after = (tail["created_ts"], tail["id"]) if tail else None
+
+    def with_statuses() -> tuple[int, list[str]]:
+        book_id = book_ids()
+        return book_id, db.list_book_statuses(book_id)
+
+    def case(name: str, fn: Callable[..., Any], *args: Any) -> Case:
+        return Case(name, lambda _: fn(*args))
+
+    cases = [
+        # Counters
+        case("count_all_books", db.count_all_books),
+        case("count_user_books", db.count_user_books, heavy),
+        case("count_user_favorites", db.count_user_favorites, heavy),
+        case("count_user_books_by_status", db.count_user_books_by_status, heavy, "in"),
+        case("count_user_books_by_status_m2m", db.count_user_books_by_status_m2m, heavy, "read"),
+        # Single rows
+        Case("get_book", db.get_book, setup=book_ids),
+        Case("list_book_statuses", db.list_book_statuses, setup=book_ids),
+        # Lists
+        case("list_all_books/shallow", db.list_all_books, 50, 0),
+        case("list_all_books/deep", db.list_all_books, 50, max(total - 50, 0)),
+        case("list_user_books/shallow", db.list_user_books, heavy, 50, 0),
+        case("list_user_books/deep", db.list_user_books, heavy, 50, max(lib - 50, 0)),
+        # Legacy OFFSET and keyset carousels
+        case("get_all_book_by_index/shallow", db.get_all_book_by_index, 0),
+        case("get_all_book_by_index/deep", db.get_all_book_by_index, total - 1),
+        case("get_all_book_by_cursor/deep", db.get_all_book_by_cursor, *cursor_at(lib_deep, "p")),
+        case("get_user_book_by_index/shallow", db.get_user_book_by_index, heavy, 0),
+        case("get_user_book_by_index/deep", db.get_user_book_by_index, heavy, lib - 1),
+        case("get_user_book_by_status_and_index/deep", db.get_user_book_by_status_and_index, heavy, "read", max(read - 1, 0)),
+        case("get_user_favorite_by_index/shallow", db.get_user_favorite_by_index, heavy, 0),
+        case("get_user_favorite_by_index/deep", db.get_user_favorite_by_index, heavy, max(fav - 1, 0)),
+        case("get_user_favorite_by_cursor/deep", db.get_user_favorite_by_cursor, heavy, *cursor_at(fav_deep, "p")),
+        case("get_user_book_by_status_and_index_m2m/shallow", db.get_user_book_by_status_and_index_m2m, heavy, "read", 0),
+        case("get_user_book_by_status_and_index_m2m/deep", db.get_user_book_by_status_and_index_m2m, heavy, "read", max(read - 1, 0)),
+        case("get_user_book_by_status_and_cursor_m2m/deep", db.get_user_book_by_status_and_cursor_m2m, heavy, "read", *cursor_at(read_deep, "p")),
+        # Carousel pages (book + total in one call)
+        case("get_lib_page/shallow", db.get_lib_page, 0),
+        case("get_lib_page/deep", db.get_lib_page, total - 1),
+        case("get_lib_page/deep-cursor", db.get_lib_page, total - 1, cursor_at(lib_deep, "p")),
+        case("get_status_page/shallow", db.get_status_page, heavy, "read", 0),
+        case("get_status_page/deep", db.get_status_page, heavy, "read", max(read - 1, 0)),
+        case("get_status_page/deep-cursor", db.get_status_page, heavy, "read", max(read - 1, 0), cursor_at(read_deep, "p")),
+        case("get_favorites_page/shallow", db.get_favorites_page, heavy, 0),
+        case("get_favorites_page/deep", db.get_favorites_page, heavy, max(fav - 1, 0)),
+        case("get_favorites_page/deep-cursor", db.get_favorites_page, heavy, max(fav - 1, 0), cursor_at(fav_deep, "p")),
+        # Search
+        case("search_books_page/common", db.search_books_page, common, 0),
+        case("search_books_page/common-deep", db.search_books_page, common, 50),
+        case("search_books_page/rare", db.search_books_page, rare, 0),
+        case("search_user_books/all", db.search_user_books, heavy, "", 21),
+        case("search_user_books/all-deep", db.search_user_books, heavy, "", 21, oldest_own[0]["id"] if oldest_own else 0),
+        case("search_user_books/common", db.search_user_books, heavy, common[:3], 21),
+        # Export
+        case("get_user_books_after/first", db.get_user_books_after, heavy, None, 1000),
+        case("get_user_books_after/tail", db.get_user_books_after, heavy, tail_after, 1000),
+        # Menus and FSM
+        case("get_user_menu", db.get_user_menu, heavy),
+        case("save_user_menus", db.save_user_menus, [(heavy, 1), (typical, 2)]),
+        case("fsm_get", db.fsm_get, f"bench:{heavy}"),
+        case("fsm_put", db.fsm_put, f"bench:{heavy}", "AddBook:name", "{}", 0.0),
+        case("fsm_delete_expired", db.fsm_delete_expired, -1.0),
+        # Mutations, each undone after its timed call
+        case("ensure_user", db.ensure_user, heavy),
+        Case(
+            "add_book_for_user",
+            lambda _: db.add_book_for_user(typical, "Bench", "Author", "genre"),
+            teardown=lambda _, book_id: db.delete_book(book_id),
+        ),
+        Case(
+            "delete_book",
+            db.delete_book,
+            setup=lambda: db.add_book_for_user(typical, "Bench", "Author", "genre"),
+        ),
+        Case(
+            "import_books/100",
+            lambda _: db.import_books(typical, [("Bench", "Author", "genre", None, 0, "read")] * 100),
+            setup=lambda: conn.execute("SELECT MAX(id) FROM books").fetchone()[0],
+            teardown=lambda last_id, _: [
+                db.delete_book(row[0])
+                for row in conn.execute("SELECT id FROM books WHERE id > ?", (last_id,)).fetchall()
+            ],
+        ),
+        Case(
+            "toggle_favorite",
+            db.toggle_favorite,
+            setup=book_ids,
+            teardown=lambda book_id, _: db.toggle_favorite(book_id),
+        ),
+        Case(
+            "toggle_status",
+            lambda prepared: db.toggle_status(prepared[0], "read"),
+            setup=with_statuses,
+            # "read" replaced "in" (restore it) or flipped "read" on/off (flip back)
+            teardown=lambda prepared, _: db.toggle_status(
+                prepared[0], prepared[1][0] if prepared[1] else "read"
+            ),
+        ),
+    ]
+    return cases
+
+
+def uncovered(db, cases: list[Case]) -> list[str]:
+    """Public app.db functions that no case names; keeps the suite complete."""
+    timed = {case.name.split("/")[0] for case in cases}
+    return sorted(
+        name
+        for name, fn in inspect.getmembers(db, inspect.isfunction)
+        if fn.__module__ == db.__name__
+        and not name.startswith("_")
+        and name not in timed | SKIPPED
+    )
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args: argparse.Namespace) -> None:
+    spec = DatasetSpec(books=args.books, users=args.users, seed=args.seed)
+    path = args.db or f"/tmp/books_bench_{spec.books}_{spec.users}_{spec.seed}.sqlite3"
+    db = open_dataset(path, spec)
+    conn = db.get_connection()
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts_vocab USING fts5vocab(books_fts, col)"
+    )
+    # Mutation cases of earlier runs leave delete markers in the FTS index;
+    # merge them so every run searches the same segments
+    conn.execute("INSERT INTO books_fts (books_fts) VALUES ('optimize')")
+    conn.commit()
+    if args.id_cache == "off":
+        # Every page goes through SQL, as for scopes too large to cache
+        db.id_cache = db.IdCache(max_entry_ids=-1)
+
+    cases = build_cases(db, args.seed)
+    missing = uncovered(db, cases)
+    if missing:
+        print(f"Not benchmarked: {', '.join(missing)}", file=sys.stderr)
+    if args.only:
+        cases = [c for c in cases if any(part in c.name for part in args.only)]
+
+    print(f"Timing {len(cases)} cases...")
+    results = {
+        name: summarize(timings)
+        for name, timings in measure(
+            cases, args.repeat, args.warmup, args.rounds, args.budget
+        ).items()
+    }
+    print(f"{'case':<48} {'n':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'qps':>9}")
+    for name, stats in results.items():
+        print(
+            f"{name:<48} {stats['n']:>5} {stats['p50_ms']:>8.3f} "
+            f"{stats['p95_ms']:>8.3f} {stats['p99_ms']:>8.3f} {stats['qps']:>9.0f}"
+        )
+
+    report = {
+        "meta": {
+            "spec": asdict(spec),
+            "id_cache": args.id_cache,
+            "repeat": args.repeat,
+            "rounds": args.rounds,
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "cases": results,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fp:
+            json.dump(report, fp, indent=2)
+        print(f"\nWrote {args.out}")
+
+
+def compare(args: argparse.Namespace) -> int:
+    with open(args.before, encoding="utf-8") as fp:
+        before = json.load(fp)
+    with open(args.after, encoding="utf-8") as fp:
+        after = json.load(fp)
+    for key in ("spec", "id_cache"):
+        if before["meta"].get(key) != after["meta"].get(key):
+            print(f"warning: runs differ in {key}; latencies are not comparable")
+
+    regressions = []
+    metric = args.metric
+    print(f"{'case':<48} {'p50 ms':>17} {'p95 ms':>17} {metric[:3] + ' change':>11}")
+    for name in sorted(before["cases"].keys() | after["cases"].keys()):
+        old, new = before["cases"].get(name), after["cases"].get(name)
+        if old is None or new is None:
+            print(f"{name:<48} {'only in ' + ('after' if old is None else 'before'):>17}")
+            continue
+        change = new[metric] / old[metric] - 1 if old[metric] else 0.0
+        slower = (
+            change > args.threshold and new[metric] - old[metric] > args.min_delta_ms
+        )
+        if slower:
+            regressions.append(name)
+        print(
+            f"{name:<48} {old['p50_ms']:>8.3f}→{new['p50_ms']:<8.3f} "
+            f"{old['p95_ms']:>8.3f}→{new['p95_ms']:<8.3f} {change:>+10.0%}"
+            + ("  REGRESSION" if slower else "")
+        )
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="time app.db and write a JSON report")
+    run_parser.add_argument("--books", type=int, default=100_000)
+    run_parser.add_argument("--users", type=int, default=100_000)
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--db", help="database path (default: per spec in /tmp)")
+    run_parser.add_argument("--out", help="JSON report path")
+    run_parser.add_argument("--repeat", type=int, default=200)
+    run_parser.add_argument("--warmup", type=int, default=10)
+    run_parser.add_argument("--rounds", type=int, default=5)
+    run_parser.add_argument("--budget", type=float, default=5.0, help="seconds per case")
+    run_parser.add_argument("--id-cache", choices=("on", "off"), default="on")
+    run_parser.add_argument("--only", nargs="*", help="run cases whose name contains any of these")
+
+    compare_parser = commands.add_parser("compare", help="compare two JSON reports")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument(
+        "--metric", choices=("p50_ms", "p95_ms", "p99_ms"), default="p50_ms"
+    )
+    compare_parser.add_argument("--threshold", type=float, default=0.2)
+    compare_parser.add_argument("--min-delta-ms", type=float, default=0.05)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+"""Offline load test of the bot handlers.
+
+Usage:
+    python -m benchmarks.load_handlers --books 100000 --users 200 --updates 5000
+
+Synthetic Message and CallbackQuery updates go through the real router from
+app.handlers via Dispatcher.feed_update, with the production FSM storage and
+database code. Bot API calls never leave the process: StubSession answers
+them locally and records what was sent, so virtual users press the buttons the
+handlers actually rendered (including keyset cursors in carousel arrows).
+
+Each scenario runs --users concurrent virtual users until --updates updates
+have been handled, and reports throughput, per-update latency percentiles and
+Bot API calls per update. --api-latency adds a simulated round trip to every
+call; --metrics runs with app.metrics instrumentation (without the HTTP
+endpoint) to measure its overhead. The add_book scenario adds books, so the harness uses its own database
+file (see benchmarks.dataset) rather than the one db_bench times.
+"""
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import random
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Iterator, get_args
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.methods import (
+    EditMessageMedia,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    SendPhoto,
+    TelegramMethod,
+)
+from aiogram.types import (
+    CallbackQuery,
+    Chat,
+    InlineKeyboardMarkup,
+    Message,
+    PhotoSize,
+    Update,
+    User,
+)
+
+from benchmarks.dataset import DatasetSpec, open_dataset, vocabulary
+from benchmarks.db_bench import summarize
+
+# Bot API methods called while handling the current update
+_update_calls: ContextVar[list[str] | None] = ContextVar("update_calls", default=None)
+
+
+@dataclass
+class Screen:
+    """The menu message a chat currently shows."""
+
+    message_id: int
+    markup: InlineKeyboardMarkup | None
+    photo: bool
+
+
+class StubSession(AiohttpSession):
+    """AiohttpSession that answers Bot API calls locally instead of sending them.
+
+    Session middlewares still run, so the request path up to the network is the
+    production one. Methods that return a Message get a plausible one back, and
+    the last menu shown in each chat is kept in screens.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.screens: dict[int, Screen] = {}
+        self._message_ids = itertools.count(1_000_000)
+
+    async def make_request(
+        self, bot: Bot, method: TelegramMethod[Any], timeout: int | None = None
+    ) -> Any:
+        name = type(method).__name__
+        self.calls[name] += 1
+        calls = _update_calls.get()
+        if calls is not None:
+            calls.append(name)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        returning = method.__returning__
+        if Message not in (returning, *get_args(returning)):
+            return True
+
+        chat_id = int(getattr(method, "chat_id", 0) or 0)
+        edit = isinstance(method, (EditMessageText, EditMessageMedia, EditMessageReplyMarkup))
+        message_id = method.message_id if edit else next(self._message_ids)
+        photo = isinstance(method, (SendPhoto, EditMessageMedia))
+        markup = getattr(method, "reply_markup", None)
+        if isinstance(markup, InlineKeyboardMarkup) or markup is None:
+            self.screens[chat_id] = Screen(message_id, markup, photo)
+        return _message(message_id, chat_id, photo).as_(bot)
+
+
+def _message(message_id: int, chat_id: int, photo: bool, **kwargs: Any) -> Message:
+    return Message(
+        message_id=message_id,
+        date=datetime.datetime.now(),
+        chat=Chat(id=chat_id, type="private"),
+        photo=[PhotoSize(file_id="p", file_unique_id="p", width=1, height=1)] if photo else None,
+        **kwargs,
+    )
+
+
+class VirtualUser:
+    """A private chat that reads its screen and presses buttons on it."""
+
+    _update_ids = itertools.count(1)
+
+    def __init__(self, tg_user_id: int, session: StubSession, rng: random.Random):
+        self.user = User(id=tg_user_id, is_bot=False, first_name="Load")
+        self.session = session
+        self.rng = rng
+
+    @property
+    def screen(self) -> Screen | None:
+        return self.session.screens.get(self.user.id)
+
+    def message(self, text: str) -> Update:
+        update_id = next(self._update_ids)
+        return Update(
+            update_id=update_id,
+            message=_message(update_id, self.user.id, False, from_user=self.user, text=text),
+        )
+
+    def press(self, data: str) -> Update:
+        screen = self.screen
+        update_id = next(self._update_ids)
+        return Update(
+            update_id=update_id,
+            callback_query=CallbackQuery(
+                id=str(update_id),
+                from_user=self.user,
+                chat_instance=str(self.user.id),
+                message=_message(
+                    screen.message_id if screen else 0,
+                    self.user.id,
+                    screen.photo if screen else False,
+                    text=None if screen and screen.photo else "menu",
+                ),
+                data=data,
+            ),
+        )
+
+    def button(self, text: str) -> str | None:
+        """callback_data of the button labelled text on the current screen."""
+        markup = self.screen.markup if self.screen else None
+        for row in markup.inline_keyboard if markup else ():
+            for button in row:
+                if button.text == text and button.callback_data != "noop":
+                    return button.callback_data
+        return None
+
+
+# --- Scenarios: generators of updates, resumed after each one is handled ---
+
+Scenario = Callable[[VirtualUser, list[str]], Iterator[Update]]
+
+
+def browse(user: VirtualUser, words: list[str]) -> Iterator[Update]:
+    """Opens a carousel and pages through it."""
+    yield user.press(user.rng.choice(["book_list", "read_books", "in_process", "favorite_books"]))
+    for _ in range(user.rng.randint(5, 30)):
+        data = user.button("➡️")
+        if data is None:
+            break
+        yield user.press(data)
+    yield user.press("back_main")
+
+
+def toggle(user: VirtualUser, words: list[str]) -> Iterator[Update]:
+    """Opens a book from the library and flips its favourite and status flags."""
+    yield user.press("book_list")
+    for _ in range(user.rng.randint(0, 5)):
+        data = user.button("➡️")
+        if data is None:
+            break
+        yield user.press(data)
+    data = user.button("🔎 Деталі")
+    if data is None:
+        return
+    yield user.press(data)
+    for _ in range(user.rng.randint(1, 4)):
+        label = user.rng.choice(["❤️ Улюблена ↔", "✅ Прочитано ↔", "📕 Хочу прочитати ↔"])
+        data = user.button(label)
+        if data is None:
+            return
+        yield user.press(data)
+    data = user.button("📚 До бібліотеки")
+    if data is not None:
+        yield user.press(data)
+
+
+def add_book(user: VirtualUser, words: list[str]) -> Iterator[Update]:
+    """The four-step add-book dialog."""
+    yield user.press("add_book")
+    yield user.message(" ".join(user.rng.choices(words, k=user.rng.randint(1, 4))).capitalize())
+    yield user.message(" ".join(user.rng.choices(words, k=2)).title())
+    yield user.message(user.rng.choice(words[:50]))
+    yield user.message("пропустити")
+
+
+def search(user: VirtualUser, words: list[str]) -> Iterator[Update]:
+    """/search for a word and a few pages of results."""
+    yield user.message(f"/search {user.rng.choice(words)}")
+    for _ in range(user.rng.randint(0, 5)):
+        data = user.button("➡️")
+        if data is None:
+            break
+        yield user.press(data)
+
+
+SCENARIOS: dict[str, Scenario] = {
+    "browse": browse,
+    "toggle": toggle,
+    "add_book": add_book,
+    "search": search,
+}
+
+
+async def run_scenario(
+    dp: Dispatcher,
+    bot: Bot,
+    users: list[VirtualUser],
+    scenario: Scenario,
+    updates: int,
+    words: list[str],
+) -> dict[str, Any]:
+    latencies: list[float] = []
+    api_calls: Counter[str] = Counter()
+    errors = unhandled = 0
+    budget = itertools.count()
+
+    async def drive(user: VirtualUser) -> None:
+        nonlocal errors, unhandled
+        while True:
+            for update in scenario(user, words):
+                if next(budget) >= updates:
+                    return
+                calls: list[str] = []
+                token = _update_calls.set(calls)
+                started = time.perf_counter()
+                try:
+                    result = await dp.feed_update(bot, update)
+                except Exception:
+                    errors += 1
+                else:
+                    unhandled += result is UNHANDLED
+                finally:
+                    latencies.append(time.perf_counter() - started)
+                    _update_calls.reset(token)
+                api_calls.update(calls)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(drive(user) for user in users))
+    elapsed = time.perf_counter() - started
+    stats = summarize(latencies)
+    del stats["qps"]
+    return {
+        **stats,
+        "updates_per_s": len(latencies) / elapsed,
+        "api_calls_per_update": sum(api_calls.values()) / len(latencies),
+        "errors": errors,
+        "unhandled": unhandled,
+        "api_calls": dict(api_calls.most_common()),
+    }
+
+
+async def main_async(args: argparse.Namespace) -> dict[str, Any]:
+    spec = DatasetSpec(books=args.books, users=args.dataset_users, seed=args.seed)
+    path = args.db or f"/tmp/books_load_{spec.books}_{spec.users}_{spec.seed}.sqlite3"
+    db = open_dataset(path, spec)
+    if args.metrics:
+        # app.metrics decides at import whether to instrument
+        os.environ.setdefault("METRICS_PORT", "9464")
+    # After app.db: these modules import it and must see the benchmark database
+    from app import db_async, logger, metrics
+    from app.fsm_storage import SQLiteStorage, create_dispatcher
+    from app.handlers import router
+    from app.prefetch import prefetcher
+    from app.settings import user_menus
+    from app.throttling import RateLimitMiddleware
+
+    rng = random.Random(args.seed)
+    owners = [
+        row[0]
+        for row in db.get_connection().execute(
+            """
+            SELECT u.tg_user_id FROM user_counters c JOIN users u ON u.id = c.user_id
+            WHERE c.user_id != 0 AND c.lib > 0 ORDER BY c.user_id
+            """
+        )
+    ]
+    # Zipf-ranked: the first words are the common ones
+    words = vocabulary(20_000, random.Random(spec.seed))[:2_000]
+
+    session = StubSession(latency=args.api_latency / 1000)
+    if args.rate_limit:
+        session.middleware(RateLimitMiddleware())
+    bot = Bot(token="42:LOAD-TEST", session=session)
+    dp = create_dispatcher(SQLiteStorage())
+    dp.include_router(router)
+    logger.setup(dp)
+    if args.metrics:
+        metrics.setup(dp, bot)
+    users = [
+        VirtualUser(tg_user_id, session, random.Random(args.seed + i))
+        for i, tg_user_id in enumerate(rng.sample(owners, min(args.users, len(owners))))
+    ]
+    try:
+        # Every chat starts with a menu message, as after /start
+        for user in users:
+            await dp.feed_update(bot, user.message("/start"))
+        report = {}
+        print(
+            f"{'scenario':<10} {'updates':>8} {'upd/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'p99 ms':>8} {'calls/upd':>9} {'errors':>6}"
+        )
+        for name in args.scenarios:
+            result = await run_scenario(dp, bot, users, SCENARIOS[name], args.updates, words)
+            report[name] = result
+            print(
+                f"{name:<10} {result['n']:>8} {result['updates_per_s']:>8.0f} "
+                f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+                f"{result['api_calls_per_update']:>9.2f} {result['errors']:>6}"
+            )
+        print(f"\nprefetch: {prefetcher.stats()}")
+        return {
+            "meta": {
+                "spec": asdict(spec),
+                "users": len(users),
+                "api_latency_ms": args.api_latency,
+                "rate_limit": args.rate_limit,
+                "metrics": args.metrics,
+            },
+            "scenarios": report,
+            "prefetch": prefetcher.stats(),
+        }
+    finally:
+        await db_async.writer.close()
+        await user_menus.close()
+        await dp.storage.close()
+        db_async.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=100_000)
+    parser.add_argument("--dataset-users", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", help="database path (default: per spec in /tmp)")
+    parser.add_argument("--users", type=int, default=200, help="concurrent virtual users")
+    parser.add_argument("--updates", type=int, default=5_000, help="updates per scenario")
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument("--api-latency", type=float, default=0.0, help="ms per Bot API call")
+    parser.add_argument(
+        "--rate-limit", action="store_true", help="apply RateLimitMiddleware to the stub"
+    )
+    parser.add_argument(
+        "--metrics", action="store_true", help="enable app.metrics instrumentation"
+    )
+    parser.add_argument("--out", help="JSON report path")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fp:
+            json.dump(report, fp, indent=2, ensure_ascii=False)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
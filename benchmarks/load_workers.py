@@ -0,0 +1,240 @@
+"""Throughput of the multi-process worker pool by worker count.
+
+Usage:
+    python -m benchmarks.load_workers --books 100000 --workers 1 2 4 --updates 20000
+
+For each worker count this process acts as the front: it starts an
+app.workers.WorkerPool whose workers run the real router from app.handlers
+against the benchmark database, with Bot API calls answered by StubSession
+(see benchmarks.load_handlers). The same synthetic updates (carousel paging,
+/search, favourite toggles that are undone by the next update) are dispatched
+as fast as the pool accepts them, and the pool is closed, which waits until
+every worker has handled everything it was sent. Updates per second over that
+span, and how the updates split between workers, are reported.
+
+Scaling is bounded by the cores available (os.cpu_count() is printed) and by
+SQLite, which serializes the writers of all workers.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from dataclasses import asdict
+from typing import Any, Iterator
+
+from benchmarks.dataset import DatasetSpec, open_dataset, vocabulary
+
+
+def _user(user_id: int) -> dict[str, Any]:
+    return {"id": user_id, "is_bot": False, "first_name": "Load"}
+
+
+def message(update_id: int, user_id: int, text: str) -> dict[str, Any]:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            "text": text,
+        },
+    }
+
+
+def press(update_id: int, user_id: int, data: str) -> dict[str, Any]:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "message": {
+                "message_id": 1,
+                "date": 0,
+                "chat": {"id": user_id, "type": "private"},
+                "text": "menu",
+            },
+            "data": data,
+        },
+    }
+
+
+def session(
+    rng: random.Random, user_id: int, words: list[str], books: int
+) -> Iterator[tuple[str, str]]:
+    """One visit of a user as (kind, payload) pairs; needs no bot replies."""
+    roll = rng.random()
+    if roll < 0.6:
+        scope, opener = rng.choice(
+            [("lib", "book_list"), ("read", "read_books"), ("in", "in_process"), ("fav", "favorite_books")]
+        )
+        yield "press", opener
+        for index in range(1, rng.randint(3, 20)):
+            yield "press", f"{scope}:{index}"
+        yield "press", "back_main"
+    elif roll < 0.85:
+        yield "message", f"/search {rng.choice(words)}"
+        for index in range(1, rng.randint(1, 5)):
+            yield "press", f"search:{index}"
+    else:
+        # The second toggle restores the flag, so repeated runs see the same data
+        book_id = rng.randint(1, books)
+        yield "press", f"favtoggle:{book_id}"
+        yield "press", f"favtoggle:{book_id}"
+
+
+def updates(
+    owners: list[int], words: list[str], books: int, count: int, seed: int
+) -> list[dict[str, Any]]:
+    """count updates from len(owners) users interleaved at random; each user in order."""
+    rng = random.Random(seed)
+    visits = {user_id: session(rng, user_id, words, books) for user_id in owners}
+    result: list[dict[str, Any]] = []
+    while len(result) < count:
+        user_id = rng.choice(owners)
+        step = next(visits[user_id], None)
+        if step is None:
+            visits[user_id] = session(rng, user_id, words, books)
+            step = next(visits[user_id])
+        kind, payload = step
+        update_id = len(result) + 1
+        builder = message if kind == "message" else press
+        result.append(builder(update_id, user_id, payload))
+    return result
+
+
+async def run_pool(
+    command: list[str], workers: int, batch: list[dict[str, Any]]
+) -> dict[str, Any]:
+    from app.workers import WorkerPool
+
+    pool = WorkerPool(command, workers, queue_size=10_000)
+    await pool.start()
+    started = time.perf_counter()
+    try:
+        for update in batch:
+            await pool.dispatch(update)
+    finally:
+        await pool.close()
+    elapsed = time.perf_counter() - started
+    stats = pool.stats()
+    handled = [w.get("handled", 0) for w in stats["workers"]]
+    return {
+        "workers": workers,
+        "seconds": elapsed,
+        "updates_per_s": sum(handled) / elapsed,
+        "handled": handled,
+        "failed": sum(w.get("failed", 0) for w in stats["workers"]),
+        "restarts": stats["restarts"],
+    }
+
+
+async def worker_async(args: argparse.Namespace) -> None:
+    """One pool worker: the production handlers behind a stub Bot API."""
+    spec = DatasetSpec(books=args.books, users=args.dataset_users, seed=args.seed)
+    open_dataset(args.db, spec)
+    from aiogram import Bot
+
+    from app import db_async
+    from app.fsm_storage import SQLiteStorage, create_dispatcher
+    from app.handlers import router
+    from app.id_cache import id_cache
+    from app.prefetch import prefetcher
+    from app.settings import user_menus
+    from app.workers import serve
+    from benchmarks.load_handlers import StubSession
+
+    # As in run.py: other workers change the same books
+    id_cache.enabled = False
+    prefetcher.skip_scopes = {"lib"}
+    bot = Bot(token="42:LOAD-TEST", session=StubSession(latency=args.api_latency / 1000))
+    dp = create_dispatcher(SQLiteStorage())
+    dp.include_router(router)
+    try:
+        await serve(dp, bot)
+    finally:
+        await db_async.writer.close()
+        await user_menus.close()
+        await dp.storage.close()
+        db_async.shutdown()
+
+
+async def main_async(args: argparse.Namespace) -> dict[str, Any]:
+    spec = DatasetSpec(books=args.books, users=args.dataset_users, seed=args.seed)
+    db = open_dataset(args.db, spec)
+    owners = [
+        row[0]
+        for row in db.get_connection().execute(
+            """
+            SELECT u.tg_user_id FROM user_counters c JOIN users u ON u.id = c.user_id
+            WHERE c.user_id != 0 AND c.lib > 0 ORDER BY c.user_id
+            """
+        )
+    ]
+    rng = random.Random(args.seed)
+    owners = rng.sample(owners, min(args.users, len(owners)))
+    words = vocabulary(20_000, random.Random(spec.seed))[:2_000]
+    batch = updates(owners, words, spec.books, args.updates, args.seed)
+    command = [
+        sys.executable, "-m", "benchmarks.load_workers", "--worker",
+        "--books", str(args.books), "--dataset-users", str(args.dataset_users),
+        "--seed", str(args.seed), "--db", args.db, "--api-latency", str(args.api_latency),
+    ]
+
+    print(f"{len(batch)} updates from {len(owners)} users, {os.cpu_count()} CPUs")
+    print(f"{'workers':>7} {'seconds':>8} {'upd/s':>8} {'speedup':>8} {'failed':>6}  per worker")
+    results = []
+    for workers in args.workers:
+        result = await run_pool(command, workers, batch)
+        results.append(result)
+        speedup = result["updates_per_s"] / results[0]["updates_per_s"]
+        print(
+            f"{workers:>7} {result['seconds']:>8.2f} {result['updates_per_s']:>8.0f} "
+            f"{speedup:>7.2f}x {result['failed']:>6}  {result['handled']}"
+        )
+    return {
+        "meta": {
+            "spec": asdict(spec),
+            "users": len(owners),
+            "updates": len(batch),
+            "api_latency_ms": args.api_latency,
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=100_000)
+    parser.add_argument("--dataset-users", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", help="database path (default: per spec in /tmp)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=1_000, help="distinct users sending updates")
+    parser.add_argument("--updates", type=int, default=20_000, help="updates per worker count")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="ms per Bot API call")
+    parser.add_argument("--out", help="JSON report path")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.db = args.db or (
+        f"/tmp/books_load_{args.books}_{args.dataset_users}_{args.seed}.sqlite3"
+    )
+
+    if args.worker:
+        asyncio.run(worker_async(args))
+        return
+    report = asyncio.run(main_async(args))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fp:
+            json.dump(report, fp, indent=2, ensure_ascii=False)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Benchmark for /search (app.db.search_books_page) on a large synthetic library.
+
+Usage:
+    python -m benchmarks.search_fts --books 1000000 --db /tmp/books_bench.sqlite3
+
+The database is generated once (see benchmarks.dataset) and reused on later
+runs with the same path. Titles are drawn from a Zipf-like vocabulary, so the
+query set covers rare, medium and very common terms as well as prefixes.
+"""
+
+import argparse
+import statistics
+import time
+
+from benchmarks.dataset import DatasetSpec, open_dataset
+
+
+def _queries(db) -> dict[str, list[str]]:
+    conn = db.get_connection()
+    words = [
+        row[0]
+        for row in conn.execute(
+            "SELECT term FROM books_fts_vocab WHERE col = 'name' ORDER BY doc DESC, term"
+        )
+    ]
+    return {
+        "common": words[:5],
+        "medium": words[200:205],
+        "rare": words[-5:],
+        "two words": [f"{a} {b}" for a, b in zip(words[10:15], words[300:305])],
+        "prefix": [w[:3] for w in words[500:505]],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=1_000_000)
+    parser.add_argument("--db", default="/tmp/books_bench.sqlite3")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    db = open_dataset(args.db, DatasetSpec(books=args.books, users=1000, seed=args.seed))
+    conn = db.get_connection()
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts_vocab USING fts5vocab(books_fts, col)"
+    )
+    total = conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+    print(f"Library: {total} books\n")
+
+    print(f"{'queries':<10} {'page':>5} {'matches':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for label, queries in _queries(db).items():
+        for index in (0, 50):
+            timings = []
+            matches = 0
+            for _ in range(args.repeat):
+                for query in queries:
+                    started = time.perf_counter()
+                    _, matches = db.search_books_page(query, index)
+                    timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            print(
+                f"{label:<10} {index:>5} {matches:>8} "
+                f"{statistics.median(timings):>8.2f} {p95:>8.2f} {timings[-1]:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,152 @@
 import asyncio
 import os
 import inspect
-from aiogram import Bot, Dispatcher
+import signal
+import sys
+from aiogram import Bot
 from aiogram.exceptions import TelegramRetryAfter, TelegramAPIError
 from dotenv import load_dotenv
-from app.handlers import router
-from app.db import init_db
-from app.logger import logger  # підключаємо логер
 
-# --- Завантажуємо .env ---
+# .env — до імпорту app.*: модулі читають налаштування (BOOKS_DB_PATH,
+# METRICS_PORT, BOT_WORKERS) під час імпорту
 load_dotenv()
+
+from app import metrics, query_log
+from app.handlers import router
+from app.inline import router as inline_router
+from app.transfer import router as transfer_router
+from app.db_async import init_db, check_query_plans, writer, shutdown as shutdown_db
+from app.logger import logger, setup as setup_log_context  # підключаємо логер
+from app.throttling import RateLimitMiddleware
+from app.settings import user_menus
+from app.fsm_storage import SQLiteStorage, create_dispatcher
+from app.id_cache import id_cache
+from app.prefetch import prefetcher
+from app.workers import WORKER_INDEX, WORKERS, WorkerPool, run_polling, serve
+
 TOKEN = os.getenv("BOT_TOKEN")
 
 if not TOKEN:
     logger.error("❌ Не знайдено BOT_TOKEN у .env файлі")
     raise ValueError("Не знайдено BOT_TOKEN у .env файлі")
 
+# --- Режим отримання оновлень: polling (за замовчуванням) або webhook ---
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+
 # --- Головний об’єкт ---
 bot = Bot(token=TOKEN)
-dp = Dispatcher()
+# Ліміти Telegram тримаємо до відправки запиту, а flood control обробляємо на місці;
+# глобальний ліміт (30 повідомлень/с) воркери ділять між собою порівну
+bot.session.middleware(RateLimitMiddleware(global_rate=30.0 / WORKERS))
+# FSM-стани (діалог додавання книги) зберігаються в SQLite з TTL; оновлення
+# різних користувачів обробляються одночасно, одного — по черзі
+dp = create_dispatcher(SQLiteStorage())
+
+
+def log_query_report() -> None:
+    """Найдорожчі SQL-запити в лог (лише з BOOKS_DB_SLOW_MS)."""
+    report = query_log.report()
+    if report:
+        logger.info(report)
+
+
+def setup_dispatcher() -> None:
+    dp.include_router(router)
+    dp.include_router(inline_router)
+    dp.include_router(transfer_router)
+    setup_log_context(dp)
+    if query_log.SLOW_THRESHOLD is not None:
+        # kill -USR1 <pid> — звіт про найдорожчі запити без зупинки бота
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, log_query_report)
+        except (AttributeError, NotImplementedError, RuntimeError):
+            pass
+
+
+async def close_resources(metrics_runner=None):
+    # Закриваємо сесію бота (без помилки, якщо нема атрибуту)
+    try:
+        await bot.session.close()
+    except Exception:
+        pass
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    # Дописуємо чергу змін і відкладені зміни меню до зупинки потоку БД
+    await writer.close()
+    await user_menus.close()
+    await dp.storage.close()
+    shutdown_db()
+    log_query_report()
+
+
+# --- Воркер багатопроцесного режиму ---
+async def run_worker():
+    # Ці ж книги змінюють інші воркери, а їхні хуки кешу сюди не доходять;
+    # сторінки власних scope-ів користувача міняє лише цей воркер
+    id_cache.enabled = False
+    prefetcher.skip_scopes = {"lib"}
+    setup_dispatcher()
+    metrics_runner = None
+    try:
+        if metrics.ENABLED:
+            metrics.setup(dp, bot)
+            metrics_runner = await metrics.start_server()
+        stats = await serve(dp, bot)
+        logger.info(f"Воркер {WORKER_INDEX} зупиняється: {stats}")
+    finally:
+        await close_resources(metrics_runner)
+
+
+# --- Фронт багатопроцесного режиму ---
+async def run_pool():
+    pool = WorkerPool([sys.executable, os.path.abspath(__file__)], WORKERS)
+    await pool.start()
+    # kill -HUP <pid> — по черзі перезапустити воркери (напр. після оновлення коду)
+    restarts: set[asyncio.Task] = set()
+
+    def restart_workers():
+        task = asyncio.create_task(pool.restart())
+        restarts.add(task)
+        task.add_done_callback(restarts.discard)
+
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, restart_workers)
+    except (AttributeError, NotImplementedError, RuntimeError):
+        pass
+    try:
+        if BOT_MODE == "webhook":
+            from app.webhook import run_webhook
+
+            logger.info(f"Бот запускається у режимі webhook з {WORKERS} воркерами...")
+            await run_webhook(
+                dp,
+                bot,
+                host=WEBAPP_HOST,
+                port=WEBAPP_PORT,
+                path=WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                base_url=WEBHOOK_BASE_URL,
+                pool=pool,
+            )
+        else:
+            logger.info(f"Бот запускається з {WORKERS} воркерами...")
+            await run_polling(pool, bot, dp.resolve_used_update_types())
+    finally:
+        await pool.close()
+        logger.info(f"Воркери зупинено: {pool.stats()}")
 
 
 # --- Запуск ---
 async def main():
+    if WORKER_INDEX is not None:
+        await run_worker()
+        return
+
     # Ініціалізація бази даних.
     # Підтримуємо і синхронну, і асинхронну реалізацію init_db.
     try:
@@ -36,25 +160,49 @@ async def main():
         logger.exception(f"Помилка ініціалізації БД: {e}")
         raise
 
-    dp.include_router(router)
+    # Запити, що скочуються у повний скан або сортування temp B-tree
+    for sql, plan in await check_query_plans():
+        logger.warning(f"Запит без відповідного індексу: {sql} -> {plan}")
+
+    setup_dispatcher()
+    metrics_runner = None
     try:
-        logger.info("Бот запускається...")
-        # Показуємо користувачам reply-клавіатуру при старті
-        await dp.start_polling(bot, skip_updates=True)
+        if WORKERS > 1:
+            # Міграції вже виконано тут; оновлення обробляють воркери
+            await run_pool()
+            return
+        if metrics.ENABLED:
+            metrics.setup(dp, bot)
+            metrics_runner = await metrics.start_server()
+        if BOT_MODE == "webhook":
+            from app.webhook import run_webhook
+
+            logger.info("Бот запускається у режимі webhook...")
+            await run_webhook(
+                dp,
+                bot,
+                host=WEBAPP_HOST,
+                port=WEBAPP_PORT,
+                path=WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                base_url=WEBHOOK_BASE_URL,
+            )
+        else:
+            logger.info("Бот запускається...")
+            # Показуємо користувачам reply-клавіатуру при старті.
+            # Кожне оновлення — окрема задача; порядок у межах користувача
+            # тримає UserEventIsolation
+            await dp.start_polling(bot, skip_updates=True, handle_as_tasks=True)
     except TelegramRetryAfter as e:
-        logger.warning(f"Отримали Flood Control. Спимо {e.retry_after} сек...")
-        await asyncio.sleep(e.retry_after)
-        return await main()  # пробуємо ще раз
+        # Запити повідомлень повторює RateLimitMiddleware; сюди доходять лише
+        # вичерпані повтори або службові виклики — бот не перезапускаємо
+        logger.error(f"Flood Control без успішного повтору: {e.retry_after} сек")
     except TelegramAPIError as e:
         logger.error(f"Помилка Telegram API: {e}")
     except Exception as e:
         logger.exception(f"Непередбачена помилка: {e}")
     finally:
-        # Закриваємо сесію бота (без помилки, якщо нема атрибуту)
-        try:
-            await bot.session.close()
-        except Exception:
-            pass
+        await close_resources(metrics_runner)
         logger.info("Бот завершив роботу")
 
 
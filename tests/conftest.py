@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+
+# До імпорту app.*: шлях до БД, файл логу і токен читаються під час імпорту
+_TMP = tempfile.mkdtemp(prefix="books_tests_")
+os.environ["BOOKS_DB_PATH"] = os.path.join(_TMP, "books.sqlite3")
+os.environ["LOG_FILE"] = os.path.join(_TMP, "bot.log")
+os.environ.setdefault("BOT_TOKEN", "42:TEST")
+os.environ.pop("METRICS_PORT", None)
+os.environ.pop("BOT_WORKERS", None)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Окремий файл БД на тест; з'єднання app.db відкривається заново."""
+    from app import db
+
+    path = str(tmp_path / "books.sqlite3")
+    monkeypatch.setattr(db, "_DB_PATH", path)
+    monkeypatch.setattr(db, "_connection", None)
+    # Кеш ID спільний на процес: записи іншої БД тут застарілі
+    db.id_cache.clear()
+    yield path
+    if db._connection is not None:
+        db._connection.close()
@@ -0,0 +1,110 @@
+from app import db
+
+_RECOUNT = """
+    SELECT b.user_id,
+           COUNT(*),
+           SUM(b.is_favorite = 1),
+           SUM(EXISTS (SELECT 1 FROM book_statuses s WHERE s.book_id = b.id AND s.status = 'in')),
+           SUM(EXISTS (SELECT 1 FROM book_statuses s WHERE s.book_id = b.id AND s.status = 'read'))
+    FROM books b
+    GROUP BY b.user_id
+"""
+
+
+def _counters(conn):
+    rows = conn.execute("SELECT user_id, lib, fav, st_in, st_read FROM user_counters")
+    # Порожній рядок лічильників рівнозначний його відсутності
+    return {row[0]: tuple(row[1:]) for row in rows if any(row[1:])}
+
+
+def _recount(conn):
+    expected = {row[0]: tuple(row[1:]) for row in conn.execute(_RECOUNT)}
+    totals = tuple(sum(column) for column in zip(*expected.values())) or (0, 0, 0, 0)
+    if any(totals):
+        expected[db.GLOBAL_COUNTERS_ID] = totals
+    return expected
+
+
+def _assert_exact(conn):
+    assert _counters(conn) == _recount(conn)
+
+
+def _seed():
+    db.init_db()
+    db.import_books(
+        1,
+        [
+            ("Кобзар", "Шевченко", "поезія", None, 1, "in"),
+            ("Дюна", "Герберт", "фантастика", None, 0, "read"),
+            ("Солярис", "Лем", "фантастика", None, 1, None),
+        ],
+    )
+    db.import_books(2, [("Тіні забутих предків", "Коцюбинський", "проза", None, 0, "in")])
+    return db.get_connection()
+
+
+def _book_id(conn, name):
+    return conn.execute("SELECT id FROM books WHERE name = ?", (name,)).fetchone()[0]
+
+
+def test_counters_follow_books_insert_and_delete(db_path):
+    conn = _seed()
+    _assert_exact(conn)
+
+    db.add_book_for_user(3, "Лісова пісня", "Українка", "драма")
+    _assert_exact(conn)
+    # Каскад видаляє статуси книги разом із нею
+    assert db.delete_book(_book_id(conn, "Кобзар"))
+    _assert_exact(conn)
+    assert db.delete_book(_book_id(conn, "Лісова пісня"))
+    _assert_exact(conn)
+
+
+def test_counters_follow_favorite_and_status_changes(db_path):
+    conn = _seed()
+    dune = _book_id(conn, "Дюна")
+
+    db.toggle_favorite(dune)
+    _assert_exact(conn)
+    db.toggle_status(dune, "in")
+    _assert_exact(conn)
+    db.toggle_status(dune, "in")
+    _assert_exact(conn)
+
+    conn.execute("UPDATE book_statuses SET status = 'in' WHERE book_id = ?", (dune,))
+    conn.commit()
+    _assert_exact(conn)
+    conn.execute("UPDATE book_statuses SET status = 'read' WHERE book_id = ?", (dune,))
+    conn.commit()
+    _assert_exact(conn)
+
+
+def test_counters_follow_owner_change(db_path):
+    conn = _seed()
+    new_owner = db.ensure_user(3)
+
+    conn.execute(
+        "UPDATE books SET user_id = ? WHERE id = ?", (new_owner, _book_id(conn, "Кобзар"))
+    )
+    conn.commit()
+    _assert_exact(conn)
+    # Зміна власника разом з обраним
+    conn.execute(
+        "UPDATE books SET user_id = ?, is_favorite = 0 WHERE id = ?",
+        (new_owner, _book_id(conn, "Солярис")),
+    )
+    conn.commit()
+    _assert_exact(conn)
+
+
+def test_counters_backfilled_for_existing_database(db_path):
+    conn = _seed()
+    # База, створена до появи лічильників
+    conn.execute("DROP TABLE user_counters")
+    conn.commit()
+
+    db.init_db()
+
+    _assert_exact(conn)
+    db.toggle_favorite(_book_id(conn, "Дюна"))
+    _assert_exact(conn)
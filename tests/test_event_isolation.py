@@ -0,0 +1,128 @@
+import asyncio
+from typing import Any
+
+from aiogram import Bot, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+
+from app import inline
+from app.fsm_storage import UserEventIsolation, create_dispatcher
+
+
+class RecordingSession(AiohttpSession):
+    """Bot API без мережі: запам'ятовує виклики і відповідає True."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls: list[Any] = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls.append(method)
+        return True
+
+
+def _message(update_id: int, user_id: int) -> Update:
+    return Update.model_validate(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+                "text": "hi",
+            },
+        }
+    )
+
+
+def _inline(update_id: int, user_id: int, query: str) -> Update:
+    return Update.model_validate(
+        {
+            "update_id": update_id,
+            "inline_query": {
+                "id": str(update_id),
+                "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+                "query": query,
+                "offset": "",
+            },
+        }
+    )
+
+
+def test_run_dispatcher_uses_user_isolation():
+    import run
+
+    assert isinstance(run.dp.fsm.events_isolation, UserEventIsolation)
+
+
+def test_same_user_updates_do_not_overlap():
+    events: list[tuple[str, int, int]] = []
+
+    async def scenario() -> UserEventIsolation:
+        dp = create_dispatcher(MemoryStorage())
+        isolation = dp.fsm.events_isolation
+        router = Router()
+
+        @router.message()
+        async def slow(message) -> None:
+            events.append(("start", message.from_user.id, message.message_id))
+            await asyncio.sleep(0.05)
+            events.append(("end", message.from_user.id, message.message_id))
+
+        dp.include_router(router)
+        bot = Bot(token="42:TEST")
+        try:
+            await asyncio.gather(
+                dp.feed_update(bot, _message(1, 100)),
+                dp.feed_update(bot, _message(2, 100)),
+                dp.feed_update(bot, _message(3, 200)),
+            )
+        finally:
+            await bot.session.close()
+        return isolation
+
+    isolation = asyncio.run(scenario())
+
+    same_user = [(kind, update) for kind, user, update in events if user == 100]
+    assert same_user in (
+        [("start", 1), ("end", 1), ("start", 2), ("end", 2)],
+        [("start", 2), ("end", 2), ("start", 1), ("end", 1)],
+    )
+    # Інший користувач не чекає першого
+    assert events.index(("start", 200, 3)) < events.index(("end", 100, 1))
+    assert isolation.active_users == 0
+
+
+def test_inline_queries_bypass_user_lock(monkeypatch):
+    searches: list[str] = []
+
+    async def slow_search(user_id, query, limit, before_id=None):
+        searches.append(query)
+        await asyncio.sleep(0.2)
+        return []
+
+    monkeypatch.setattr(inline, "search_user_books", slow_search)
+
+    async def scenario() -> tuple[list[Any], float]:
+        dp = create_dispatcher(MemoryStorage())
+        dp.include_router(inline.router)
+        session = RecordingSession()
+        bot = Bot(token="42:TEST", session=session)
+        started = asyncio.get_running_loop().time()
+        try:
+            first = asyncio.create_task(dp.feed_update(bot, _inline(1, 100, "гар")))
+            await asyncio.sleep(0.05)
+            await dp.feed_update(bot, _inline(2, 100, "гаррі"))
+            await first
+        finally:
+            await bot.session.close()
+        return session.calls, asyncio.get_running_loop().time() - started
+
+    calls, elapsed = asyncio.run(scenario())
+
+    # Другий запит не чекав першого, а скасував його пошук
+    assert searches == ["гар", "гаррі"]
+    assert [call.inline_query_id for call in calls] == ["2"]
+    assert elapsed < 0.35
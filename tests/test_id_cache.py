@@ -0,0 +1,74 @@
+from app import db
+from app.id_cache import GLOBAL
+
+
+def _sql_ids(tg_user_id: int, scope: str) -> list[int]:
+    where = {
+        "fav": "b.is_favorite = 1",
+        "in": "EXISTS (SELECT 1 FROM book_statuses s WHERE s.book_id = b.id AND s.status = 'in')",
+        "read": "EXISTS (SELECT 1 FROM book_statuses s WHERE s.book_id = b.id AND s.status = 'read')",
+    }[scope]
+    rows = db.get_connection().execute(
+        f"""
+        SELECT b.id FROM books b JOIN users u ON u.id = b.user_id
+        WHERE u.tg_user_id = ? AND {where}
+        ORDER BY b.created_at DESC, b.id DESC
+        """,
+        (tg_user_id,),
+    )
+    return [row[0] for row in rows]
+
+
+def _cached(key) -> list[int] | None:
+    ids = db.id_cache._entries.get(key)
+    return list(ids) if ids is not None else None
+
+
+def _library(count: int) -> list[int]:
+    ids = [db.add_book_for_user(7, f"Книга {i}", "Автор", "Жанр") for i in range(count)]
+    # Різні дати додавання, не в порядку id: позицію визначає created_at
+    conn = db.get_connection()
+    for book_id, day in zip(ids, [3, 1, 4, 1, 5, 9, 2, 6][:count]):
+        conn.execute(
+            "UPDATE books SET created_at = datetime('2024-01-01', ?) WHERE id = ?",
+            (f"+{day} days", book_id),
+        )
+    conn.commit()
+    return ids
+
+
+def test_toggles_update_cached_scopes_in_place(db_path):
+    db.init_db()
+    ids = _library(8)
+    for book_id in ids[::2]:
+        db.toggle_favorite(book_id)
+        db.toggle_status(book_id, "in")
+    db.get_favorites_page(7, 0)
+    db.get_status_page(7, "in", 0)
+    db.get_status_page(7, "read", 0)
+
+    for book_id in ids[1:4]:
+        db.toggle_favorite(book_id)
+        db.toggle_status(book_id, "read")
+    db.toggle_favorite(ids[0])
+    db.toggle_status(ids[2], "read")
+
+    for scope in ("fav", "in", "read"):
+        assert _cached((7, scope)) == _sql_ids(7, scope), scope
+
+
+def test_add_and_delete_update_cached_library(db_path):
+    db.init_db()
+    ids = _library(4)
+    db.get_lib_page(0)
+    db.delete_book(ids[1])
+    new_id = db.add_book_for_user(7, "Нова", "Автор", "Жанр")
+
+    expected = [
+        row[0]
+        for row in db.get_connection().execute(
+            "SELECT id FROM books ORDER BY created_at DESC, id DESC"
+        )
+    ]
+    assert _cached((GLOBAL, "lib")) == expected
+    assert expected[0] == new_id
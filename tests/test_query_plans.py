@@ -0,0 +1,40 @@
+import sqlite3
+
+from app import db
+
+
+def test_read_queries_use_indexes(db_path):
+    db.init_db()
+    assert db.check_query_plans() == []
+
+
+def test_init_db_migrates_legacy_books_table(db_path):
+    # Схема до появи is_favorite
+    legacy = sqlite3.connect(db_path)
+    legacy.executescript(
+        """
+        CREATE TABLE users (id INTEGER PRIMARY KEY, tg_user_id INTEGER UNIQUE NOT NULL);
+        CREATE TABLE books (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            author TEXT NOT NULL,
+            genre TEXT NOT NULL,
+            photo_id TEXT,
+            status TEXT NOT NULL DEFAULT 'my',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT INTO users (id, tg_user_id) VALUES (1, 100);
+        INSERT INTO books (user_id, name, author, genre, status) VALUES (1, 'A', 'B', 'C', 'read');
+        """
+    )
+    legacy.close()
+
+    db.init_db()
+
+    conn = db.get_connection()
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(books)")]
+    assert "is_favorite" in columns
+    indexes = [row[1] for row in conn.execute("PRAGMA index_list(books)")]
+    assert "idx_books_user_fav_created" in indexes
+    assert db.check_query_plans() == []
@@ -0,0 +1,69 @@
+from app import db
+
+
+def _titles(books):
+    return [book["name"] for book in books]
+
+
+def test_user_search_sees_only_own_books(db_path):
+    db.init_db()
+    db.import_books(1, [("Гаррі Поттер", "Ролінг", "фентезі", None, 0, None)])
+    db.import_books(2, [("Гаррі і u1", "Інший", "фентезі", None, 0, None)])
+
+    assert _titles(db.search_user_books(1, "гар", 10)) == ["Гаррі Поттер"]
+    assert _titles(db.search_user_books(2, "гар", 10)) == ["Гаррі і u1"]
+    # Службовий токен власника не шукається як слово
+    book, total = db.search_books_page("u1", 0)
+    assert (book["name"], total) == ("Гаррі і u1", 1)
+    assert db.search_user_books(3, "гар", 10) == []
+
+
+def test_search_index_rebuilt_with_owner_column(db_path):
+    db.init_db()
+    db.import_books(1, [("Кобзар", "Шевченко", "поезія", None, 0, None)])
+    conn = db.get_connection()
+    # Індекс і тригери у вигляді до появи fts_owner
+    conn.executescript(
+        """
+        DROP TRIGGER trg_books_fts_insert;
+        DROP TRIGGER trg_books_fts_delete;
+        DROP TRIGGER trg_books_fts_update;
+        DROP TABLE books_fts;
+        CREATE VIRTUAL TABLE books_fts USING fts5(
+            name, author, genre, content = 'books', content_rowid = 'id'
+        );
+        INSERT INTO books_fts (books_fts) VALUES ('rebuild');
+        """
+    )
+
+    db.init_db()
+
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(books_fts)")]
+    assert "fts_owner" in columns
+    assert _titles(db.search_user_books(1, "кобз", 10)) == ["Кобзар"]
+    db.import_books(1, [("Кобза", "Автор", "музика", None, 0, None)])
+    assert _titles(db.search_user_books(1, "кобз", 10)) == ["Кобза", "Кобзар"]
+    # Падає, якщо індекс розійшовся з таблицею books
+    conn.execute("INSERT INTO books_fts (books_fts) VALUES ('integrity-check')")
+
+
+def test_search_past_limit_is_capped(db_path, monkeypatch):
+    monkeypatch.setattr(db, "SEARCH_LIMIT", 3)
+    db.init_db()
+    db.import_books(1, [(f"Дюна {i}", "Герберт", "фантастика", None, 0, None) for i in range(5)])
+    db.import_books(1, [("Дюна Дюна", "Герберт", "фантастика", None, 0, None)])
+
+    # Понад ліміт ранжуються лише найновіші збіги, лічильник — SEARCH_LIMIT + 1
+    book, total = db.search_books_page("дюна", 0)
+    assert (book["name"], total) == ("Дюна Дюна", 4)
+    assert db.search_books_page("дюна", 3) == (None, 4)
+
+
+def test_search_within_limit_ranks_all_matches(db_path):
+    db.init_db()
+    db.import_books(1, [("Дюна Дюна", "Герберт", "фантастика", None, 0, None)])
+    db.import_books(1, [(f"Дюна {i}", "Герберт", "фантастика", None, 0, None) for i in range(5)])
+
+    book, total = db.search_books_page("дюна", 0)
+    assert (book["name"], total) == ("Дюна Дюна", 6)
+    assert db.search_books_page("дюна", 5)[0]["name"].startswith("Дюна")
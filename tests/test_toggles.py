@@ -0,0 +1,47 @@
+from app import db
+
+
+def _statements(fn, *args):
+    conn = db.get_connection()
+    statements: list[str] = []
+    conn.set_trace_callback(statements.append)
+    try:
+        result = fn(*args)
+    finally:
+        conn.set_trace_callback(None)
+    # Без керування транзакцією; тригери повторюють у трасі текст запиту,
+    # що їх запустив, тому рахуємо різні запити
+    return result, [
+        sql for sql in dict.fromkeys(statements)
+        if not sql.lstrip().upper().startswith(("BEGIN", "COMMIT", "SAVEPOINT", "RELEASE", "--"))
+    ]
+
+
+def test_toggle_status_returns_view_in_two_statements(db_path):
+    db.init_db()
+    book_id = db.add_book_for_user(7, "Кобзар", "Шевченко", "поезія")
+
+    book, statements = _statements(db.toggle_status, book_id, "in")
+    assert (book["id"], book["tg_user_id"], book["statuses"]) == (book_id, 7, ["in"])
+    assert len(statements) == 2
+
+    book, statements = _statements(db.toggle_status, book_id, "read")
+    assert book["statuses"] == ["read"]
+    assert len(statements) == 2
+
+    # Вимкнення — одним DELETE … RETURNING
+    book, statements = _statements(db.toggle_status, book_id, "read")
+    assert book["statuses"] == []
+    assert len(statements) == 1
+
+    assert db.list_book_statuses(book_id) == []
+    assert db.toggle_status(book_id + 1, "in") is None
+
+
+def test_toggle_favorite_is_one_statement(db_path):
+    db.init_db()
+    book_id = db.add_book_for_user(7, "Кобзар", "Шевченко", "поезія")
+
+    book, statements = _statements(db.toggle_favorite, book_id)
+    assert book["is_favorite"] == 1
+    assert len(statements) == 1
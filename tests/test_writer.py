@@ -0,0 +1,92 @@
+import asyncio
+import sqlite3
+import time
+
+from app import db, db_async
+
+
+def _names(db_path):
+    # Окреме з'єднання бачить лише закомічене
+    conn = sqlite3.connect(db_path)
+    try:
+        return sorted(row[0] for row in conn.execute("SELECT name FROM books"))
+    finally:
+        conn.close()
+
+
+def _insert_then_fail(cur, name):
+    cur.execute(
+        "INSERT INTO books (user_id, name, author, genre) VALUES (?, ?, '', '')",
+        (db._ensure_user(cur, 1), name),
+    )
+    raise ValueError(name)
+
+
+def test_failing_op_rolls_back_only_its_savepoint(db_path):
+    db.init_db()
+    writer = db_async.writer
+
+    async def main():
+        batches = writer.batches
+        try:
+            return await asyncio.gather(
+                db_async.add_book_for_user(1, "Кобзар", "Шевченко", "поезія"),
+                writer.submit(_insert_then_fail, "Зламана"),
+                db_async.add_book_for_user(1, "Дюна", "Герберт", "фантастика"),
+                return_exceptions=True,
+            ), writer.batches - batches
+        finally:
+            await writer.close()
+
+    (first, error, second), batches = asyncio.run(main())
+
+    assert batches == 1
+    assert isinstance(first, int) and isinstance(second, int)
+    assert isinstance(error, ValueError)
+    assert _names(db_path) == ["Дюна", "Кобзар"]
+
+
+def test_awaited_write_is_visible_to_next_read(db_path):
+    db.init_db()
+
+    async def main():
+        try:
+            book_id = await db_async.add_book_for_user(1, "Кобзар", "Шевченко", "поезія")
+            # Наступне читання одразу після await, без очікування пакета
+            return (
+                await db_async.get_book(book_id),
+                await db_async.count_user_books(1),
+                _names(db_path),
+            )
+        finally:
+            await db_async.writer.close()
+
+    book, count, committed = asyncio.run(main())
+
+    assert book["name"] == "Кобзар"
+    assert count == 1
+    assert committed == ["Кобзар"]
+
+
+def test_close_flushes_queued_ops(db_path, monkeypatch):
+    db.init_db()
+    writer = db_async.writer
+    # Пакет інакше чекав би довше за весь тест
+    monkeypatch.setattr(writer, "max_delay", 10.0)
+
+    async def main():
+        pending = [
+            asyncio.create_task(db_async.add_book_for_user(1, name, "Автор", "жанр"))
+            for name in ("Кобзар", "Дюна", "Солярис")
+        ]
+        await asyncio.sleep(0)
+        started = time.perf_counter()
+        await writer.close()
+        elapsed = time.perf_counter() - started
+        return [task.done() for task in pending], elapsed
+
+    done, elapsed = asyncio.run(main())
+
+    assert done == [True, True, True]
+    assert elapsed < 1.0
+    assert _names(db_path) == ["Дюна", "Кобзар", "Солярис"]